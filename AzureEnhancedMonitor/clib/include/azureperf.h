@@ -16,6 +16,8 @@
 #ifndef AZURE_PERF
 #define AZURE_PERF
 
+#include <sys/types.h>
+
 /*All the strings are utf-8 encoded*/
 
 /*The max buf size for all string*/
@@ -48,6 +50,19 @@
 #define AP_ERR_INVALID_REFRESH_INTERVAL     (-17)
 #define AP_ERR_INVALID_TIMESTAMP            (-18)
 #define AP_ERR_INVALID_MACHINE_NAME         (-19)
+#define AP_ERR_INVALID_TABLE                (-20)
+#define AP_ERR_TABLE_BUSY                   (-21)
+#define AP_ERR_TABLE_STALE                  (-22)
+
+#define AP_TABLE_MAGIC      (0x43504141) /*"AAPC"*/
+#define AP_TABLE_VERSION    (2)
+#define AP_TABLE_RETRY_MAX  (100)
+/*
+ * The writer updates the text file right before the table. A text file that
+ * is newer than the table by more than this many seconds means the table is
+ * not written anymore.
+ */
+#define AP_TABLE_MAX_LAG    (10)
 
 
 typedef struct 
@@ -70,12 +85,33 @@ typedef struct
     
 } perf_counter;
 
+/*
+ * The optional memory mapped counter table is this header followed by
+ * PERF_COUNT_MAX perf_counter. The writer makes generation odd before it
+ * changes the table and even again afterwards, a reader retries until it
+ * copied the counters between two reads of the same even generation.
+ */
+typedef struct
+{
+    unsigned int    magic;
+    unsigned int    version;
+    unsigned int    generation;
+    unsigned int    len;
+    unsigned int    counter_size;
+    unsigned int    updated; /*Seconds since the epoch of the last write*/
+    unsigned int    reserved[10];
+} ap_table_header;
+
 typedef struct
 {
     perf_counter    buf[PERF_COUNT_MAX]; 
     int             len; 
     int             err;
     char            *ap_file;
+    char            *ap_table_file;
+    void            *table;
+    dev_t           table_dev;
+    ino_t           table_ino;
 } ap_handler;
 
 ap_handler* ap_open();
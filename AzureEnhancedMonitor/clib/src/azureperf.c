@@ -18,6 +18,12 @@
 #include <stdlib.h> 
 #include <string.h> 
 #include <errno.h>
+#include <fcntl.h>
+#include <sched.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <time.h>
 #include <azureperf.h> 
 
 #define INTMIN(X, Y) (((X) < (Y)) ? (X) : (Y))
@@ -31,17 +37,31 @@
 
 static char FIELD_SEPRATOR = ';';
 static char DEFAULT_AP_FILE[] = "/var/lib/AzureEnhancedMonitor/PerfCounters";
+static char DEFAULT_AP_TABLE_FILE[] = "/var/lib/AzureEnhancedMonitor/PerfCounterTable";
+
+#define AP_TABLE_SIZE (sizeof(ap_table_header) + sizeof(perf_counter) * PERF_COUNT_MAX)
 
 ap_handler* ap_open()
 {
     ap_handler *handler = malloc(sizeof(ap_handler));
-    handler->ap_file = DEFAULT_AP_FILE;
     memset(handler, 0, sizeof(ap_handler));
+    handler->ap_file = DEFAULT_AP_FILE;
+    handler->ap_table_file = DEFAULT_AP_TABLE_FILE;
     return handler;
 }
 
+void unmap_table(ap_handler *handler)
+{
+    if(handler->table)
+    {
+        munmap(handler->table, AP_TABLE_SIZE);
+        handler->table = 0;
+    }
+}
+
 void ap_close(ap_handler *handler)
 {
+    unmap_table(handler);
     free(handler);
 }
 
@@ -284,6 +304,111 @@ EXIT:
     return ret;
 }
 
+int map_table(ap_handler *handler)
+{
+    int fd = -1;
+    struct stat st;
+    void *table = MAP_FAILED;
+
+    if(stat(handler->ap_table_file, &st) != 0)
+    {
+        unmap_table(handler);
+        return errno;
+    }
+    //Keep the mapping until the file is removed or replaced
+    if(handler->table && 
+            st.st_dev == handler->table_dev && 
+            st.st_ino == handler->table_ino)
+    {
+        return 0;
+    }
+    unmap_table(handler);
+    fd = open(handler->ap_table_file, O_RDONLY);
+    if(fd < 0)
+    {
+        return errno;
+    }
+    if(fstat(fd, &st) == 0 && st.st_size >= AP_TABLE_SIZE)
+    {
+        table = mmap(0, AP_TABLE_SIZE, PROT_READ, MAP_SHARED, fd, 0);
+    }
+    close(fd);
+    if(table == MAP_FAILED)
+    {
+        return AP_ERR_INVALID_TABLE;
+    }
+    handler->table = table;
+    handler->table_dev = st.st_dev;
+    handler->table_ino = st.st_ino;
+    return 0;
+}
+
+int is_table_stale(ap_handler *handler, unsigned int updated)
+{
+    struct stat st;
+
+    if(handler->ap_file == 0 || stat(handler->ap_file, &st) != 0)
+    {
+        return 0;
+    }
+    return st.st_mtime > (time_t)updated + AP_TABLE_MAX_LAG;
+}
+
+int read_pc_from_table(ap_handler *handler)
+{
+    volatile ap_table_header *header = 0;
+    perf_counter *counters = 0;
+    unsigned int generation = 0;
+    unsigned int len = 0;
+    unsigned int updated = 0;
+    int retry = 0;
+    int ret = 0;
+
+    ret = map_table(handler);
+    if(ret)
+    {
+        return ret;
+    }
+    header = (volatile ap_table_header*)handler->table;
+    counters = (perf_counter*)((char*)handler->table + sizeof(ap_table_header));
+    if(header->magic != AP_TABLE_MAGIC || 
+            header->version != AP_TABLE_VERSION ||
+            header->counter_size != sizeof(perf_counter))
+    {
+        return AP_ERR_INVALID_TABLE;
+    }
+
+    for(; retry < AP_TABLE_RETRY_MAX; retry++)
+    {
+        generation = header->generation;
+        __sync_synchronize();
+        if(generation & 1)
+        {
+            //The writer is changing the table
+            sched_yield();
+            continue;
+        }
+        len = header->len;
+        updated = header->updated;
+        if(len > PERF_COUNT_MAX)
+        {
+            return AP_ERR_INVALID_TABLE;
+        }
+        memcpy(handler->buf, counters, sizeof(perf_counter) * len);
+        __sync_synchronize();
+        if(generation == header->generation)
+        {
+            if(is_table_stale(handler, updated))
+            {
+                return AP_ERR_TABLE_STALE;
+            }
+            handler->len = len;
+            return 0;
+        }
+    }
+    return AP_ERR_TABLE_BUSY;
+}
+
 void ap_refresh(ap_handler *handler)
 {
     FILE *fp = 0;
@@ -292,6 +417,15 @@ void ap_refresh(ap_handler *handler)
     //Reset handler 
     memset(handler->buf, 0, sizeof(perf_counter) * PERF_COUNT_MAX);
     handler->len = 0;
+
+    //Prefer the counter table, fall back to the text file without a valid
+    //and up to date table
+    if(handler->ap_table_file && read_pc_from_table(handler) == 0)
+    {
+        goto EXIT;
+    }
+    memset(handler->buf, 0, sizeof(perf_counter) * PERF_COUNT_MAX);
+    handler->len = 0;
    
     errno = 0;
     fp = fopen(handler->ap_file, "r");
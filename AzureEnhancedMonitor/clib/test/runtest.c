@@ -16,9 +16,11 @@
 
 #include <stdio.h>
 #include <string.h>
+#include <time.h>
 #include <azureperf.h> 
 
 static const char default_input[] = "./test/cases/positive_case";
+static const char table_output[] = "./bin/PerfCounterTable";
 
 int main(int argc, char ** argv)
 {
@@ -29,6 +31,8 @@ int main(int argc, char ** argv)
     }
     printf("Parsing perf counters from: %s\n", ap_file);
     run_test(ap_file);
+    printf("Reading perf counters from table: %s\n", table_output);
+    run_table_test(ap_file);
 }
 
 void print_counter(perf_counter *pc)
@@ -63,6 +67,7 @@ int run_test(char* ap_file)
 
     handler = ap_open();
     handler->ap_file = ap_file;
+    handler->ap_table_file = 0;
     ap_refresh(handler);
     if(handler->err)
     {
@@ -216,3 +221,97 @@ EXIT:
     return ret;
 }
 
+
+int write_table(ap_handler *text, unsigned int generation, 
+        unsigned int len, unsigned int updated)
+{
+    FILE *fp = 0;
+    ap_table_header header;
+    char tmp_path[256];
+
+    memset(&header, 0, sizeof(ap_table_header));
+    header.magic = AP_TABLE_MAGIC;
+    header.version = AP_TABLE_VERSION;
+    header.generation = generation;
+    header.len = len;
+    header.counter_size = sizeof(perf_counter);
+    header.updated = updated;
+
+    //Replace the file like a new writer would, readers have to remap it
+    snprintf(tmp_path, sizeof(tmp_path), "%s.tmp", table_output);
+    fp = fopen(tmp_path, "w");
+    if(0 == fp)
+    {
+        return -1;
+    }
+    fwrite(&header, sizeof(ap_table_header), 1, fp);
+    fwrite(text->buf, sizeof(perf_counter), PERF_COUNT_MAX, fp);
+    fclose(fp);
+    return rename(tmp_path, table_output);
+}
+
+int run_table_test(char* ap_file)
+{
+    int ret = 0;
+    ap_handler *text = 0;
+    ap_handler *handler = 0;
+
+    text = ap_open();
+    text->ap_file = ap_file;
+    text->ap_table_file = 0;
+    ap_refresh(text);
+
+    //A consistent table is read without the text file
+    write_table(text, 2, text->len, (unsigned int)time(0));
+    handler = ap_open();
+    handler->ap_file = "./bin/no_such_file";
+    handler->ap_table_file = (char*)table_output;
+    ap_refresh(handler);
+    if(handler->err || handler->len != text->len ||
+            memcmp(handler->buf, text->buf, sizeof(perf_counter) * text->len))
+    {
+        printf("Table mismatch, error code:%d\n", handler->err);
+        ret = -1;
+        goto EXIT;
+    }
+
+    //A replaced table is mapped again
+    write_table(text, 2, 1, (unsigned int)time(0));
+    ap_refresh(handler);
+    if(handler->err || handler->len != 1)
+    {
+        printf("Replaced table not remapped, error code:%d\n", handler->err);
+        ret = -1;
+        goto EXIT;
+    }
+    ap_close(handler);
+
+    //A table the writer is changing falls back to the text file
+    write_table(text, 3, 1, (unsigned int)time(0));
+    handler = ap_open();
+    handler->ap_file = ap_file;
+    handler->ap_table_file = (char*)table_output;
+    ap_refresh(handler);
+    if(handler->err || handler->len != text->len)
+    {
+        printf("No fallback to text file, error code:%d\n", handler->err);
+        ret = -1;
+        goto EXIT;
+    }
+
+    //So does a table the writer stopped updating
+    write_table(text, 2, 1, 0);
+    ap_refresh(handler);
+    if(handler->err || handler->len != text->len)
+    {
+        printf("No fallback from stale table, error code:%d\n", handler->err);
+        ret = -1;
+        goto EXIT;
+    }
+    printf("Found counters in table:%d\n", text->len);
+
+EXIT:
+    ap_close(handler);
+    ap_close(text);
+    return ret;
+}
@@ -15,10 +15,14 @@
 
 import os
 import re
+import errno
 import socket
 import traceback
 import time
 import datetime
+import mmap
+import struct
+import threading
 import psutil
 import urlparse
 import xml.dom.minidom as minidom
@@ -30,6 +34,7 @@ FAILED_TO_RETRIEVE_MDS_DATA="(03100)Failed to retrieve mds data"
 FAILED_TO_RETRIEVE_LOCAL_DATA="(03101)Failed to retrieve local data"
 FAILED_TO_RETRIEVE_STORAGE_DATA="(03102)Failed to retrieve storage data"
 FAILED_TO_SERIALIZE_PERF_COUNTERS="(03103)Failed to serialize perf counters"
+FAILED_TO_COLLECT_IN_TIME="(03104)Data source missed its collection deadline"
 
 def timedelta_total_seconds(delta):
 
@@ -48,10 +53,20 @@ def get_host_base_from_uri(blob_uri):
 MonitoringIntervalInMinute = 1 #One minute
 MonitoringInterval = 60 * MonitoringIntervalInMinute
 
+#Rates are only computed over at least this many seconds, shorter windows
+#give huge spikes
+MinSampleInterval = 1
+
 #It takes sometime before the performance date reaches azure table.
 AzureTableDelayInMinute = 5 #Five minute
 AzureTableDelay = 60 * AzureTableDelayInMinute
 
+#Seconds each data source may take before the counters of its last
+#collection are written instead
+VMDataSourceDeadline = 20
+StorageDataSourceDeadline = 30
+StaticDataSourceDeadline = 10
+
 AzureEnhancedMonitorVersion = "2.0.0"
 LibDir = "/var/lib/AzureEnhancedMonitor"
 
@@ -201,9 +216,9 @@ class AzureDiagnosticData(object):
         return self.memoryPercent
 
 class AzureDiagnosticMetric(object):
-    def __init__(self, config):
+    def __init__(self, config, sampler=None):
         self.config = config
-        self.linux = LinuxMetric(self.config)
+        self.linux = LinuxMetric(self.config, sampler)
         self.azure = AzureDiagnosticData(self.config)
         self.timestamp = int(time.time()) - AzureTableDelay
 
@@ -374,67 +389,131 @@ def sameList(l1, l2):
             return False
     return True
 
+def parseNetDev(content):
+    """
+    Returns {adapterId: (bytesReceived, bytesSent)} from /proc/net/dev
+    """
+    nics = {}
+    for line in content.split("\n")[2:]:
+        if ":" not in line:
+            continue
+        nicName, stat = line.split(":", 1)
+        fields = stat.split()
+        nics[nicName.strip()] = (int(fields[0]), int(fields[8]))
+    return nics
+
+def parseProcStat(content):
+    """
+    Returns (idle, total) jiffies of all cpus from /proc/stat
+    """
+    for line in content.split("\n"):
+        fields = line.split()
+        if len(fields) > 4 and fields[0] == "cpu":
+            #user nice system idle iowait irq softirq steal, guest time is
+            #already part of user time
+            jiffies = map(lambda f : int(f), fields[1:9])
+            idle = sum(jiffies[3:5])
+            return idle, sum(jiffies)
+    return None
+
+def parseNetSnmp(content, protocol, name):
+    """
+    Returns one counter from /proc/net/snmp, every protocol has a line with
+    the counter names followed by a line with the values
+    """
+    lines = filter(lambda l : l.startswith(protocol + ":"),
+                   content.split("\n"))
+    for i in range(0, len(lines) - 1, 2):
+        names = lines[i].split()[1:]
+        values = lines[i + 1].split()[1:]
+        if name in names:
+            return int(values[names.index(name)])
+    return None
+
+class CounterSnapshot(object):
+    def __init__(self, procDir):
+        self.timestamp = time.time()
+        self.nics = parseNetDev(waagent.GetFileContents(
+            os.path.join(procDir, "net/dev")))
+        self.cpu = parseProcStat(waagent.GetFileContents(
+            os.path.join(procDir, "stat")))
+        self.retransmitted = parseNetSnmp(waagent.GetFileContents(
+            os.path.join(procDir, "net/snmp")), "Tcp", "RetransSegs")
+
+class CounterRates(object):
+    """
+    Rates between two snapshots, None where a counter is missing or the
+    snapshots are less than MinSampleInterval apart
+    """
+    def __init__(self, old, new):
+        interval = new.timestamp - old.timestamp
+        self.nicNames = filter(lambda n : n != 'lo', sorted(new.nics.keys()))
+        self.readBytes = {}
+        self.writeBytes = {}
+        self.cpuPercent = None
+        self.retransmitted = None
+        if interval < MinSampleInterval:
+            return
+
+        for nicName, stat in new.nics.iteritems():
+            oldStat = old.nics.get(nicName)
+            if oldStat is None:
+                continue
+            self.readBytes[nicName] = (stat[0] - oldStat[0]) / interval
+            self.writeBytes[nicName] = (stat[1] - oldStat[1]) / interval
+
+        if old.cpu is not None and new.cpu is not None:
+            total = new.cpu[1] - old.cpu[1]
+            if total > 0:
+                idle = new.cpu[0] - old.cpu[0]
+                self.cpuPercent = 100.0 * (total - idle) / total
+
+        if old.retransmitted is not None and new.retransmitted is not None:
+            self.retransmitted = int((new.retransmitted - old.retransmitted)
+                                     * 60 / interval)
+
+class CounterSampler(object):
+    """
+    Long lived sampler of the network, cpu and tcp counters in /proc. It keeps
+    the snapshot of the last sample, so every sample yields exact rates for
+    the interval since then without forking netstat. Only a sample right
+    after the start waits for MinSampleInterval to pass.
+    """
+    def __init__(self, procDir="/proc"):
+        self.procDir = procDir
+        self.snapshot = CounterSnapshot(self.procDir)
+        self.rates = CounterRates(self.snapshot, self.snapshot)
+
+    def sample(self):
+        timeToWait = self.snapshot.timestamp + MinSampleInterval - time.time()
+        if timeToWait > 0:
+            time.sleep(timeToWait)
+        snapshot = CounterSnapshot(self.procDir)
+        self.rates = CounterRates(self.snapshot, snapshot)
+        self.snapshot = snapshot
+
+    def getRates(self):
+        return self.rates
+
 class NetworkInfo(object):
-    def __init__(self):
-        self.nics = psutil.net_io_counters(pernic=True)
-        self.nicNames = []
-        for nicName, stat in self.nics.iteritems():
-            if nicName != 'lo':
-                self.nicNames.append(nicName)
+    def __init__(self, rates):
+        self.rates = rates
 
     def getAdapterIds(self):
-        return self.nicNames
+        return self.rates.nicNames
 
     def getNetworkReadBytes(self, adapterId):
-        net = psutil.net_io_counters(pernic=True)
-        if net[adapterId] != None:
-            bytes_recv1 = net[adapterId][1]
-            time1 = time.time()
-            
-            time.sleep(0.2)
-            
-            net = psutil.net_io_counters(pernic=True)
-            bytes_recv2 = net[adapterId][1]
-            time2 = time.time()
-            
-            interval = (time2 - time1)
-            
-            return (bytes_recv2 - bytes_recv1) / interval
-        else:
-            return 0
+        return self.rates.readBytes.get(adapterId, 0)
 
     def getNetworkWriteBytes(self, adapterId):
-        net = psutil.net_io_counters(pernic=True)
-        if net[adapterId] != None:
-            bytes_sent1 = net[adapterId][0]
-            time1 = time.time()
-            
-            time.sleep(0.2)
-            
-            net = psutil.net_io_counters(pernic=True)
-            bytes_sent2 = net[adapterId][0]
-            time2 = time.time()
-            
-            interval = (time2 - time1)
-            
-            return (bytes_sent2 - bytes_sent1) / interval
-        else:
-            return 0
-
-    def getNetstat(self):
-        retCode, output = waagent.RunGetOutput("netstat -s", chk_err=False)
-        return output
+        return self.rates.writeBytes.get(adapterId, 0)
 
     def getNetworkPacketRetransmitted(self):
-        netstat = self.getNetstat()
-        match = re.search("(\d+)\s*segments retransmited", netstat)
-        if match != None:
-            return int(match.group(1))
-        else:
-            waagent.Error("Failed to parse netstat output: {0}".format(netstat))
+        if self.rates.retransmitted is None:
+            waagent.Error("Failed to read tcp counters from /proc/net/snmp")
             updateLatestErrorRecord(FAILED_TO_RETRIEVE_LOCAL_DATA)
             AddExtensionEvent(message=FAILED_TO_RETRIEVE_LOCAL_DATA)
-            return None
+        return self.rates.retransmitted
 
 
 HwInfoFile = os.path.join(LibDir, "HwInfo")
@@ -471,14 +550,18 @@ class HardwareChangeInfo(object):
             return oldTime
 
 class LinuxMetric(object):
-    def __init__(self, config):
+    def __init__(self, config, sampler=None):
         self.config = config
+        if sampler is None:
+            sampler = CounterSampler()
+            sampler.sample()
+        self.rates = sampler.getRates()
         #CPU
         self.cpuInfo = CPUInfo.getCPUInfo()
         #Memory
         self.memInfo = MemoryInfo()
         #Network
-        self.networkInfo = NetworkInfo()
+        self.networkInfo = NetworkInfo(self.rates)
         #Detect hardware change
         self.hwChangeInfo = HardwareChangeInfo(self.networkInfo)
         self.timestamp = int(time.time())
@@ -523,7 +606,7 @@ class LinuxMetric(object):
         return "thread" if self.cpuInfo.isHyperThreadingOn() else "core"
     
     def getVMProcessingPowerConsumption(self):
-        return self.memInfo.getMemPercent()
+        return self.rates.cpuPercent
     
     def getCurrMemAssigned(self):
         if self.config.isMemoryOverCommitted():
@@ -565,15 +648,16 @@ class LinuxMetric(object):
         return self.hwChangeInfo.getLastHardwareChange()
 
 class VMDataSource(object):
-    def __init__(self, config):
+    def __init__(self, config, sampler=None):
         self.config = config
+        self.sampler = sampler
 
     def collect(self):
         counters = []
         if self.config.isLADEnabled():
-            metrics = AzureDiagnosticMetric(self.config)
+            metrics = AzureDiagnosticMetric(self.config, self.sampler)
         else:
-            metrics = LinuxMetric(self.config)
+            metrics = LinuxMetric(self.config, self.sampler)
 
         #CPU
         counters.append(self.createCounterCurrHwFrequency(metrics))
@@ -809,18 +893,84 @@ def getStorageTableKeyRange():
     startTime = endTime - MonitoringInterval
     return getStorageTimestamp(startTime), getStorageTimestamp(endTime)
 
+class StorageMetricsCache(object):
+    """
+    Minute metrics rows of one storage account by partition. All partitions
+    below fetchedKey were queried already, so a query only asks for the ones
+    after it. The rows of partitions that left the key range are dropped. One
+    TableService is kept per account.
+    """
+    Select = ("TotalRequests,TotalIngress,TotalEgress,AverageE2ELatency,"
+              "AverageServerLatency,PartitionKey,RowKey")
+
+    def __init__(self, account, key, hostBase, table):
+        self.key = key
+        self.hostBase = hostBase
+        self.table = table
+        self.tableService = TableService(account_name = account,
+                                         account_key = key,
+                                         host_base = hostBase)
+        self.partitions = {}
+        self.fetchedKey = None
+
+    def queryEntities(self, ofilter):
+        entities = []
+        nextPartitionKey = None
+        nextRowKey = None
+        while True:
+            result = self.tableService.query_entities(self.table,
+                                                      ofilter,
+                                                      self.Select,
+                                                      None,
+                                                      nextPartitionKey,
+                                                      nextRowKey)
+            entities.extend(result)
+            continuation = getattr(result, "x_ms_continuation", None)
+            if not continuation:
+                return entities
+            nextPartitionKey = continuation.get("nextpartitionkey")
+            nextRowKey = continuation.get("nextrowkey")
+            if nextPartitionKey is None:
+                return entities
+
+    def getMetrics(self, startKey, endKey):
+        lowerKey = startKey
+        if self.fetchedKey is not None and self.fetchedKey > startKey:
+            lowerKey = self.fetchedKey
+        if lowerKey < endKey:
+            ofilter = ("PartitionKey ge '{0}' and PartitionKey lt '{1}'"
+                       "").format(lowerKey, endKey)
+            entities = self.queryEntities(ofilter)
+            for entity in entities:
+                self.partitions.setdefault(entity.PartitionKey, []).append(entity)
+            self.fetchedKey = endKey
+            waagent.Log("{0} new records returned.".format(len(entities)))
+
+        metrics = []
+        for partitionKey in self.partitions.keys():
+            if partitionKey < startKey:
+                del self.partitions[partitionKey]
+            elif partitionKey < endKey:
+                metrics.extend(self.partitions[partitionKey])
+        return metrics
+
+StorageMetricsCaches = {}
+StorageMetricsCachesLock = threading.Lock()
+
+def getStorageMetricsCache(account, key, hostBase, table):
+    with StorageMetricsCachesLock:
+        cache = StorageMetricsCaches.get((account, table))
+        if cache is None or cache.key != key or cache.hostBase != hostBase:
+            cache = StorageMetricsCache(account, key, hostBase, table)
+            StorageMetricsCaches[(account, table)] = cache
+        return cache
+
 def getStorageMetrics(account, key, hostBase, table, startKey, endKey):
     try:
         waagent.Log("Retrieve storage metrics data.")
-        tableService = TableService(account_name = account, 
-                                    account_key = key,
-                                    host_base = hostBase)
-        ofilter = ("PartitionKey ge '{0}' and PartitionKey lt '{1}'"
-                   "").format(startKey, endKey)
-        oselect = ("TotalRequests,TotalIngress,TotalEgress,AverageE2ELatency,"
-                   "AverageServerLatency,RowKey")
-        metrics = tableService.query_entities(table, ofilter, oselect)
-        waagent.Log("{0} records returned.".format(len(metrics)))
+        cache = getStorageMetricsCache(account, key, hostBase, table)
+        metrics = cache.getMetrics(startKey, endKey)
+        waagent.Log("{0} records in range.".format(len(metrics)))
         return metrics
     except Exception as e:
         waagent.Error((u"Failed to retrieve storage metrics data: {0} {1}"
@@ -905,37 +1055,54 @@ def isUserWrite(op):
             return True
     return False
 
-def storageStat(metrics, opFilter):
+def newStorageStat():
     stat = {}
     stat['bytes'] = None
     stat['ops'] = None
     stat['e2eLatency'] = None
     stat['serverLatency'] = None
     stat['throughput'] = None
-    if metrics is None:
-        return stat
+    return stat
 
-    metrics = filter(lambda x : opFilter(x.RowKey), metrics)
-    stat['bytes'] = sum(map(lambda x : x.TotalIngress + x.TotalEgress, 
-                            metrics))
-    stat['ops'] = sum(map(lambda x : x.TotalRequests, metrics))
+def storageStatFromTotal(total):
+    stat = newStorageStat()
+    stat['bytes'] = total[0]
+    stat['ops'] = total[1]
     if stat['ops'] != 0:
-        stat['e2eLatency'] = sum(map(lambda x : x.TotalRequests * \
-                                                x.AverageE2ELatency, 
-                                     metrics)) / stat['ops']
-        stat['serverLatency'] = sum(map(lambda x : x.TotalRequests * \
-                                                   x.AverageServerLatency, 
-                                        metrics)) / stat['ops']
+        stat['e2eLatency'] = total[2] / stat['ops']
+        stat['serverLatency'] = total[3] / stat['ops']
     #Convert to MB/s
-    stat['throughput'] = float(stat['bytes']) / (1024 * 1024) / 60 
+    stat['throughput'] = float(stat['bytes']) / (1024 * 1024) / 60
     return stat
 
+def storageStats(metrics):
+    """
+    Returns the read and the write stat of the metrics rows in a single pass
+    """
+    if metrics is None:
+        return newStorageStat(), newStorageStat()
+
+    #Bytes, ops and the latencies weighted by ops
+    rTotal = [0, 0, 0, 0]
+    wTotal = [0, 0, 0, 0]
+    for x in metrics:
+        if isUserRead(x.RowKey):
+            total = rTotal
+        elif isUserWrite(x.RowKey):
+            total = wTotal
+        else:
+            continue
+        total[0] += x.TotalIngress + x.TotalEgress
+        total[1] += x.TotalRequests
+        total[2] += x.TotalRequests * x.AverageE2ELatency
+        total[3] += x.TotalRequests * x.AverageServerLatency
+    return storageStatFromTotal(rTotal), storageStatFromTotal(wTotal)
+
 class AzureStorageStat(object):
 
     def __init__(self, metrics):
         self.metrics = metrics
-        self.rStat = storageStat(metrics, isUserRead)
-        self.wStat = storageStat(metrics, isUserWrite)
+        self.rStat, self.wStat = storageStats(metrics)
 
     def getReadBytes(self):
         return self.rStat['bytes']
@@ -1269,6 +1436,13 @@ class PerfCounterType(object):
     COUNTER_TYPE_LARGE = 3
     COUNTER_TYPE_STRING = 4
 
+#Resolved once per cycle instead of once per counter
+MachineName = socket.gethostname()
+
+def refreshMachineName():
+    global MachineName
+    MachineName = socket.gethostname()
+
 class PerfCounter(object):
     def __init__(self, 
                  counterType, 
@@ -1290,7 +1464,7 @@ class PerfCounter(object):
             self.timestamp = timestamp
         else:
             self.timestamp = int(time.time())
-        self.machine = socket.gethostname()
+        self.machine = MachineName
 
     def __str__(self):
         return (u"{0};{1};{2};{3};{4};{5};{6};{7};{8};{9};\n"
@@ -1307,20 +1481,114 @@ class PerfCounter(object):
 
     __repr__ = __str__
 
+class DataSourceCollector(object):
+    """
+    Collects one data source on its own thread. A collection that misses its
+    deadline keeps running, the counters of the last finished collection are
+    used in the meantime. They keep their original timestamps, so consumers
+    can tell they are stale.
+    """
+    def __init__(self, dataSource, deadline):
+        self.dataSource = dataSource
+        self.deadline = deadline
+        self.lock = threading.Lock()
+        self.thread = None
+        self.result = None
+        self.lastCounters = []
+
+    def getName(self):
+        return self.dataSource.__class__.__name__
+
+    def isCollecting(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if self.isCollecting():
+            waagent.Warn(("{0} is still collecting since last cycle."
+                          "").format(self.getName()))
+            return
+        #A collection that finished after its deadline must not be taken
+        #for the result of this one, its counters are in lastCounters
+        with self.lock:
+            self.result = None
+        self.thread = threading.Thread(target=self._collect)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _collect(self):
+        try:
+            result = (self.dataSource.collect(), None)
+        except Exception as e:
+            waagent.Error(u"{0} failed: {1} {2}".format(self.getName(), e,
+                                                        traceback.format_exc()))
+            result = (None, e)
+        with self.lock:
+            self.result = result
+            if result[0] is not None:
+                self.lastCounters = result[0]
+
+    def wait(self, startTime):
+        """
+        Returns (counters, error), error is the exception raised by the
+        collection or None.
+        """
+        timeout = max(0, startTime + self.deadline - time.time())
+        self.thread.join(timeout)
+        with self.lock:
+            result = self.result
+            self.result = None
+            lastCounters = self.lastCounters
+        if result is not None:
+            return result
+        waagent.Warn(("{0} missed its deadline of {1}s, {2} counters from "
+                      "the last collection are used.").format(self.getName(),
+                                                              self.deadline,
+                                                              len(lastCounters)))
+        return lastCounters, None
+
 class EnhancedMonitor(object):
-    def __init__(self, config):
-        self.dataSources = []
-        self.dataSources.append(VMDataSource(config))
-        self.dataSources.append(StorageDataSource(config))
-        self.dataSources.append(StaticDataSource(config))
+    def __init__(self, config, sampler=None):
+        self.collectors = []
+        self.collectors.append(DataSourceCollector(VMDataSource(config,
+                                                                sampler),
+                                                   VMDataSourceDeadline))
+        self.collectors.append(DataSourceCollector(StorageDataSource(config),
+                                                   StorageDataSourceDeadline))
+        self.collectors.append(DataSourceCollector(StaticDataSource(config),
+                                                   StaticDataSourceDeadline))
         self.writer = PerfCounterWriter()
+        self.table = None
+        if config.isPerfCounterTableEnabled():
+            self.table = PerfCounterTable()
+        else:
+            removePerfCounterTable()
 
     def run(self):
+        startTime = time.time()
+        refreshMachineName()
+        for collector in self.collectors:
+            collector.start()
+
         counters = []
-        for dataSource in self.dataSources:
-            counters.extend(dataSource.collect())
+        errors = []
+        for collector in self.collectors:
+            collected, error = collector.wait(startTime)
+            if error is not None:
+                errors.append(error)
+            else:
+                counters.extend(collected)
+        if len(errors) != 0:
+            raise errors[0]
         clearLastErrorRecord()
+        if any(map(lambda c : c.isCollecting(), self.collectors)):
+            updateLatestErrorRecord(FAILED_TO_COLLECT_IN_TIME)
         self.writer.write(counters)
+        if self.table is not None:
+            try:
+                self.table.write(counters)
+            except EnvironmentError as e:
+                waagent.Warn((u"Write to perf counter table failed: {0}"
+                              "").format(e))
 
 EventFile=os.path.join(LibDir, "PerfCounters")
 class PerfCounterWriter(object):
@@ -1347,6 +1615,137 @@ class PerfCounterWriter(object):
         with open(eventFile, "w+") as F:
             F.write("".join(map(lambda c : str(c), counters)).encode("utf8"))
 
+def encodeCounterString(value, maxSize):
+    if isinstance(value, unicode):
+        value = value.encode("utf8")
+    return str(value)[:maxSize - 1]
+
+PerfCounterTableFile = os.path.join(LibDir, "PerfCounterTable")
+class PerfCounterTable(object):
+    """
+    Optional fixed layout copy of the counters in a memory mapped file, so
+    readers like libazureperf can poll it without parsing and without racing
+    a half written PerfCounters file. The layout is ap_table_header followed
+    by PERF_COUNT_MAX perf_counter from azureperf.h (x86_64).
+
+    The generation in the header is odd while the table is changed, readers
+    retry until they copied it between two reads of the same even value. The
+    stores of one writer reach the mapping in program order on x86.
+
+    The header also has the time of the last write. Readers fall back to the
+    PerfCounters file when it is much newer than the table, e.g. after the
+    table is disabled or its writer stopped.
+    """
+    Magic = 0x43504141
+    Version = 2
+    MaxCounters = 128
+    HeaderFormat = "=6I40x"
+    GenerationOffset = 8
+    LenOffset = 12
+    UpdatedOffset = 20
+    #counter_typer, type_name, property_name, instance_name, is_empty, value
+    #union, unit_name, refresh_interval, padding, timestamp, machine_name
+    CounterFormat = "=i64s128s256si256s64sI4xq128s"
+    ValueFormats = {
+        PerfCounterType.COUNTER_TYPE_INT : "=i",
+        PerfCounterType.COUNTER_TYPE_LARGE : "=q",
+        PerfCounterType.COUNTER_TYPE_DOUBLE : "=d",
+    }
+
+    def __init__(self, tableFile=PerfCounterTableFile):
+        self.headerSize = struct.calcsize(self.HeaderFormat)
+        self.counterSize = struct.calcsize(self.CounterFormat)
+        self.size = self.headerSize + self.counterSize * self.MaxCounters
+        fd = os.open(tableFile, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            if os.fstat(fd).st_size < self.size:
+                os.ftruncate(fd, self.size)
+            self.table = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+
+        magic, version, generation, length, counterSize, updated = \
+            struct.unpack(self.HeaderFormat, self.table[0:self.headerSize])
+        if (magic != self.Magic or version != self.Version or
+                counterSize != self.counterSize):
+            generation = 0
+            self.table[0:self.headerSize] = struct.pack(self.HeaderFormat,
+                                                        self.Magic,
+                                                        self.Version,
+                                                        generation,
+                                                        0,
+                                                        self.counterSize,
+                                                        0)
+        #Continue after a writer that stopped in the middle of a change
+        self.generation = generation + (generation & 1)
+
+    def packValue(self, counter):
+        """
+        Returns the value union, None when the value does not fit the type
+        """
+        if counter.value is None:
+            return None
+        valueFormat = self.ValueFormats.get(counter.counterType)
+        try:
+            if valueFormat is None:
+                return encodeCounterString(counter.value, 256)
+            elif counter.counterType == PerfCounterType.COUNTER_TYPE_DOUBLE:
+                return struct.pack(valueFormat, float(counter.value))
+            else:
+                return struct.pack(valueFormat, int(counter.value))
+        except (ValueError, TypeError, struct.error):
+            return None
+
+    def packCounter(self, counter):
+        value = self.packValue(counter)
+        return struct.pack(self.CounterFormat,
+                           counter.counterType,
+                           encodeCounterString(counter.category, 64),
+                           encodeCounterString(counter.name, 128),
+                           encodeCounterString(counter.instance, 256),
+                           0 if value is not None else 1,
+                           value if value is not None else "",
+                           encodeCounterString(counter.unit, 64),
+                           counter.refreshInterval,
+                           counter.timestamp,
+                           encodeCounterString(counter.machine, 128))
+
+    def setGeneration(self, generation):
+        self.generation = generation & 0xffffffff
+        offset = self.GenerationOffset
+        self.table[offset:offset + 4] = struct.pack("=I", self.generation)
+
+    def write(self, counters):
+        if len(counters) > self.MaxCounters:
+            waagent.Warn(("Only {0} of {1} counters fit the perf counter "
+                          "table.").format(self.MaxCounters, len(counters)))
+            counters = counters[:self.MaxCounters]
+        records = "".join(map(lambda c : self.packCounter(c), counters))
+
+        self.setGeneration(self.generation + 1)
+        self.table[self.headerSize:self.headerSize + len(records)] = records
+        offset = self.LenOffset
+        self.table[offset:offset + 4] = struct.pack("=I", len(counters))
+        offset = self.UpdatedOffset
+        self.table[offset:offset + 4] = struct.pack("=I", int(time.time()))
+        self.setGeneration(self.generation + 1)
+
+    def close(self):
+        self.table.close()
+
+def removePerfCounterTable(tableFile=PerfCounterTableFile):
+    """
+    Remove the table of an earlier run, so that readers don't keep reading
+    its frozen counters after the table is disabled.
+    """
+    try:
+        os.remove(tableFile)
+        waagent.Log("Removed perf counter table: {0}".format(tableFile))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            waagent.Warn((u"Remove perf counter table failed: {0}"
+                          "").format(e))
+
 class EnhancedMonitorConfig(object):
     def __init__(self, publicConfig, privateConfig):
         xmldoc = minidom.parse('/var/lib/waagent/SharedConfig.xml')
@@ -1391,6 +1790,10 @@ class EnhancedMonitorConfig(object):
         flag = self.configData.get("verbose")
         return flag == "1" or flag == 1
 
+    def isPerfCounterTableEnabled(self):
+        flag = self.configData.get("perfcounter.table.enabled")
+        return flag == "1" or flag == 1
+
     def getVMSLAIOPS(self):
         return self.configData.get("vm.sla.iops")
 
@@ -83,13 +83,15 @@ def daemon(hutil):
     publicConfig = hutil.get_public_settings()
     privateConfig = hutil.get_protected_settings()
     config = aem.EnhancedMonitorConfig(publicConfig, privateConfig)
-    monitor = aem.EnhancedMonitor(config)
+    sampler = aem.CounterSampler()
+    monitor = aem.EnhancedMonitor(config, sampler)
     hutil.set_verbose_log(config.isVerbose())
     InitExtensionEventLog(hutil.get_name())
     while True:
         waagent.Log("Collecting performance counter.")
         startTime = time.time()
         try:
+            sampler.sample()
             monitor.run()
             message = ("deploymentId={0} roleInstance={1} OK"
                        "").format(config.getVmDeploymentId(), 
@@ -18,7 +18,13 @@
 
 import datetime
 import os
+import re
 import json
+import shutil
+import struct
+import tempfile
+import threading
+import time
 import unittest
 
 import env
@@ -178,7 +184,9 @@ class TestAEM(unittest.TestCase):
         self.assertTrue(percent >= 0 and percent <= 100)
 
     def test_networkinfo(self):
-        netinfo = aem.NetworkInfo()
+        sampler = aem.CounterSampler()
+        sampler.sample()
+        netinfo = aem.NetworkInfo(sampler.getRates())
         adapterIds = netinfo.getAdapterIds()
         self.assertNotEquals(None, adapterIds)
         self.assertNotEquals(0, len(adapterIds))
@@ -188,8 +196,45 @@ class TestAEM(unittest.TestCase):
         self.assertNotEquals(None, netinfo.getNetworkWriteBytes())
         self.assertNotEquals(None, netinfo.getNetworkPacketRetransmitted())
 
+    def test_counter_sampler(self):
+        procDir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(procDir, "net"))
+        writeProcFiles(procDir, 1000, 2000, (100, 0, 50, 800, 50), 10)
+        sampler = aem.CounterSampler(procDir)
+        writeProcFiles(procDir, 3000, 2500, (200, 0, 100, 1100, 100), 12)
+        sampler.snapshot.timestamp -= 2
+        sampler.sample()
+        rates = sampler.getRates()
+        shutil.rmtree(procDir)
+
+        self.assertEquals(["eth0"], rates.nicNames)
+        self.assertAlmostEquals(1000, rates.readBytes["eth0"], delta=10)
+        self.assertAlmostEquals(250, rates.writeBytes["eth0"], delta=10)
+        self.assertAlmostEquals(30, rates.cpuPercent)
+        self.assertAlmostEquals(60, rates.retransmitted, delta=1)
+
+    def test_counter_sampler_min_interval(self):
+        procDir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(procDir, "net"))
+        writeProcFiles(procDir, 1000, 2000, (100, 0, 50, 800, 50), 10)
+        sampler = aem.CounterSampler(procDir)
+        #Snapshots taken right after each other give no rates
+        self.assertEquals({}, sampler.getRates().readBytes)
+        self.assertEquals(None, sampler.getRates().cpuPercent)
+
+        writeProcFiles(procDir, 3000, 2500, (200, 0, 100, 1100, 100), 12)
+        oldTimestamp = sampler.snapshot.timestamp
+        sampler.sample()
+        rates = sampler.getRates()
+        shutil.rmtree(procDir)
+
+        interval = sampler.snapshot.timestamp - oldTimestamp
+        self.assertTrue(interval >= aem.MinSampleInterval)
+        self.assertAlmostEquals(2000 / interval, rates.readBytes["eth0"], delta=1)
+        self.assertAlmostEquals(30, rates.cpuPercent)
+
     def test_hwchangeinfo(self):
-        netinfo = aem.NetworkInfo()
+        netinfo = aem.NetworkInfo(aem.CounterSampler().getRates())
         testHwInfoFile = "/tmp/HwInfo"
         aem.HwInfoFile = testHwInfoFile
         if os.path.isfile(testHwInfoFile):
@@ -299,6 +344,47 @@ class TestAEM(unittest.TestCase):
         self.assertNotEquals(None, stat.getWriteOpServerLatency())
         self.assertNotEquals(None, stat.getWriteOpThroughput())
 
+    def test_storage_stats(self):
+        metrics = mock_getStorageMetrics()
+        rStat, wStat = aem.storageStats(metrics)
+        reads = filter(lambda x : aem.isUserRead(x.RowKey), metrics)
+        writes = filter(lambda x : aem.isUserWrite(x.RowKey), metrics)
+        self.assertEquals(sum(map(lambda x : x.TotalRequests, reads)),
+                          rStat['ops'])
+        self.assertEquals(sum(map(lambda x : x.TotalRequests, writes)),
+                          wStat['ops'])
+        self.assertEquals(sum(map(lambda x : x.TotalIngress + x.TotalEgress,
+                                  writes)),
+                          wStat['bytes'])
+
+    def test_storage_metrics_cache(self):
+        cache = aem.StorageMetricsCache("account", "key", ".core.windows.net",
+                                        "table")
+        cache.tableService = MockTableService()
+        cache.tableService.rows = [("20150126T0353", "user;GetBlob"),
+                                   ("20150126T0354", "user;GetBlob"),
+                                   ("20150126T0354", "user;PutBlob")]
+        metrics = cache.getMetrics("20150126T0353", "20150126T0354")
+        self.assertEquals(1, len(metrics))
+        self.assertEquals(1, len(cache.tableService.filters))
+
+        #The same range is served from the cache
+        metrics = cache.getMetrics("20150126T0353", "20150126T0354")
+        self.assertEquals(1, len(metrics))
+        self.assertEquals(1, len(cache.tableService.filters))
+
+        #Only partitions that were not queried yet are asked for
+        metrics = cache.getMetrics("20150126T0353", "20150126T0355")
+        self.assertEquals(3, len(metrics))
+        self.assertEquals(("PartitionKey ge '20150126T0354' and "
+                           "PartitionKey lt '20150126T0355'"),
+                          cache.tableService.filters[-1])
+
+        #Partitions that left the range are dropped
+        metrics = cache.getMetrics("20150126T0354", "20150126T0355")
+        self.assertEquals(2, len(metrics))
+        self.assertEquals(["20150126T0354"], cache.partitions.keys())
+
     def test_disk_info(self):
         config = self.test_config()
         mapping = aem.DiskInfo(config).getDiskMapping()
@@ -364,6 +450,100 @@ class TestAEM(unittest.TestCase):
         self.assertRaises(IOError, writer.write, counters, 2, testEventFile)
         print("==============================")
 
+    def test_collector_deadline(self):
+        dataSource = MockSlowDataSource()
+        collector = aem.DataSourceCollector(dataSource, 0.2)
+
+        #The first collection finishes in time
+        dataSource.release.set()
+        collector.start()
+        counters, error = collector.wait(time.time())
+        self.assertEquals(None, error)
+        self.assertEquals(1, len(counters))
+        lastCounter = counters[0]
+
+        #A slow collection gets the counters of the last one
+        dataSource.release.clear()
+        collector.start()
+        counters, error = collector.wait(time.time())
+        self.assertEquals(None, error)
+        self.assertEquals([lastCounter], counters)
+        self.assertTrue(collector.isCollecting())
+
+        #A collection still running is not started again
+        collector.start()
+        self.assertEquals(2, dataSource.collectCount)
+        dataSource.release.set()
+        counters, error = collector.wait(time.time())
+        self.assertEquals(None, error)
+        self.assertEquals(2, counters[0].value)
+
+        #A collection that finishes after its deadline is not taken for the
+        #result of the next one
+        dataSource.release.clear()
+        collector.start()
+        counters, error = collector.wait(time.time())
+        self.assertEquals(2, counters[0].value)
+        dataSource.fail = True
+        dataSource.release.set()
+        collector.thread.join()
+        dataSource.fail = False
+        dataSource.release.clear()
+        collector.start()
+        counters, error = collector.wait(time.time())
+        self.assertEquals(None, error)
+        self.assertEquals(2, counters[0].value)
+        dataSource.release.set()
+
+    def test_perf_counter_table(self):
+        testTableFile = "/tmp/PerfCounterTable"
+        if os.path.isfile(testTableFile):
+            os.remove(testTableFile)
+        table = aem.PerfCounterTable(testTableFile)
+        counters = [aem.PerfCounter(counterType = 1,
+                                    category = "test",
+                                    name = "int",
+                                    value = 42,
+                                    unit = "test"),
+                    aem.PerfCounter(counterType = 3,
+                                    category = "test",
+                                    name = "invalid large",
+                                    value = "test")]
+        table.write(counters)
+        table.close()
+
+        with open(testTableFile, "rb") as F:
+            content = F.read()
+        self.assertEquals(table.size, len(content))
+        magic, version, generation, length, counterSize, updated = \
+            struct.unpack(table.HeaderFormat, content[0:table.headerSize])
+        self.assertEquals(aem.PerfCounterTable.Magic, magic)
+        self.assertEquals(2, generation)
+        self.assertTrue(abs(time.time() - updated) < 5)
+        self.assertEquals(2, length)
+        self.assertEquals(920, counterSize)
+
+        offset = table.headerSize
+        fields = struct.unpack(table.CounterFormat,
+                               content[offset:offset + counterSize])
+        self.assertEquals("int", fields[2].rstrip("\0"))
+        self.assertEquals(0, fields[4])
+        self.assertEquals(42, struct.unpack("=i", fields[5][0:4])[0])
+        offset = offset + counterSize
+        fields = struct.unpack(table.CounterFormat,
+                               content[offset:offset + counterSize])
+        self.assertEquals(1, fields[4])
+
+        #A reopened table continues the generation
+        table = aem.PerfCounterTable(testTableFile)
+        self.assertEquals(2, table.generation)
+        table.close()
+
+        #A disabled table is removed
+        aem.removePerfCounterTable(testTableFile)
+        self.assertFalse(os.path.exists(testTableFile))
+        aem.removePerfCounterTable(testTableFile)
+
     def test_easyHash(self):
         hashVal = aem.easyHash('a')
         self.assertEquals(97, hashVal)
@@ -393,6 +573,63 @@ class TestAEM(unittest.TestCase):
         storageTimestamp = aem.getStorageTimestamp(unixTimestamp)
         self.assertEquals("20150126T0354", storageTimestamp)
 
+class MockSlowDataSource(object):
+    def __init__(self):
+        self.release = threading.Event()
+        self.collectCount = 0
+        self.fail = False
+
+    def collect(self):
+        self.collectCount += 1
+        value = self.collectCount
+        self.release.wait()
+        if self.fail:
+            raise Exception("Collection failed")
+        return [aem.PerfCounter(counterType = 0,
+                                category = "test",
+                                name = "test",
+                                value = value)]
+
+def writeProcFiles(procDir, bytesReceived, bytesSent, cpu, retransmitted):
+    netDev = ("Inter-|   Receive                            |  Transmit\n"
+              " face |bytes    packets errs drop fifo frame compressed "
+              "multicast|bytes    packets errs drop fifo colls carrier "
+              "compressed\n"
+              "    lo: 500 5 0 0 0 0 0 0 500 5 0 0 0 0 0 0\n"
+              "  eth0: {0} 10 0 0 0 0 0 0 {1} 10 0 0 0 0 0 0\n"
+              "").format(bytesReceived, bytesSent)
+    stat = ("cpu  {0} {1} {2} {3} {4} 0 0 0 0 0\n"
+            "cpu0 {0} {1} {2} {3} {4} 0 0 0 0 0\n"
+            "ctxt 12345\n").format(*cpu)
+    snmp = ("Tcp: RtoAlgorithm RtoMin RtoMax MaxConn ActiveOpens RetransSegs\n"
+            "Tcp: 1 200 120000 -1 7 {0}\n"
+            "Udp: InDatagrams NoPorts\n"
+            "Udp: 1 2\n").format(retransmitted)
+    waagent.SetFileContents(os.path.join(procDir, "net/dev"), netDev)
+    waagent.SetFileContents(os.path.join(procDir, "stat"), stat)
+    waagent.SetFileContents(os.path.join(procDir, "net/snmp"), snmp)
+
+class MockTableService(object):
+    def __init__(self):
+        self.rows = []
+        self.filters = []
+
+    def query_entities(self, table, ofilter, oselect, top, nextPartitionKey,
+                       nextRowKey):
+        self.filters.append(ofilter)
+        lower = re.search("PartitionKey ge '(\w+)'", ofilter).group(1)
+        upper = re.search("PartitionKey lt '(\w+)'", ofilter).group(1)
+        class Row(object):
+            def __init__(self, partitionKey, rowKey):
+                self.PartitionKey = partitionKey
+                self.RowKey = rowKey
+        rows = []
+        for partitionKey, rowKey in self.rows:
+            if partitionKey < lower or partitionKey >= upper:
+                continue
+            rows.append(Row(partitionKey, rowKey))
+        return rows
+
 def mock_getStorageMetrics(*args, **kwargs):
         with open(os.path.join(env.test_dir, "storage_metrics")) as F:
             test_data = F.read()
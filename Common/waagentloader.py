@@ -20,11 +20,16 @@
 import imp
 import os
 
+try:
+    from Utils.waagentcache import load_source
+except ImportError:
+    load_source = imp.load_source
+
 def load_waagent(path=None):
     if path is None:
         pwd = os.path.dirname(os.path.abspath(__file__))
         path = os.path.join(pwd, 'waagent')
-    waagent = imp.load_source('waagent', path)
+    waagent = load_source('waagent', path)
     waagent.LoggerInit('/var/log/waagent.log','/dev/stdout')
     waagent.MyDistro = waagent.GetMyDistro()
     waagent.Config = waagent.ConfigurationProvider(None)
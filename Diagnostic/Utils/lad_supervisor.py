@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+#
+# Azure Linux extension
+#
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+# MIT License
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the ""Software""), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions: The above
+# copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software. THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+# LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+
+
+def read_proc_cmdline(pid):
+    """
+    Read the raw command line of a process from /proc, without forking cat.
+    :param pid: ID of the process (int or str)
+    :return: The NUL separated command line, or None if the process doesn't exist (anymore).
+    """
+    try:
+        with open('/proc/{0}/cmdline'.format(str(pid).strip())) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def find_pids_by_binary(binary_path):
+    """
+    Scan /proc for processes whose command line contains binary_path. Replaces 'ps aux | grep'.
+    :param str binary_path: Full path of the binary
+    :return: List of int PIDs
+    """
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        cmdline = read_proc_cmdline(entry)
+        if cmdline and binary_path in cmdline.replace('\0', ' '):
+            pids.append(int(entry))
+    return pids
+
+
+class InotifyWatcher(object):
+    """
+    Minimal inotify binding over ctypes (Python 2 has no inotify module). Directories are watched instead of files,
+    so that a file that is created later or rotated is still noticed.
+    """
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    _event_header = struct.Struct('iIII')
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self._dirs = {}  # watch descriptor -> directory
+
+    def fileno(self):
+        return self._fd
+
+    def add_dir(self, dir_path):
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self._libc.inotify_add_watch(self._fd, dir_path, mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for ' + dir_path)
+        self._dirs[wd] = dir_path
+
+    def read_changed_paths(self):
+        """
+        Read the pending events. Must only be called when the fd is readable.
+        :return: Set of full paths of the changed files
+        """
+        buf = os.read(self._fd, 64 * 1024)
+        paths = set()
+        offset = 0
+        while offset + self._event_header.size <= len(buf):
+            wd, mask, cookie, name_len = self._event_header.unpack_from(buf, offset)
+            offset += self._event_header.size
+            name = buf[offset:offset + name_len].rstrip('\0')
+            offset += name_len
+            if wd in self._dirs and name:
+                paths.add(os.path.join(self._dirs[wd], name))
+        return paths
+
+    def close(self):
+        os.close(self._fd)
+
+
+class SupervisedProcess(object):
+    """
+    One entry of the supervisor's process table. A child of the daemon (mdsd) is reaped by a waiter thread as soon
+    as it exits. Other processes (e.g. telegraf and MetricsExtension, often started by systemd) are found by their
+    binary path in /proc, and only the last known PID is checked until it's gone.
+    """
+
+    def __init__(self, name, binary_path=None, popen=None):
+        self.name = name
+        self.binary_path = binary_path
+        self.popen = popen
+        self.pid = popen.pid if popen else None
+        self.exited = False
+
+    def is_running(self):
+        if self.popen:
+            return not self.exited
+        if self.pid:
+            cmdline = read_proc_cmdline(self.pid)
+            if cmdline and self.binary_path in cmdline.replace('\0', ' '):
+                return True
+        pids = find_pids_by_binary(self.binary_path)
+        self.pid = pids[0] if pids else None
+        return self.pid is not None
+
+
+class LadSupervisor(object):
+    """
+    Multiplexes the events the LAD daemon reacts to on one select() call: exits of its children (through waitpid in
+    a waiter thread), writes to watched files (through inotify) and the caller's own timeout for periodic checks.
+    """
+
+    def __init__(self, logger_log, logger_error):
+        self._log = logger_log
+        self._error = logger_error
+        self._processes = {}
+        self._lock = threading.Lock()
+        self._exited = set()
+        self._wakeup_read_fd, self._wakeup_write_fd = os.pipe()
+        self._watched_files = set()
+        self._inotify = None
+        self._closed = False
+
+    def add_child(self, name, popen):
+        """
+        Supervise a child process. Replaces any previous entry of the same name.
+        :param str name: Name of the entry in the process table
+        :param popen: subprocess.Popen object of the child. Only the waiter thread may wait/poll it from now on.
+        :return: None
+        """
+        process = SupervisedProcess(name, popen=popen)
+        with self._lock:
+            self._processes[name] = process
+            self._exited.discard(name)
+        waiter = threading.Thread(target=self._wait_child, args=(process,))
+        waiter.daemon = True
+        waiter.start()
+
+    def _wait_child(self, process):
+        try:
+            process.popen.wait()
+        except Exception as e:
+            self._error("Waiting for {0} (pid={1}) failed: {2}".format(process.name, process.pid, e))
+        with self._lock:
+            process.exited = True
+            if self._processes.get(process.name) is process:
+                self._exited.add(process.name)
+            if not self._closed:
+                os.write(self._wakeup_write_fd, 'x')
+
+    def add_process(self, name, binary_path):
+        """
+        Supervise a process that is not a child of the daemon, by its binary path.
+        :param str name: Name of the entry in the process table
+        :param str binary_path: Full path of the process's binary
+        :return: None
+        """
+        with self._lock:
+            self._processes[name] = SupervisedProcess(name, binary_path=binary_path)
+
+    def is_running(self, name):
+        with self._lock:
+            process = self._processes.get(name)
+        return process is not None and process.is_running()
+
+    def watch_file(self, file_path):
+        """
+        Report writes to file_path from wait(). Falls back to no notifications if inotify isn't usable.
+        :param str file_path: Full path of the file. It doesn't need to exist yet.
+        :return: True if writes will be reported, False if the caller has to poll the file.
+        """
+        try:
+            if self._inotify is None:
+                self._inotify = InotifyWatcher()
+            self._inotify.add_dir(os.path.dirname(file_path))
+        except Exception as e:
+            self._error("Cannot watch {0} with inotify, will poll it instead: {1}".format(file_path, e))
+            return False
+        self._watched_files.add(file_path)
+        self._log("Watching {0} with inotify".format(file_path))
+        return True
+
+    def wait(self, timeout):
+        """
+        Block until a child exits, a watched file is written, or the timeout expires. Writes to other files in the
+        watched directories (e.g. mdsd.info next to mdsd.err) are consumed without returning.
+        :param float timeout: Maximum number of seconds to wait
+        :return (set, set): Names of the children that exited, and paths of the watched files that were written
+        """
+        deadline = time.time() + timeout
+        while True:
+            fds = [self._wakeup_read_fd]
+            if self._inotify:
+                fds.append(self._inotify.fileno())
+            try:
+                readable = select.select(fds, [], [], max(0, deadline - time.time()))[0]
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                readable = []
+
+            changed_files = set()
+            if self._wakeup_read_fd in readable:
+                os.read(self._wakeup_read_fd, 1024)
+            if self._inotify and self._inotify.fileno() in readable:
+                changed_files = self._inotify.read_changed_paths() & self._watched_files
+            with self._lock:
+                exited = self._exited
+                self._exited = set()
+            if exited or changed_files or time.time() >= deadline:
+                return exited, changed_files
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+        with self._lock:
+            self._closed = True
+            os.close(self._wakeup_read_fd)
+            os.close(self._wakeup_write_fd)
@@ -51,6 +51,7 @@ try:
     import lad_config_all as lad_cfg
     from Utils.imds_util import ImdsLogger
     import Utils.omsagent_util as oms
+    from Utils.lad_supervisor import LadSupervisor, read_proc_cmdline
     import telegraf_utils.telegraf_config_handler as telhandler
     import metrics_ext_utils.metrics_ext_handler as me_handler
     import metrics_ext_utils.metrics_constants as metrics_constants
@@ -574,9 +575,19 @@ def start_mdsd(configurator):
         g_ext_settings.get_mdsd_trace_option(),
         eh_spool_path).split(" ")
 
+    supervisor = LadSupervisor(hutil.log, hutil.error)
     try:
         start_watcher_thread()
 
+        # One process table for mdsd (our child), telegraf, MetricsExtension and OMI. Only liveness checks of
+        # /proc are done periodically; mdsd's exit and writes to mdsd.err wake the loop up right away.
+        supervisor.add_process('telegraf', metrics_constants.lad_telegraf_bin)
+        supervisor.add_process('MetricsExtension', metrics_constants.lad_metrics_extension_bin)
+        supervisor.add_process('omiserver', '/opt/omi/bin/omiserver')
+        mdsd_err_watched = supervisor.watch_file(err_file_path)
+        monitoring_interval_in_seconds = 30
+        omi_query_every_n_intervals = 10  # 'omicli noop' only every 5 minutes while omiserver is alive
+
         num_quick_consecutive_crashes = 0
         mdsd_crash_msg = ''
 
@@ -590,6 +601,7 @@ def start_mdsd(configurator):
                                     stdout=mdsd_stdout_stream,
                                     stderr=mdsd_stdout_stream,
                                     env=copy_env)
+            supervisor.add_child('mdsd', mdsd)
 
             write_lad_pids_to_file(g_lad_pids_filepath, os.getpid(), mdsd.pid)
 
@@ -599,17 +611,38 @@ def start_mdsd(configurator):
             telegraf_restart_retries = 0
             me_restart_retries = 0
             max_restart_retries = 10
+            num_monitoring_intervals = 0
+            next_monitoring_time = time.time() + monitoring_interval_in_seconds
+            # New errors in mdsd.err are reported right away, but at most once per monitoring interval
+            mdsd_errors_pending = False
+            next_error_report_time = 0
             # Continuously monitors mdsd process
             while True:
-                time.sleep(30)
-                if " ".join(get_lad_pids()).find(str(mdsd.pid)) < 0 and len(get_lad_pids()) >= 2:
-                    mdsd.kill()
-                    hutil.log("Another process is started, now exit")
-                    return
-                if mdsd.poll() is not None:  # if mdsd has terminated
+                wakeup_time = next_monitoring_time
+                if mdsd_errors_pending:
+                    wakeup_time = min(wakeup_time, next_error_report_time)
+                exited, changed_files = supervisor.wait(wakeup_time - time.time())
+                if 'mdsd' in exited:  # mdsd has terminated
+                    hutil.log("mdsd (pid={0}) exited with {1}".format(mdsd.pid, mdsd.returncode))
                     time.sleep(60)
                     mdsd_stdout_stream.flush()
                     break
+                if err_file_path in changed_files:
+                    mdsd_errors_pending = True
+                if mdsd_errors_pending and time.time() >= next_error_report_time:
+                    last_error_time = report_new_mdsd_errors(err_file_path, last_error_time)
+                    mdsd_errors_pending = False
+                    next_error_report_time = time.time() + monitoring_interval_in_seconds
+                if time.time() < next_monitoring_time:
+                    continue
+                next_monitoring_time = time.time() + monitoring_interval_in_seconds
+                num_monitoring_intervals += 1
+
+                lad_pids = get_lad_pids()
+                if " ".join(lad_pids).find(str(mdsd.pid)) < 0 and len(lad_pids) >= 2:
+                    mdsd.kill()
+                    hutil.log("Another process is started, now exit")
+                    return
 
                 # mdsd is now up for at least 30 seconds. Do some monitoring activities.
                 # 1. Mitigate if memory leak is suspected.
@@ -619,11 +652,14 @@ def start_mdsd(configurator):
                                                                              waagent_ext_event_type)
                     break
                 # 2. Restart OMI if it crashed (Issue #128)
-                omi_installed = restart_omi_if_crashed(omi_installed, mdsd)
-                # 3. Check if there's any new logs in mdsd.err and report
-                last_error_time = report_new_mdsd_errors(err_file_path, last_error_time)
+                if num_monitoring_intervals % omi_query_every_n_intervals == 0 \
+                        or not supervisor.is_running('omiserver'):
+                    omi_installed = restart_omi_if_crashed(omi_installed, mdsd)
+                # 3. Check if there's any new logs in mdsd.err and report, unless inotify reports them
+                if not mdsd_err_watched:
+                    last_error_time = report_new_mdsd_errors(err_file_path, last_error_time)
                 # 4. Check if telegraf is running, if not, then restart
-                if not telhandler.is_running(is_lad=True):
+                if not supervisor.is_running('telegraf'):
                     if telegraf_restart_retries < max_restart_retries:
                         telegraf_restart_retries += 1
                         hutil.log("Telegraf binary process is not running. Restarting telegraf now. Retry count - {0}".format(telegraf_restart_retries))
@@ -643,7 +679,7 @@ def start_mdsd(configurator):
                     telegraf_restart_retries = 0
                 # 5. Check if ME is running, if not, then restart
                 if enable_metrics_ext:
-                    if not me_handler.is_running(is_lad=True):
+                    if not supervisor.is_running('MetricsExtension'):
                         if me_restart_retries < max_restart_retries:
                             me_restart_retries += 1
                             hutil.log("MetricsExtension binary process is not running. Restarting MetricsExtension now. Retry count - {0}".format(me_restart_retries))
@@ -742,6 +778,7 @@ def start_mdsd(configurator):
     finally:
         if mdsd_stdout_stream:
             mdsd_stdout_stream.close()
+        supervisor.close()
 
 
 def report_new_mdsd_errors(err_file_path, last_error_time):
@@ -815,7 +852,7 @@ def get_lad_pids():
 
     with open(g_lad_pids_filepath, "r") as f:
         for pid in f.readlines():
-            is_still_alive = RunGetOutput("cat /proc/" + pid.strip() + "/cmdline", should_log=False)[1]
+            is_still_alive = read_proc_cmdline(pid) or ''
             if is_still_alive.find('/waagent/') > 0:
                 lad_pids.append(pid.strip())
             else:
@@ -0,0 +1,79 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from Utils.lad_supervisor import LadSupervisor, find_pids_by_binary, read_proc_cmdline
+
+
+def _log(msg):
+    pass
+
+
+class LadSupervisorTest(unittest.TestCase):
+
+    def setUp(self):
+        self._supervisor = LadSupervisor(_log, _log)
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self._supervisor.close()
+        shutil.rmtree(self._dir)
+
+    def test_child_exit_wakes_up_wait(self):
+        child = subprocess.Popen(['sleep', '0.2'])
+        self._supervisor.add_child('child', child)
+        self.assertTrue(self._supervisor.is_running('child'))
+
+        start = time.time()
+        exited, changed_files = self._supervisor.wait(30)
+        self.assertEqual(set(['child']), exited)
+        self.assertEqual(set(), changed_files)
+        self.assertTrue(time.time() - start < 5)
+        self.assertFalse(self._supervisor.is_running('child'))
+        self.assertEqual(0, child.returncode)
+
+    def test_watched_file_write_wakes_up_wait(self):
+        err_file_path = os.path.join(self._dir, 'mdsd.err')
+        self.assertTrue(self._supervisor.watch_file(err_file_path))
+
+        with open(os.path.join(self._dir, 'mdsd.info'), 'w') as f:
+            f.write('not watched\n')
+        start = time.time()
+        exited, changed_files = self._supervisor.wait(0.5)
+        self.assertEqual(set(), changed_files)
+        # Writes to files that are not watched don't end the wait early
+        self.assertTrue(time.time() - start >= 0.5)
+
+        with open(err_file_path, 'w') as f:
+            f.write('error\n')
+        exited, changed_files = self._supervisor.wait(30)
+        self.assertEqual(set([err_file_path]), changed_files)
+
+    def test_wait_times_out(self):
+        start = time.time()
+        exited, changed_files = self._supervisor.wait(0.2)
+        self.assertEqual((set(), set()), (exited, changed_files))
+        self.assertTrue(time.time() - start >= 0.2)
+
+    def test_process_found_in_proc(self):
+        sleep_path = '/bin/sleep' if os.path.isfile('/bin/sleep') else '/usr/bin/sleep'
+        other = subprocess.Popen([sleep_path, '30'])
+        try:
+            self.assertTrue(other.pid in find_pids_by_binary(sleep_path))
+            self.assertTrue(sleep_path in read_proc_cmdline(other.pid))
+            self._supervisor.add_process('sleep', sleep_path)
+            self.assertTrue(self._supervisor.is_running('sleep'))
+        finally:
+            other.kill()
+            other.wait()
+        self.assertEqual(None, read_proc_cmdline(other.pid))
+        self._supervisor.add_process('missing', os.path.join(self._dir, 'no_such_binary'))
+        self.assertFalse(self._supervisor.is_running('missing'))
+        self.assertFalse(self._supervisor.is_running('unknown'))
+
+
+if __name__ == '__main__':
+    unittest.main()
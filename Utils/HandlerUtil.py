@@ -87,6 +87,9 @@ class HandlerContext:
 
 
 class HandlerUtility:
+    # Decrypted protected settings by (settings file, its mtime, cert thumbprint), held in process memory only
+    _protected_settings_cache = {}
+
     def __init__(self, log, error, s_name=None, l_name=None, extension_version=None, logFileName='extension.log',
                  console_logger=None, file_logger=None):
         self._log = log
@@ -171,7 +174,7 @@ class HandlerUtility:
         redacted = re.sub('"protectedSettingsCertThumbprint":\s*"[^"]+"', '"protectedSettingsCertThumbprint": "*** REDACTED ***"', redacted_tmp)
         return redacted
 
-    def _parse_config(self, ctxt):
+    def _parse_config(self, ctxt, settings_file=None):
         config = None
         try:
             config = json.loads(ctxt)
@@ -188,11 +191,7 @@ class HandlerUtility:
                     handlerSettings["protectedSettingsCertThumbprint"] is not None:
                 protectedSettings = handlerSettings['protectedSettings']
                 thumb = handlerSettings['protectedSettingsCertThumbprint']
-                cert = waagent.LibDir + '/' + thumb + '.crt'
-                pkey = waagent.LibDir + '/' + thumb + '.prv'
-                unencodedSettings = base64.standard_b64decode(protectedSettings)
-                openSSLcmd = "openssl smime -inform DER -decrypt -recip {0} -inkey {1}"
-                cleartxt = waagent.RunSendStdin(openSSLcmd.format(cert, pkey), unencodedSettings)[1]
+                cleartxt = self._decrypt_protected_settings(protectedSettings, thumb, settings_file)
                 if cleartxt is None:
                     self.error("OpenSSL decode error using  thumbprint " + thumb)
                     self.do_exit(1, "Enable", 'error', '1', 'Failed to decrypt protectedSettings')
@@ -205,6 +204,38 @@ class HandlerUtility:
                 self.log('Config decoded correctly.')
         return config
 
+    def _decrypt_protected_settings(self, protected_settings, thumb, settings_file):
+        """
+        Decrypt protectedSettings with openssl, or return the cleartext of an earlier call for the same settings
+        file, mtime and thumbprint, so that daemons re-parsing their config don't fork openssl every time.
+        """
+        cache_key = None
+        if settings_file is not None:
+            try:
+                cache_key = (settings_file, os.path.getmtime(settings_file), thumb)
+            except OSError:
+                pass
+        cache = HandlerUtility._protected_settings_cache
+        # The ciphertext is compared too, in case the file was rewritten within the mtime granularity
+        if cache_key in cache and cache[cache_key][0] == protected_settings:
+            return cache[cache_key][1]
+
+        cert = waagent.LibDir + '/' + thumb + '.crt'
+        pkey = waagent.LibDir + '/' + thumb + '.prv'
+        unencodedSettings = base64.standard_b64decode(protected_settings)
+        openSSLcmd = "openssl smime -inform DER -decrypt -recip {0} -inkey {1}"
+        cleartxt = waagent.RunSendStdin(openSSLcmd.format(cert, pkey), unencodedSettings)[1]
+        if cleartxt is not None and cache_key is not None:
+            # Only the latest decryption of a settings file is kept
+            for key in [key for key in cache if key[0] == settings_file]:
+                del cache[key]
+            cache[cache_key] = (protected_settings, cleartxt)
+        return cleartxt
+
+    @staticmethod
+    def clear_protected_settings_cache():
+        HandlerUtility._protected_settings_cache.clear()
+
     def do_parse_context(self, operation):
         _context = self.try_parse_context()
         if not _context:
@@ -262,7 +293,7 @@ class HandlerUtility:
             return None
 
         self.log("JSON config: " + HandlerUtility.redact_protected_settings(ctxt))
-        self._context._config = self._parse_config(ctxt)
+        self._context._config = self._parse_config(ctxt, self._context._settings_file)
         return self._context
 
     def _change_log_file(self):
@@ -349,6 +380,8 @@ class HandlerUtility:
             self.error('Unable to wite heartbeat info to ' + heartbeat_file)
 
     def do_exit(self, exit_code, operation, status, code, message):
+        if operation in ('Disable', 'Uninstall'):
+            HandlerUtility.clear_protected_settings_cache()
         try:
             self.do_status_report(operation, status, code, message)
         except Exception as e:
@@ -385,3 +418,4 @@ class HandlerUtility:
         redacted = HandlerUtility.redact_protected_settings(content)
 
         waagent.SetFileContents(self._context._settings_file, redacted)
+        HandlerUtility.clear_protected_settings_cache()
@@ -15,8 +15,10 @@
 # limitations under the License.
 
 
+import io
 import os
 import os.path
+import threading
 import time
 import subprocess
 import traceback
@@ -30,6 +32,91 @@ from Utils.WAAgentUtil import waagent
 DefaultStdoutFile = "stdout"
 DefaultErroutFile = "errout"
 
+# A running command is reported at least every interval seconds, and earlier once this much new output arrived,
+# but not more often than every MinReportInterval seconds
+ReportOutputSize = LogUtil.OutputSize
+MinReportInterval = 5
+# How often the output files of a running command are checked for new output
+OutputCheckInterval = 1
+
+
+class OutputBuffer(object):
+    """
+    Keeps the last LogUtil.OutputSize bytes of the file a child writes its stdout or stderr to, for the status
+    messages. The file is read incrementally from where the previous update stopped.
+    """
+
+    def __init__(self, output_file_path, size=LogUtil.OutputSize):
+        # Unbuffered, a buffered file object may not read past an EOF it has seen once
+        self.output_file = io.open(output_file_path, "rb", buffering=0)
+        self.size = size
+        self.data = bytearray()
+        self.total = 0
+
+    def update(self):
+        """
+        Read the output appended since the last call.
+        :return: Number of new bytes
+        """
+        new_bytes = 0
+        while True:
+            data = self.output_file.read(64 * 1024)
+            if not data:
+                return new_bytes
+            self.data += data
+            del self.data[:-self.size]
+            self.total += len(data)
+            new_bytes += len(data)
+
+    def tail(self):
+        return LogUtil.get_printable(bytes(self.data))
+
+    def close(self):
+        self.output_file.close()
+
+
+def stream_output(child, buffers, report, interval):
+    """
+    Wait for child, which writes its output to the files of buffers, and follow the files meanwhile. A waiter
+    thread reaps the child as soon as it exits. Processes it left behind keep writing to the files undisturbed.
+    report() is called once right away, then with rate limits by time and by the amount of new output.
+    :param child: subprocess.Popen object
+    :param buffers: List of OutputBuffers
+    :param report: Function without arguments reporting the progress of the child
+    :param interval: Seconds between two reports if there's no output
+    """
+    exited = threading.Event()
+
+    def wait_child():
+        try:
+            child.wait()
+        finally:
+            exited.set()
+
+    waiter = threading.Thread(target=wait_child)
+    waiter.daemon = True
+    waiter.start()
+
+    report()
+    last_report_time = time.time()
+    last_report_total = 0
+    while True:
+        timeout = max(0, min(last_report_time + interval - time.time(), OutputCheckInterval))
+        exited.wait(timeout)
+        for buffer in buffers:
+            buffer.update()
+        if exited.is_set():
+            break
+
+        now = time.time()
+        total = sum(buffer.total for buffer in buffers)
+        if now - last_report_time >= interval or \
+                (total - last_report_total >= ReportOutputSize and now - last_report_time >= MinReportInterval):
+            report()
+            last_report_time = now
+            last_report_total = total
+    waiter.join()
+
 
 def run_command(hutil, args, cwd, operation, extension_short_name, version, exit_after_run=True, interval=30,
                 std_out_file_name=DefaultStdoutFile, std_err_file_name=DefaultErroutFile):
@@ -37,29 +124,35 @@ def run_command(hutil, args, cwd, operation, extension_short_name, version, exit
     err_out_file = os.path.join(cwd, std_err_file_name)
     std_out = None
     err_out = None
+    buffers = []
     try:
         std_out = open(std_out_file, "w")
         err_out = open(err_out_file, "w")
+        std_out_buffer = OutputBuffer(std_out_file)
+        buffers.append(std_out_buffer)
+        err_out_buffer = OutputBuffer(err_out_file)
+        buffers.append(err_out_buffer)
         start_time = time.time()
         child = subprocess.Popen(args,
                                  cwd=cwd,
                                  stdout=std_out,
                                  stderr=err_out)
-        time.sleep(1)
-        while child.poll() is None:
+
+        def report_running():
             msg = "Command is running..."
-            msg_with_cmd_output = LogUtil.get_formatted_log(msg, LogUtil.tail(std_out_file), LogUtil.tail(err_out_file))
+            msg_with_cmd_output = LogUtil.get_formatted_log(msg, std_out_buffer.tail(), err_out_buffer.tail())
             msg_without_cmd_output = msg + " Stdout/Stderr omitted from output."
 
             hutil.log_to_file(msg_with_cmd_output)
             hutil.log_to_console(msg_without_cmd_output)
             hutil.do_status_report(operation, 'transitioning', '0', msg_without_cmd_output)
-            time.sleep(interval)
+
+        stream_output(child, buffers, report_running, interval)
 
         exit_code = child.returncode
         if child.returncode and child.returncode != 0:
             msg = "Command returned an error."
-            msg_with_cmd_output = LogUtil.get_formatted_log(msg, LogUtil.tail(std_out_file), LogUtil.tail(err_out_file))
+            msg_with_cmd_output = LogUtil.get_formatted_log(msg, std_out_buffer.tail(), err_out_buffer.tail())
             msg_without_cmd_output = msg + " Stdout/Stderr omitted from output."
 
             hutil.error(msg_without_cmd_output)
@@ -70,7 +163,7 @@ def run_command(hutil, args, cwd, operation, extension_short_name, version, exit
                                       message="(01302)" + msg_without_cmd_output)
         else:
             msg = "Command is finished."
-            msg_with_cmd_output = LogUtil.get_formatted_log(msg, LogUtil.tail(std_out_file), LogUtil.tail(err_out_file))
+            msg_with_cmd_output = LogUtil.get_formatted_log(msg, std_out_buffer.tail(), err_out_buffer.tail())
             msg_without_cmd_output = msg + " Stdout/Stderr omitted from output."
 
             hutil.log_to_file(msg_with_cmd_output)
@@ -103,6 +196,8 @@ def run_command(hutil, args, cwd, operation, extension_short_name, version, exit
 
         log_or_exit(hutil, exit_after_run, exit_code, operation, msg)
     finally:
+        for buffer in buffers:
+            buffer.close()
         if std_out:
             std_out.close()
         if err_out:
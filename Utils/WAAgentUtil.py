@@ -21,6 +21,11 @@ import imp
 import os
 import os.path
 
+try:
+    from Utils.waagentcache import load_source
+except ImportError:
+    load_source = imp.load_source
+
 #
 # The following code will search and load waagent code and expose
 # it as a submodule of current module
@@ -45,7 +50,7 @@ def searchWAAgent():
 waagent = None
 agentPath = searchWAAgent()
 if agentPath:
-    waagent = imp.load_source('waagent', agentPath)
+    waagent = load_source('waagent', agentPath)
 else:
     raise Exception("Can't load waagent.")
 
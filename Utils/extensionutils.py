@@ -1,3 +1,4 @@
+import atexit
 import subprocess
 import os
 import tempfile
@@ -5,6 +6,7 @@ import traceback
 import time
 import sys
 import pwd
+import threading
 import Utils.constants as constants
 import xml.sax.saxutils as xml_utils
 import Utils.logger as logger
@@ -305,17 +307,103 @@ class WALAEvent(object):
         return u"<Data>{0}{1}{2}</Data>".format(str_provider_id, str_event_id, str_events_data)
 
     def save(self):
-        event_folder = constants.LibDir + "/events"
-        if not os.path.exists(event_folder):
-            os.mkdir(event_folder)
-            os.chmod(event_folder, 0o700)
-        if len(os.listdir(event_folder)) > 1000:
-            raise Exception("WriteToFolder:Too many file under " + event_folder + " exit")
+        get_event_sink().write([self])
 
-        filename = os.path.join(event_folder, str(int(time.time() * 1000000)))
-        with open(filename + ".tmp", 'wb+') as h_file:
-            h_file.write(self.to_xml().encode("utf-8"))
-        os.rename(filename + ".tmp", filename + ".tld")
+
+class EventSink(object):
+    """
+    Writes WALAEvents to the waagent events folder, one .tld file per event since that is what the agent reads.
+    Events passed to add() are buffered for up to window seconds and written together, so a burst costs one
+    pass over the folder instead of one per event. The number of files in the folder is kept in memory and only
+    recounted with listdir when the cap is near or after rescan_interval seconds, since the agent deletes the
+    files it sends and other extensions add their own.
+    """
+    max_files = 1000
+    rescan_interval = 60
+
+    def __init__(self, event_folder=None, window=1.0, max_batch=100):
+        self.event_folder = event_folder or constants.LibDir + "/events"
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+        self._file_count = None
+        self._counted_at = 0
+        self._last_name = 0
+
+    def add(self, event):
+        """
+        Queue an event. Errors while writing it are logged, not raised.
+        """
+        with self._lock:
+            self._pending.append(event)
+            if len(self._pending) >= self.max_batch or self.window <= 0:
+                self._flush_pending()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        events, self._pending = self._pending, []
+        if not events:
+            return
+        try:
+            self._write(events)
+        except Exception:
+            logger.error("Error writing {0} events: {1}".format(len(events), traceback.format_exc()))
+
+    def write(self, events):
+        """
+        Write events right away, raises if the folder is full or a file can't be written.
+        """
+        with self._lock:
+            self._write(events)
+
+    def _write(self, events):
+        now = time.time()
+        if self._file_count is None or self._file_count + len(events) > self.max_files or \
+                now - self._counted_at > self.rescan_interval:
+            if not os.path.exists(self.event_folder):
+                os.mkdir(self.event_folder)
+                os.chmod(self.event_folder, 0o700)
+            self._file_count = len(os.listdir(self.event_folder))
+            self._counted_at = now
+        if self._file_count + len(events) > self.max_files:
+            raise Exception("WriteToFolder:Too many file under " + self.event_folder + " exit")
+
+        for event in events:
+            # The agent sends files in name order, keep them unique and increasing within a batch
+            self._last_name = max(int(time.time() * 1000000), self._last_name + 1)
+            filename = os.path.join(self.event_folder, str(self._last_name))
+            with open(filename + ".tmp", 'wb+') as h_file:
+                h_file.write(event.to_xml().encode("utf-8"))
+            os.rename(filename + ".tmp", filename + ".tld")
+            self._file_count += 1
+
+
+_event_sink = None
+_event_sink_lock = threading.Lock()
+
+
+def get_event_sink():
+    """
+    The process wide EventSink, flushed at exit.
+    """
+    global _event_sink
+    with _event_sink_lock:
+        if _event_sink is None:
+            _event_sink = EventSink()
+            atexit.register(_event_sink.flush)
+        return _event_sink
 
 
 class ExtensionEvent(WALAEvent):
@@ -344,7 +432,4 @@ def add_extension_event(name, op, is_success, duration=0, version="1.0", message
     event.Message = message
     event.Duration = duration
     event.ExtensionType = extension_type
-    try:
-        event.save()
-    except EnvironmentError:
-        logger.error("Error " + traceback.format_exc())
+    get_event_sink().add(event)
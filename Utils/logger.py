@@ -1,6 +1,130 @@
+import atexit
+import os
 import time
 import sys
 import string
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class BufferedLogWriter(object):
+    """
+    Appends lines to one file through a bounded queue that a daemon thread drains, so callers never wait for
+    the disk. The file stays open between lines and is reopened if it's rotated away. Lines that don't fit in
+    the queue are dropped and counted. The file is fsynced when the level of consecutive lines changes (e.g.
+    when an error follows info lines) and when the writer is closed, at the latest at exit.
+    """
+    max_batch = 256
+
+    def __init__(self, path, queue_size=1000, sync=True):
+        self.path = path
+        self.queue_size = queue_size
+        self.sync = sync
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._file = None
+        self._inode = None
+        self._last_level = None
+        atexit.register(self.close)
+
+    def put(self, line, level):
+        """
+        Queue a line without blocking. Returns False if it was dropped because the queue is full.
+        """
+        with self._lock:
+            # A forked child doesn't inherit the flush thread
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(self.queue_size)
+                self._thread = threading.Thread(target=self._drain, args=(self._queue,))
+                self._thread.daemon = True
+                self._pid = os.getpid()
+                self._file = None
+                self._thread.start()
+            try:
+                self._queue.put_nowait((line, level))
+                return True
+            except queue.Full:
+                self.dropped += 1
+                return False
+
+    def close(self, timeout=5):
+        """
+        Write the queued lines, fsync and close the file.
+        """
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None:
+                return
+            thread = self._thread
+            log_queue = self._queue
+            self._thread = None
+            self._pid = None
+        # The sentinel may wait for room, the queue is drained concurrently
+        try:
+            log_queue.put(None, True, timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def _drain(self, log_queue):
+        while True:
+            items = [log_queue.get()]
+            try:
+                while len(items) < self.max_batch:
+                    items.append(log_queue.get_nowait())
+            except queue.Empty:
+                pass
+            closing = None in items
+            try:
+                self._write([item for item in items if item is not None], closing)
+            except Exception:
+                # Like the unbuffered logger, lines that can't be written are lost
+                self._close_file()
+            if closing:
+                self._close_file()
+                return
+
+    def _write(self, items, closing):
+        self._open_file()
+        need_sync = closing
+        if self.dropped != self._reported_dropped:
+            self._file.write("{0} log messages dropped, the log queue was full\n".format(
+                self.dropped - self._reported_dropped))
+            self._reported_dropped = self.dropped
+        for line, level in items:
+            if self._last_level is not None and level != self._last_level:
+                need_sync = True
+            self._last_level = level
+            self._file.write(line + "\n")
+        self._file.flush()
+        if need_sync and self.sync:
+            os.fsync(self._file.fileno())
+
+    def _open_file(self):
+        if self._file is not None:
+            try:
+                if os.stat(self.path).st_ino == self._inode:
+                    return
+            except OSError:
+                pass
+            self._close_file()
+        self._file = open(self.path, "a")
+        self._inode = os.fstat(self._file.fileno()).st_ino
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except (IOError, OSError):
+                pass
+            self._file = None
 
 
 # noinspection PyMethodMayBeStatic
@@ -22,6 +146,9 @@ class Logger(object):
         self.file_path = filepath
         self.con_path = conpath
         self.verbose = verbose
+        self._file_writer = BufferedLogWriter(filepath) if filepath else None
+        # fsync is not supported on a terminal
+        self._con_writer = BufferedLogWriter(conpath, sync=False) if conpath else None
 
     def throttle_log(self, counter):
         """
@@ -29,47 +156,47 @@ class Logger(object):
         """
         return (counter < 10) or ((counter < 100) and ((counter % 10) == 0)) or ((counter % 100) == 0)
 
-    def write_to_file(self, message):
+    def _sanitize(self, message):
+        message = filter(lambda x: x in string.printable, message)
+
+        # encoding works different for between interpreter version, we are keeping separate implementation
+        # to ensure backward compatibility
+        if sys.version_info[0] == 3:
+            message = ''.join(list(message)).encode('ascii', 'ignore').decode("ascii", "ignore")
+        elif sys.version_info[0] == 2:
+            message = message.encode('ascii', 'ignore')
+        return message
+
+    def write_to_file(self, message, level="INFO"):
         """
         Write 'message' to logfile.
         """
         if self.file_path:
-            try:
-                with open(self.file_path, "a") as F:
-                    message = filter(lambda x: x in string.printable, message)
-
-                    # encoding works different for between interpreter version, we are keeping separate implementation
-                    # to ensure backward compatibility
-                    if sys.version_info[0] == 3:
-                        message = ''.join(list(message)).encode('ascii', 'ignore').decode("ascii", "ignore")
-                    elif sys.version_info[0] == 2:
-                        message = message.encode('ascii', 'ignore')
-
-                    F.write(message + "\n")
-            except IOError as e:
-                pass
+            self._file_writer.put(self._sanitize(message), level)
 
-    def write_to_console(self, message):
+    def write_to_console(self, message, level="INFO"):
         """
         Write 'message' to /dev/console.
         This supports serial port logging if the /dev/console
         is redirected to ttys0 in kernel boot options.
         """
         if self.con_path:
-            try:
-                with open(self.con_path, "w") as C:
-                    message = filter(lambda x: x in string.printable, message)
-
-                    # encoding works different for between interpreter version, we are keeping separate implementation
-                    # to ensure backward compatibility
-                    if sys.version_info[0] == 3:
-                        message = ''.join(list(message)).encode('ascii', 'ignore').decode("ascii", "ignore")
-                    elif sys.version_info[0] == 2:
-                        message = message.encode('ascii', 'ignore')
-
-                    C.write(message + "\n")
-            except IOError as e:
-                pass
+            self._con_writer.put(self._sanitize(message), level)
+
+    def get_dropped_count(self):
+        """
+        Number of messages dropped because the log queues were full.
+        """
+        return sum(writer.dropped for writer in [getattr(self, '_file_writer', None),
+                                                 getattr(self, '_con_writer', None)] if writer)
+
+    def flush(self):
+        """
+        Write out everything logged so far and fsync the log file.
+        """
+        for writer in [getattr(self, '_file_writer', None), getattr(self, '_con_writer', None)]:
+            if writer:
+                writer.close()
 
     def log(self, message):
         """
@@ -113,10 +240,11 @@ class Logger(object):
         Prefix each line of 'message' with current time+'prefix'.
         """
         log_prefix = self._get_log_prefix(prefix)
+        level = self._get_level(prefix)
         for line in message.split('\n'):
             line = log_prefix + line
-            self.write_to_file(line)
-            self.write_to_console(line)
+            self.write_to_file(line, level)
+            self.write_to_console(line, level)
 
     def log_with_prefix_if_verbose(self, prefix, message):
         """
@@ -142,6 +270,15 @@ class Logger(object):
         """
         self.error_with_prefix("", message)
 
+    def _get_level(self, prefix):
+        """
+        The level a prefix stands for, the log file is fsynced when it changes.
+        """
+        for level in ["ERROR", "WARNING"]:
+            if prefix.startswith(level):
+                return level
+        return "INFO"
+
     def _get_log_prefix(self, prefix):
         """
         Generates the log prefix with timestamp+'prefix'.
@@ -163,10 +300,10 @@ class TestLogger(Logger):
         sys.stdout.writelines(message)
         sys.stdout.write("\n")
 
-    def write_to_file(self, message):
+    def write_to_file(self, message, level="INFO"):
         self._log_to_stdout(message)
 
-    def write_to_console(self, message):
+    def write_to_console(self, message, level="INFO"):
         self._log_to_stdout(message)
 
     def log(self, message):
@@ -228,3 +365,7 @@ def error_with_prefix(prefix, message):
 
 def log_if_verbose(message):
     global_shared_context_logger.log_if_verbose(message)
+
+
+def dropped_messages():
+    return global_shared_context_logger.get_dropped_count()
@@ -30,6 +30,12 @@ class MockUtil():
     def error(self, msg):
         print(msg)
 
+    def log_to_file(self, msg):
+        print(msg)
+
+    def log_to_console(self, msg):
+        print(msg)
+
     def get_seq_no(self):
         return "0"
 
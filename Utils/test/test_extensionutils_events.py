@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+import Utils.extensionutils as ext_utils
+import Utils.logger as logger
+
+
+logger.global_shared_context_logger = logger.TestLogger()
+
+
+class TestEventSink(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.event_folder = os.path.join(self.tmp_dir, "events")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def new_event(self, message):
+        event = ext_utils.ExtensionEvent()
+        event.Name = "TestExtension"
+        event.Message = message
+        return event
+
+    def read_events(self):
+        names = sorted(os.listdir(self.event_folder))
+        self.assertTrue(all(name.endswith(".tld") for name in names))
+        contents = []
+        for name in names:
+            with open(os.path.join(self.event_folder, name), 'rb') as h_file:
+                contents.append(h_file.read().decode("utf-8"))
+        return contents
+
+    def test_burst_is_written_on_flush(self):
+        sink = ext_utils.EventSink(self.event_folder, window=60)
+        for i in range(5):
+            sink.add(self.new_event("event {0}".format(i)))
+        self.assertFalse(os.path.exists(self.event_folder))
+
+        sink.flush()
+        contents = self.read_events()
+        self.assertEqual(5, len(contents))
+        for i in range(5):
+            self.assertTrue('"event {0}"'.format(i) in contents[i])
+
+    def test_max_batch_and_file_cap(self):
+        sink = ext_utils.EventSink(self.event_folder, window=60, max_batch=2)
+        sink.max_files = 3
+        sink.add(self.new_event("first"))
+        sink.add(self.new_event("second"))
+        self.assertEqual(2, len(self.read_events()))
+
+        sink.write([self.new_event("third")])
+        self.assertRaises(Exception, sink.write, [self.new_event("fourth")])
+
+        # Files sent by the agent are noticed on the next recount
+        for name in os.listdir(self.event_folder):
+            os.remove(os.path.join(self.event_folder, name))
+        sink.write([self.new_event("fourth")])
+        self.assertEqual(1, len(self.read_events()))
+
+if __name__ == '__main__':
+    unittest.main()
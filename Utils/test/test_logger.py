@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import Utils.logger as logger
+
+
+class TestBufferedLogger(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.tmp_dir, "extension.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_lines(self, path=None):
+        with open(path or self.log_file) as f:
+            return f.read().splitlines()
+
+    def test_log_and_rotate(self):
+        log = logger.Logger(self.log_file, None)
+        log.log("first\nsecond")
+        log.error("broken")
+        log.flush()
+        lines = self.read_lines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].endswith(" first"))
+        self.assertTrue(lines[2].endswith("ERROR: broken"))
+
+        os.rename(self.log_file, self.log_file + ".1")
+        log.warning("after rotation")
+        log.flush()
+        self.assertEqual(1, len(self.read_lines()))
+        self.assertEqual(3, len(self.read_lines(self.log_file + ".1")))
+        self.assertEqual(0, log.get_dropped_count())
+
+    def test_full_queue_drops_messages(self):
+        writer = logger.BufferedLogWriter(self.log_file, queue_size=2)
+        unblock = threading.Event()
+        write = writer._write
+
+        def blocked_write(items, closing):
+            unblock.wait()
+            write(items, closing)
+        writer._write = blocked_write
+
+        self.assertTrue(writer.put("line 1", "INFO"))
+        while not writer._queue.empty():
+            time.sleep(0.01)
+        self.assertTrue(writer.put("line 2", "INFO"))
+        self.assertTrue(writer.put("line 3", "INFO"))
+        self.assertFalse(writer.put("line 4", "INFO"))
+        self.assertEqual(1, writer.dropped)
+
+        unblock.set()
+        writer.close()
+        # line 1 was still being written when line 4 was dropped
+        self.assertEqual(["1 log messages dropped, the log queue was full", "line 1", "line 2", "line 3"],
+                         self.read_lines())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+import HandlerUtil as Util
+
+def mock_log(*args, **kwargs):
+    pass
+
+class TestProtectedSettingsCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.settings_file = os.path.join(self.tmp_dir, "0.settings")
+        self.decrypt_calls = 0
+        self.run_send_stdin = Util.waagent.RunSendStdin
+        Util.waagent.RunSendStdin = self.mock_run_send_stdin
+        Util.HandlerUtility.clear_protected_settings_cache()
+
+    def tearDown(self):
+        Util.waagent.RunSendStdin = self.run_send_stdin
+        Util.HandlerUtility.clear_protected_settings_cache()
+        shutil.rmtree(self.tmp_dir)
+
+    def mock_run_send_stdin(self, cmd, input):
+        self.decrypt_calls += 1
+        if isinstance(input, bytes) and not isinstance(input, str):
+            input = input.decode('utf-8')
+        return 0, '{"password": "%s"}' % input
+
+    def write_settings(self, protected_settings, mtime):
+        settings = Settings % protected_settings
+        with open(self.settings_file, "w") as f:
+            f.write(settings)
+        os.utime(self.settings_file, (mtime, mtime))
+        return settings
+
+    def parse(self, hutil, settings):
+        config = hutil._parse_config(settings, self.settings_file)
+        return config['runtimeSettings'][0]['handlerSettings']['protectedSettings']['password']
+
+    def test_decryption_is_cached(self):
+        hutil = Util.HandlerUtility(mock_log, mock_log, "UnitTest", "HandlerUtil.UnitTest", "0.0.1")
+        settings = self.write_settings("Zmlyc3Q=", 1000)
+        self.assertEqual("first", self.parse(hutil, settings))
+        self.assertEqual("first", self.parse(hutil, settings))
+        self.assertEqual(1, self.decrypt_calls)
+
+        # A new settings file is decrypted again, even within the same mtime
+        settings = self.write_settings("c2Vjb25k", 1000)
+        self.assertEqual("second", self.parse(hutil, settings))
+        self.assertEqual(2, self.decrypt_calls)
+        settings = self.write_settings("c2Vjb25k", 2000)
+        self.assertEqual("second", self.parse(hutil, settings))
+        self.assertEqual(3, self.decrypt_calls)
+
+        Util.HandlerUtility.clear_protected_settings_cache()
+        self.assertEqual("second", self.parse(hutil, settings))
+        self.assertEqual(4, self.decrypt_calls)
+
+Settings="""\
+{
+    "runtimeSettings":[{
+        "handlerSettings":{
+            "protectedSettingsCertThumbprint":"0123456789ABCDEF",
+            "protectedSettings":"%s",
+            "publicSettings":{}
+            }
+     }]
+}
+"""
+
+if __name__ == '__main__':
+    unittest.main()
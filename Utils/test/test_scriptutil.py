@@ -16,6 +16,10 @@
 
 import os
 import os.path
+import shutil
+import subprocess
+import tempfile
+import time
 import env
 import ScriptUtil as su
 import unittest
@@ -41,6 +45,65 @@ class TestScriptUtil(unittest.TestCase):
         self.assertEquals(75, exit_code)
         self.assertEquals("do_status_report", hutil.last)
     
+    def run_stream_output(self, args, interval=30):
+        out_file = os.path.join(self.tmp_dir, "stdout")
+        err_file = os.path.join(self.tmp_dir, "errout")
+        with open(out_file, "w") as out:
+            with open(err_file, "w") as err:
+                buffers = [su.OutputBuffer(out_file, 8), su.OutputBuffer(err_file)]
+                child = subprocess.Popen(args, cwd=self.tmp_dir, stdout=out, stderr=err)
+        su.stream_output(child, buffers, lambda: self.reports.append(time.time()), interval)
+        for buffer in buffers:
+            buffer.close()
+        return child, buffers
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.reports = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_stream_output(self):
+        start_time = time.time()
+        child, buffers = self.run_stream_output(["sh", "-c", "echo 0123456789; echo error >&2; exit 3"])
+        self.assertTrue(time.time() - start_time < 1)
+        self.assertEquals(3, child.returncode)
+        # Only the report right after the start
+        self.assertEquals(1, len(self.reports))
+        self.assertEquals("3456789\n", buffers[0].tail())
+        self.assertEquals(11, buffers[0].total)
+        self.assertEquals("error\n", buffers[1].tail())
+
+    def test_stream_output_reports(self):
+        child, buffers = self.run_stream_output(["sh", "-c", "echo first; sleep 1.5; echo second"], 0.5)
+        self.assertEquals(0, child.returncode)
+        self.assertTrue(len(self.reports) >= 2)
+        self.assertEquals("\nsecond\n", buffers[0].tail())
+
+    def test_stream_output_reports_start(self):
+        start_time = time.time()
+        child, buffers = self.run_stream_output(["sh", "-c", "sleep 0.5"])
+        self.assertEquals(1, len(self.reports))
+        self.assertTrue(self.reports[0] - start_time < 0.5)
+
+    def test_stream_output_left_behind_process(self):
+        start_time = time.time()
+        # The background process keeps writing to stdout after the shell exited
+        child, buffers = self.run_stream_output(["sh", "-c", "(sleep 1; echo late; touch marker) & echo early"])
+        self.assertTrue(time.time() - start_time < 1)
+        self.assertEquals(0, child.returncode)
+        self.assertEquals("early\n", buffers[0].tail())
+
+        marker = os.path.join(self.tmp_dir, "marker")
+        for _ in range(50):
+            if os.path.exists(marker):
+                break
+            time.sleep(0.1)
+        self.assertTrue(os.path.exists(marker))
+        with open(os.path.join(self.tmp_dir, "stdout")) as out:
+            self.assertEquals("early\nlate\n", out.read())
+
     def test_log_or_exit(self):        
         hutil = MockUtil(self)
         su.log_or_exit(hutil, True, 0, 'LogOrExit-0', 'Message1')
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import binascii
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import env
+import waagentcache
+
+
+class TestWAAgentCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.script = os.path.join(self.tmp_dir, 'waagent')
+        self.write_script("Version = 1\n")
+
+    def tearDown(self):
+        sys.modules.pop('fakeagent', None)
+        shutil.rmtree(self.tmp_dir)
+
+    def write_script(self, content):
+        with open(self.script, 'w') as f:
+            f.write(content)
+
+    def cache_files(self):
+        return os.listdir(self.cache_dir)
+
+    def test_cache_hit_and_stale_source(self):
+        code, cached = waagentcache.get_code(self.script, self.cache_dir)
+        self.assertFalse(cached)
+        self.assertEqual(1, len(self.cache_files()))
+        self.assertEqual(0o700, os.stat(self.cache_dir).st_mode & 0o777)
+
+        code, cached = waagentcache.get_code(self.script, self.cache_dir)
+        self.assertTrue(cached)
+
+        # A changed source misses the cache
+        self.write_script("Version = 2\n")
+        code, cached = waagentcache.get_code(self.script, self.cache_dir)
+        self.assertFalse(cached)
+        self.assertEqual(2, len(self.cache_files()))
+        module = waagentcache.load_source('fakeagent', self.script, self.cache_dir)
+        self.assertEqual(2, module.Version)
+        self.assertEqual(self.script, module.__file__)
+        self.assertTrue(sys.modules['fakeagent'] is module)
+
+    def test_alternating_sources(self):
+        other_script = os.path.join(self.tmp_dir, 'waagent-2.0.14')
+        with open(other_script, 'w') as f:
+            f.write("Version = 14\n")
+
+        for script in [self.script, other_script]:
+            self.assertFalse(waagentcache.get_code(script, self.cache_dir)[1])
+        for script in [self.script, other_script, self.script]:
+            self.assertTrue(waagentcache.get_code(script, self.cache_dir)[1])
+        self.assertEqual(2, len(self.cache_files()))
+        for file_name in self.cache_files():
+            self.assertTrue(binascii.hexlify(imp.get_magic()).decode('ascii') in file_name)
+
+    def test_least_recently_used_entries_are_trimmed(self):
+        for version in range(waagentcache.MAX_CACHE_FILES + 2):
+            self.write_script("Version = {0}\n".format(version))
+            waagentcache.get_code(self.script, self.cache_dir)
+            # Make the order of the entries independent of the mtime granularity
+            for file_name in self.cache_files():
+                file_path = os.path.join(self.cache_dir, file_name)
+                mtime = os.path.getmtime(file_path)
+                os.utime(file_path, (mtime - 1, mtime - 1))
+        self.assertEqual(waagentcache.MAX_CACHE_FILES, len(self.cache_files()))
+        self.assertTrue(waagentcache.get_code(self.script, self.cache_dir)[1])
+        self.write_script("Version = 0\n")
+        self.assertFalse(waagentcache.get_code(self.script, self.cache_dir)[1])
+
+    def test_untrusted_cache_is_ignored(self):
+        waagentcache.get_code(self.script, self.cache_dir)
+        cache_file = os.path.join(self.cache_dir, self.cache_files()[0])
+        os.chmod(cache_file, 0o666)
+        code, cached = waagentcache.get_code(self.script, self.cache_dir)
+        self.assertFalse(cached)
+
+    def test_corrupt_cache_falls_back(self):
+        waagentcache.get_code(self.script, self.cache_dir)
+        cache_file = os.path.join(self.cache_dir, self.cache_files()[0])
+        with open(cache_file, 'wb') as f:
+            f.write(b'garbage')
+        module = waagentcache.load_source('fakeagent', self.script, self.cache_dir)
+        self.assertEqual(1, module.Version)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+# Bytecode cache for the waagent script
+#
+# waagent is a ~7000 line script without a .py suffix, so Python never writes a .pyc for it and every
+# imp.load_source call (once per handler invocation) compiles it from scratch. This module keeps the
+# compiled code object in a private cache directory, keyed by the interpreter and the hash of the source.
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import binascii
+import hashlib
+import imp
+import marshal
+import os
+import stat
+import sys
+import tempfile
+
+DEFAULT_CACHE_DIR = '/var/lib/waagent/bytecode_cache'
+CACHE_FILE_PREFIX = 'waagent-'
+CACHE_FILE_SUFFIX = '.pyc'
+# The cache is shared by all extensions on the VM, which ship different copies of waagent and run on different
+# interpreters. The least recently used entries beyond this number are removed.
+MAX_CACHE_FILES = 16
+
+
+def _is_private(path):
+    """
+    Only trust a cache file or directory we own and nobody else can write to, since its content is executed.
+    """
+    st = os.lstat(path)
+    return st.st_uid == os.getuid() and not stat.S_ISLNK(st.st_mode) and \
+        not (st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _ensure_cache_dir(cache_dir):
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, 0o700)
+    return _is_private(cache_dir)
+
+
+def _read_cached_code(cache_path):
+    if not os.path.isfile(cache_path) or not _is_private(cache_path):
+        return None
+    with open(cache_path, 'rb') as f:
+        data = f.read()
+    magic = imp.get_magic()
+    if data[:len(magic)] != magic:
+        return None
+    return marshal.loads(data[len(magic):])
+
+
+def _write_cached_code(cache_dir, cache_path, code):
+    fd, temp_path = tempfile.mkstemp(prefix=CACHE_FILE_PREFIX, suffix='.tmp', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(imp.get_magic())
+            f.write(marshal.dumps(code))
+        os.rename(temp_path, cache_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    _trim_cache(cache_dir)
+
+
+def _trim_cache(cache_dir, max_files=MAX_CACHE_FILES):
+    entries = []
+    for file_name in os.listdir(cache_dir):
+        if file_name.startswith(CACHE_FILE_PREFIX) and file_name.endswith(CACHE_FILE_SUFFIX):
+            file_path = os.path.join(cache_dir, file_name)
+            entries.append((os.path.getmtime(file_path), file_path))
+    entries.sort()
+    for mtime, file_path in entries[:max(0, len(entries) - max_files)]:
+        os.remove(file_path)
+
+
+def _get_cache_path(cache_dir, source):
+    """
+    The entry of source for the running interpreter, whose bytecode format is identified by its magic number.
+    """
+    magic = binascii.hexlify(imp.get_magic()).decode('ascii')
+    return os.path.join(cache_dir, CACHE_FILE_PREFIX + magic + '-' + hashlib.sha256(source).hexdigest() +
+                        CACHE_FILE_SUFFIX)
+
+
+def get_code(path, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Return the code object of the script at path, from the cache if its source hash matches, otherwise
+    compile it and store it in the cache. Failing to use the cache is not an error, the script is compiled.
+    :param str path: Path of the script
+    :param str cache_dir: Directory of the cache files
+    :return: (code object, True if it came from the cache)
+    """
+    with open(path, 'rb') as f:
+        source = f.read()
+    cache_path = _get_cache_path(cache_dir, source)
+
+    usable = False
+    try:
+        usable = _ensure_cache_dir(cache_dir)
+        if usable:
+            code = _read_cached_code(cache_path)
+            if code is not None:
+                # The mtime tells _trim_cache which entries are still used
+                os.utime(cache_path, None)
+                return code, True
+    except Exception:
+        pass
+
+    code = compile(source, path, 'exec')
+    if usable:
+        try:
+            _write_cached_code(cache_dir, cache_path, code)
+        except Exception:
+            pass
+    return code, False
+
+
+def load_source(name, path, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Drop-in replacement for imp.load_source(name, path) that goes through the bytecode cache, and falls
+    back to imp.load_source itself if the cached code can't be used.
+    """
+    try:
+        code = get_code(path, cache_dir)[0]
+    except Exception:
+        return imp.load_source(name, path)
+
+    module = imp.new_module(name)
+    module.__file__ = path
+    sys.modules[name] = module
+    try:
+        exec(code, module.__dict__)
+    except Exception:
+        del sys.modules[name]
+        raise
+    return module
@@ -18,14 +18,21 @@
 
 import time
 import datetime
+import errno
 import traceback
+try:
+    import urlparse as urlparser
+except ImportError:
+    import urllib.parse as urlparser
 try:
     import httplib as httplibs
 except ImportError:
     import http.client as httplibs
 import shlex
+import socket
 import subprocess
 import sys
+import threading
 from common import CommonVariables
 from subprocess import *
 from Utils.WAAgentUtil import waagent
@@ -54,6 +61,10 @@ class HttpUtil(object):
                 cls.__instance.proxyHost = Config.get("HttpProxy.Host")
                 cls.__instance.proxyPort = Config.get("HttpProxy.Port")
             cls.__instance.tmpFile = './tmp_file_FD76C85E-406F-4CFA-8EB0-CF18B123365C'
+            # idle keep-alive connections, keyed by (scheme, host) of the storage account or host endpoint
+            cls.__instance.connection_pool = {}
+            cls.__instance.connection_pool_lock = threading.Lock()
+            cls.__instance.max_idle_connections_per_host = 16
         else:
             cls.__instance.logger = hutil
             cls.__instance.logger.log("Returning HttpUtil")
@@ -88,17 +99,16 @@ class HttpUtil(object):
 
     def Call(self, method, sasuri_obj, data, headers, fallback_to_curl = False):
         try:
-            result, resp, errorMsg = self.HttpCallGetResponse(method, sasuri_obj, data, headers)
+            result, resp, errorMsg, responseBody = self.HttpCallGetResponse(method, sasuri_obj, data, headers, responseBodyRequired = True)
             self.logger.log("HttpUtil Call : result: " + str(result) + ", errorMsg: " + str(errorMsg))
             if(result == CommonVariables.success and resp != None):
                 self.logger.log("resp-header: " + str(resp.getheaders()))
             else:
                 self.logger.log("Http connection response is None")
 
-            responseBody = resp.read()
             self.logger.log(" resp status: " + str(resp.status))
             if(responseBody is not None):
-                self.logger.log("responseBody: " + (responseBody).decode('utf-8-sig'))
+                self.logger.log("responseBody: " + responseBody)
 
             if(resp.status == 200 or resp.status == 201):
                 return CommonVariables.success
@@ -112,6 +122,104 @@ class HttpUtil(object):
             else:
                 return CommonVariables.error_http_failure
 
+    def get_connection_key(self, sasuri_obj, isHostCall):
+        if(isHostCall or self.proxyHost == None or self.proxyPort != None):
+            if(isHostCall):
+                return ('http', sasuri_obj.hostname, None)
+            return ('https', sasuri_obj.hostname, None)
+        return ('https', sasuri_obj.hostname, (self.proxyHost, self.proxyPort))
+
+    def create_connection(self, connection_key):
+        scheme, hostname, proxy = connection_key
+        if(proxy is not None):
+            connection = httplibs.HTTPSConnection(proxy[0], proxy[1], timeout = 10)
+            connection.set_tunnel(hostname, 443)
+        elif(scheme == 'http'):
+            connection = httplibs.HTTPConnection(hostname, timeout = 10) # making call with port 80 to make it http call
+        else:
+            connection = httplibs.HTTPSConnection(hostname, timeout = 10)
+        return connection
+
+    def acquire_connection(self, connection_key):
+        """
+        Returns an idle keep-alive connection for the host if there is one, otherwise a new connection.
+        The second return value tells whether the connection was reused.
+        """
+        with self.connection_pool_lock:
+            idle_connections = self.connection_pool.get(connection_key)
+            if idle_connections:
+                return idle_connections.pop(), True
+        return self.create_connection(connection_key), False
+
+    def release_connection(self, connection_key, connection, resp):
+        if(resp is None or resp.will_close):
+            connection.close()
+            return
+        with self.connection_pool_lock:
+            idle_connections = self.connection_pool.setdefault(connection_key, [])
+            if(len(idle_connections) < self.max_idle_connections_per_host):
+                idle_connections.append(connection)
+                return
+        connection.close()
+
+    def warm_up_connections(self, uris, connections_per_host = 1):
+        """
+        Opens keep-alive connections to the hosts of the given uris ahead of time, so that
+        the calls made while the file systems are frozen do not pay the TCP and TLS handshake.
+        """
+        connections_needed = {}
+        for uri in uris or []:
+            try:
+                sasuri_obj = urlparser.urlparse(uri)
+                if(sasuri_obj.hostname is None):
+                    continue
+                connection_key = self.get_connection_key(sasuri_obj, False)
+                connections_needed[connection_key] = min(connections_needed.get(connection_key, 0) + 1, connections_per_host)
+            except Exception as e:
+                self.logger.log("Failed to parse uri for connection warm up with error: %s" % (str(e)))
+        for connection_key, count in connections_needed.items():
+            with self.connection_pool_lock:
+                count = count - len(self.connection_pool.get(connection_key, []))
+            for i in range(0, count):
+                connection = self.create_connection(connection_key)
+                try:
+                    connection.connect()
+                except Exception as e:
+                    self.logger.log("Failed to warm up connection to " + str(connection_key[1]) + " with error: %s" % (str(e)))
+                    connection.close()
+                    break
+                with self.connection_pool_lock:
+                    self.connection_pool.setdefault(connection_key, []).append(connection)
+            self.logger.log("warmed up connections to " + str(connection_key[1]))
+
+    def close_connections(self):
+        with self.connection_pool_lock:
+            connection_pool = self.connection_pool
+            self.connection_pool = {}
+        for idle_connections in connection_pool.values():
+            for connection in idle_connections:
+                connection.close()
+
+    def is_stale_connection_error(self, e):
+        """
+        Whether e is how a request on a dropped keep-alive connection fails: the send fails, or the server
+        closes the connection without sending any byte of a response.
+        """
+        if(isinstance(e, httplibs.BadStatusLine)):
+            # RemoteDisconnected on python 3, an empty status line on python 2
+            return (hasattr(httplibs, 'RemoteDisconnected') and isinstance(e, httplibs.RemoteDisconnected)) or \
+                e.line in ('', "''", "No status line received - the server has closed the connection")
+        if(isinstance(e, socket.error)):
+            return e.args[0] in (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED)
+        return False
+
+    def can_retry(self, method, e, request_sent):
+        """
+        The server may have processed a request it closed the connection on after receiving it, and the snapshot
+        PUT and POST calls are not idempotent. So only a request whose send failed, or an idempotent one, is sent again.
+        """
+        return self.is_stale_connection_error(e) and (not request_sent or method.upper() in ('GET', 'HEAD', 'OPTIONS'))
+
     def HttpCallGetResponse(self, method, sasuri_obj, data, headers , responseBodyRequired = False, isHostCall = False):
         result = CommonVariables.error_http_failure
         resp = None
@@ -122,25 +230,44 @@ class HttpUtil(object):
             resp = None
             self.logger.log("Entered HttpCallGetResponse, isHostCall: " + str(isHostCall))
 
-            if(isHostCall or self.proxyHost == None or self.proxyPort != None):
-                if(isHostCall):
-                    connection = httplibs.HTTPConnection(sasuri_obj.hostname, timeout = 10) # making call with port 80 to make it http call
-                else:
-                    connection = httplibs.HTTPSConnection(sasuri_obj.hostname, timeout = 10)
+            connection_key = self.get_connection_key(sasuri_obj, isHostCall)
+            if(connection_key[2] is None):
+                url = sasuri_obj.path + '?' + sasuri_obj.query
                 self.logger.log("Details of sas uri object  hostname: " + str(sasuri_obj.hostname) + " path: " + str(sasuri_obj.path))
-                connection.request(method=method, url=(sasuri_obj.path + '?' + sasuri_obj.query), body=data, headers = headers)
-                resp = connection.getresponse()
-                if(responseBodyRequired):
-                    responeBody = resp.read().decode('utf-8-sig')
-                connection.close()
             else:
-                connection = httplibs.HTTPSConnection(self.proxyHost, self.proxyPort, timeout = 10)
-                connection.set_tunnel(sasuri_obj.hostname, 443)
                 # If proxy is used, full url is needed.
-                path = "https://{0}:{1}{2}".format(sasuri_obj.hostname, 443, (sasuri_obj.path + '?' + sasuri_obj.query))
-                connection.request(method=method, url=(path), body=data, headers=headers)
-                resp = connection.getresponse()
-                connection.close()
+                url = "https://{0}:{1}{2}".format(sasuri_obj.hostname, 443, (sasuri_obj.path + '?' + sasuri_obj.query))
+            retried = False
+            while True:
+                if(retried):
+                    # the other idle connections of the pool may be just as stale
+                    connection, reused = self.create_connection(connection_key), False
+                else:
+                    connection, reused = self.acquire_connection(connection_key)
+                request_sent = False
+                response_started = False
+                try:
+                    connection.request(method=method, url=url, body=data, headers = headers)
+                    request_sent = True
+                    resp = connection.getresponse()
+                    response_started = True
+                    # the body has to be drained before the connection can be reused
+                    body = resp.read()
+                except (httplibs.HTTPException, socket.error) as e:
+                    connection.close()
+                    if(reused and not retried and not response_started and self.can_retry(method, e, request_sent)):
+                        # the server dropped the idle connection, retry once on a new one
+                        self.logger.log("Reused connection failed with error: " + str(e) + ", retrying on a new connection")
+                        retried = True
+                        continue
+                    raise
+                except Exception:
+                    connection.close()
+                    raise
+                break
+            if(responseBodyRequired):
+                responeBody = body.decode('utf-8-sig')
+            self.release_connection(connection_key, connection, resp)
             result = CommonVariables.success
         except Exception as e:
             errorMsg = str(datetime.datetime.now()) +  " Failed to call http with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
@@ -8,6 +8,7 @@ try:
 except ImportError:
     import configparser as ConfigParsers
 from common import CommonVariables
+from Utils import HandlerUtil
 from pwd import getpwuid
 from stat import *
 import traceback
@@ -21,6 +22,8 @@ import traceback
     # "pluginName0" : "oracle_plugin",      the python plugin file will have same name
     # "pluginPath0" : "/abc/xyz/"
     # "pluginConfigPath0" : "sdf/sdf/abcd.json"
+    # "pluginDependsOn0" : "mysql_plugin, postgres_plugin"   optional, prescript starts after theirs finished,
+    #                                                          postscript runs before theirs
     #
     #
     # errorcode policy
@@ -39,9 +42,35 @@ class PluginHostError(object):
         return 'Plugin :- ', self.pluginName , ' ErrorCode :- ' + str(self.errorCode)
 
 
+class PluginTiming(object):
+    def __init__(self, pluginName):
+        self.pluginName = pluginName
+        self.startTime = None
+        self.endTime = None
+        self.timedOut = False
+
+    def duration(self):
+        if self.startTime is None or self.endTime is None:
+            return None
+        return self.endTime - self.startTime
+
+    def __str__(self):
+        timingStr = self.pluginName + ':'
+        if self.startTime is None:
+            timingStr += 'notStarted'
+        else:
+            timingStr += 'start=' + time.strftime('%H:%M:%S', time.gmtime(self.startTime)) + '.%03d' % int((self.startTime % 1) * 1000)
+            if self.endTime is not None:
+                timingStr += ',duration=%.3f' % self.duration()
+        if self.timedOut:
+            timingStr += ',timedOut'
+        return timingStr
+
+
 class PluginHostResult(object):
     def __init__(self):
         self.errors = []
+        self.timeline = []
         self.anyScriptFailed = False
         self.continueBackup = True
         self.errorCode = 0
@@ -73,6 +102,9 @@ class PluginHost(object):
         self.postScriptCompleted = []
         self.postScriptResult = []
         self.pollTime = 3
+        self.pluginDependsOn = []
+        self.preScriptTimeline = []
+        self.postScriptTimeline = []
 
     def pre_check(self):
         self.logger.log('Loading script modules now...',True,'Info')
@@ -154,6 +186,11 @@ class PluginHost(object):
                     self.logger.log('Validate Scripts output: errorCode - {0} dobackup - {1} fsFreeze_on - {2} pollTime - {3}'.format(errorCode, dobackup, fsFreeze_on, self.pollTime), True)
                     self.noOfPlugins = self.noOfPlugins + 1
                     self.pluginName.append(pname)
+                    pdepends = []
+                    if config.has_option('pre_post', 'pluginDependsOn'+str(self.noOfPlugins - 1)):
+                        pdepends = [dname.strip() for dname in config.get('pre_post','pluginDependsOn'+str(self.noOfPlugins - 1)).split(',') if dname.strip() != '']
+                        self.logger.log('Plugin ' + pname + ' depends on ' + str(pdepends), True)
+                    self.pluginDependsOn.append(pdepends)
                     self.preScriptCompleted.append(False)
                     self.preScriptResult.append(None)
                     self.postScriptCompleted.append(False)
@@ -162,6 +199,8 @@ class PluginHost(object):
                 len = len - 1
             if self.noOfPlugins != 0:
                 self.modulesLoaded = True
+                if not self.validate_dependencies():
+                    errorCode = CommonVariables.FailedPrepostPluginhostConfigParsing
 
         except Exception as err:
             errMsg = 'Error in reading PluginHost config file : %s, stack trace: %s' % (str(err), traceback.format_exc())
@@ -193,94 +232,158 @@ class PluginHost(object):
         return permissions
 
 
-    def pre_script(self):
-
-            # Runs pre_script() for all plugins and maintains a timer
-
-
+    def validate_dependencies(self):
+
+            # Checks that every pluginDependsOn entry names a loaded plugin and that
+            # the dependencies do not form a cycle, otherwise the plugins would never start
+
+        for j in range(0, self.noOfPlugins):
+            for dname in self.pluginDependsOn[j]:
+                if dname not in self.pluginName:
+                    self.logger.log('Plugin ' + self.pluginName[j] + ' depends on ' + dname + ' which is not loaded', True, 'Error')
+                    return False
+        resolved = []
+        while len(resolved) < self.noOfPlugins:
+            progress = False
+            for j in range(0, self.noOfPlugins):
+                if j not in resolved and all(self.pluginName.index(dname) in resolved for dname in self.pluginDependsOn[j]):
+                    resolved.append(j)
+                    progress = True
+            if not progress:
+                self.logger.log('Plugin dependencies contain a cycle', True, 'Error')
+                return False
+        return True
+
+    def get_dependencies(self, reverse):
+
+            # Returns, for every plugin index, the indices of the plugins it has to wait for.
+            # Postscripts undo the prescripts, so they run in reverse dependency order.
+
+        dependencies = [[] for j in range(0, self.noOfPlugins)]
+        for j in range(0, self.noOfPlugins):
+            for dname in self.pluginDependsOn[j]:
+                i = self.pluginName.index(dname)
+                if reverse:
+                    dependencies[i].append(j)
+                else:
+                    dependencies[j].append(i)
+        return dependencies
+
+    def run_plugins(self, scriptName, scriptCompleted, scriptResult, dependencies, skipAfterTimeout):
+
+            # Starts the scripts of all plugins whose dependencies are done and waits on a
+            # condition which every plugin thread notifies when done, so completion is noticed
+            # immediately instead of on the next poll. Returns the timeline of the plugins.
+            # A dependency is done when it finished or passed its deadline. With skipAfterTimeout,
+            # plugins depending on one which timed out are not started at all.
+
+        condition = threading.Condition()
+        finished = [False] * self.noOfPlugins
+        timeline = [PluginTiming(pname) for pname in self.pluginName]
+
+        def run_plugin(pluginIndex):
+            try:
+                getattr(self.plugins[pluginIndex], scriptName)(pluginIndex, scriptCompleted, scriptResult)
+            except Exception as err:
+                errMsg = 'Error in running ' + scriptName + ' for the plugin ' + self.pluginName[pluginIndex] + ': %s, stack trace: %s' % (str(err), traceback.format_exc())
+                self.logger.log(errMsg, True, 'Error')
+            finally:
+                condition.acquire()
+                try:
+                    timeline[pluginIndex].endTime = time.time()
+                    finished[pluginIndex] = True
+                    condition.notify_all()
+                finally:
+                    condition.release()
+
+        def dependency_done(i):
+            if skipAfterTimeout:
+                return finished[i] and not timeline[i].timedOut
+            return finished[i] or timeline[i].timedOut
+
+        #every plugin gets timeoutInSeconds from its own start, waiting two poll intervals more to escape race
+        #condition between Host and script timing out
+        timeout = self.timeoutInSeconds + 2 * self.pollTime
+        deadlines = [None] * self.noOfPlugins
+        condition.acquire()
+        try:
+            while True:
+                now = time.time()
+                for j in range(0, self.noOfPlugins):
+                    if timeline[j].startTime is not None and not finished[j] and now >= deadlines[j]:
+                        timeline[j].timedOut = True
+                for j in range(0, self.noOfPlugins):
+                    if timeline[j].startTime is None and all(dependency_done(i) for i in dependencies[j]):
+                        timeline[j].startTime = time.time()
+                        deadlines[j] = timeline[j].startTime + timeout
+                        t1 = threading.Thread(target=run_plugin, args=(j,))
+                        t1.daemon = True
+                        t1.start()
+                running = [j for j in range(0, self.noOfPlugins)
+                           if timeline[j].startTime is not None and not finished[j] and not timeline[j].timedOut]
+                #the plugins which did not start depend on one which timed out
+                if len(running) == 0:
+                    break
+                condition.wait(min(deadlines[j] for j in running) - time.time())
+            for j in range(0, self.noOfPlugins):
+                if not finished[j]:
+                    timeline[j].timedOut = True
+        finally:
+            condition.release()
+        return timeline
+
+    def collect_result(self, scriptCompleted, scriptResult, timeline, timeoutErrorCode, failedErrorCode):
         result = PluginHostResult()
-        curr = 0
-        for plugin in self.plugins:
-            t1 = threading.Thread(target=plugin.pre_script, args=(curr, self.preScriptCompleted, self.preScriptResult))
-            t1.start()
-            curr = curr + 1
-
-        flag = True
-        for i in range(0, int(self.timeoutInSeconds/self.pollTime) + 2): #waiting 10 more seconds to escape race condition between Host and script timing out
-            time.sleep(self.pollTime)
-            flag = True
-            for j in range(0,self.noOfPlugins):
-                flag = flag & self.preScriptCompleted[j]
-            if flag:
-                break
-
-
+        result.timeline = timeline
         continueBackup = True
-        #Plugin timed out
-        if not flag:
-            ecode = CommonVariables.FailedPrepostPluginhostPreTimeout
-            result.anyScriptFailed = True
+        for j in range(0, self.noOfPlugins):
+            if timeline[j].timedOut:
+                ecode = timeoutErrorCode
+                self.logger.log('Plugin ' + self.pluginName[j] + ' timed out at PluginHost side', True, 'Error')
+            elif not scriptCompleted[j] or scriptResult[j] is None:
+                ecode = failedErrorCode
+            else:
+                ecode = scriptResult[j].errorCode
+                continueBackup = continueBackup & scriptResult[j].continueBackup
+            if ecode != CommonVariables.PrePost_PluginStatus_Success:
+                result.anyScriptFailed = True
             presult = PluginHostError(errorCode = ecode, pluginName = self.pluginName[j])
             result.errors.append(presult)
-        else:
-            for j in range(0,self.noOfPlugins):
-                ecode = CommonVariables.FailedPrepostPluginhostPreTimeout
-                continueBackup = continueBackup & self.preScriptResult[j].continueBackup
-                if self.preScriptCompleted[j]:
-                    ecode = self.preScriptResult[j].errorCode
-                if ecode != CommonVariables.PrePost_PluginStatus_Success:
-                    result.anyScriptFailed = True
-                presult = PluginHostError(errorCode = ecode, pluginName = self.pluginName[j])
-                result.errors.append(presult)
         result.continueBackup = continueBackup
-        self.logger.log('Finished prescript execution from PluginHost side. Continue Backup: '+str(continueBackup),True,'Info')
         return result
 
-    def post_script(self):
-
-            # Runs post_script() for all plugins and maintains a timer
+    def pre_script(self):
 
+            # Runs pre_script() for all plugins in dependency order and records their timeline
 
         result = PluginHostResult()
         if not self.modulesLoaded:
             return result
 
-        self.logger.log('Starting postscript for all modules.',True,'Info')
-        curr = 0
-        for plugin in self.plugins:
-            t1 = threading.Thread(target=plugin.post_script, args=(curr, self.postScriptCompleted, self.postScriptResult))
-            t1.start()
-            curr = curr + 1
-
-        flag = True
-        for i in range(0, int(self.timeoutInSeconds/self.pollTime) + 2): #waiting 10 more seconds to escape race condition between Host and script timing out
-            time.sleep(self.pollTime)
-            flag = True
-            for j in range(0,self.noOfPlugins):
-                flag = flag & self.postScriptCompleted[j]
-            if flag:
-                break
+        self.preScriptTimeline = self.run_plugins('pre_script', self.preScriptCompleted, self.preScriptResult, self.get_dependencies(reverse = False), True)
+        result = self.collect_result(self.preScriptCompleted, self.preScriptResult, self.preScriptTimeline,
+                                     CommonVariables.FailedPrepostPluginhostPreTimeout, CommonVariables.FailedPrepostPreScriptFailed)
+        timelineStr = ';'.join(str(timing) for timing in self.preScriptTimeline)
+        HandlerUtil.HandlerUtility.add_to_telemetery_data("preScriptTimeline", timelineStr)
+        self.logger.log('Prescript timeline: ' + timelineStr, True, 'Info')
+        self.logger.log('Finished prescript execution from PluginHost side. Continue Backup: '+str(result.continueBackup),True,'Info')
+        return result
 
-        continueBackup = True
+    def post_script(self):
 
-        #Plugin timed out
-        if not flag:
-            ecode = CommonVariables.FailedPrepostPluginhostPostTimeout
-            result.anyScriptFailed = True
-            presult = PluginHostError(errorCode = ecode, pluginName = self.pluginName[j])
-            result.errors.append(presult)
-        else:
-            for j in range(0,self.noOfPlugins):
-                ecode = CommonVariables.FailedPrepostPluginhostPostTimeout
-                continueBackup = continueBackup & self.postScriptResult[j].continueBackup
-                if self.postScriptCompleted[j]:
-                    ecode = self.postScriptResult[j].errorCode
-                if ecode != CommonVariables.PrePost_PluginStatus_Success:
-                    result.anyScriptFailed = True
-                presult = PluginHostError(errorCode = ecode, pluginName = self.pluginName[j])
-                result.errors.append(presult)
-        result.continueBackup = continueBackup
-        self.logger.log('Finished postscript execution from PluginHost side. Continue Backup: '+str(continueBackup),True,'Info')
-        return result
+            # Runs post_script() for all plugins in reverse dependency order and records their timeline
 
+        result = PluginHostResult()
+        if not self.modulesLoaded:
+            return result
 
+        self.logger.log('Starting postscript for all modules.',True,'Info')
+        #every postscript runs, even after one it has to wait for timed out, so no application stays quiesced
+        self.postScriptTimeline = self.run_plugins('post_script', self.postScriptCompleted, self.postScriptResult, self.get_dependencies(reverse = True), False)
+        result = self.collect_result(self.postScriptCompleted, self.postScriptResult, self.postScriptTimeline,
+                                     CommonVariables.FailedPrepostPluginhostPostTimeout, CommonVariables.FailedPrepostPostScriptFailed)
+        timelineStr = ';'.join(str(timing) for timing in self.postScriptTimeline)
+        HandlerUtil.HandlerUtility.add_to_telemetery_data("postScriptTimeline", timelineStr)
+        self.logger.log('Postscript timeline: ' + timelineStr, True, 'Info')
+        self.logger.log('Finished postscript execution from PluginHost side. Continue Backup: '+str(result.continueBackup),True,'Info')
+        return result
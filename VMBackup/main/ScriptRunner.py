@@ -1,5 +1,6 @@
 import json
 import subprocess
+import threading
 import time
 import os
 from pwd import getpwuid
@@ -190,6 +191,47 @@ class ScriptRunner(object):
 
         return errorCode,dobackup,self.fsFreeze_on, self.pollSleepTime
 
+    def wait_for_process(self, process, timeout):
+
+            # Waits until the process exits or timeout seconds passed, whichever comes first, and
+            # returns its return code or None on timeout. communicate() drains the output pipes,
+            # so a script writing a lot of output can not block on them.
+
+        exited = threading.Event()
+
+        def wait_process():
+            try:
+                process.communicate()
+            finally:
+                exited.set()
+
+        waiter = threading.Thread(target=wait_process)
+        waiter.daemon = True
+        waiter.start()
+        exited.wait(max(0, timeout))
+        if not exited.is_set():
+            return None
+        return process.returncode
+
+    def run_script(self, scriptType, paramsStr, noOfRetries):
+
+            # Runs the script and runs it again on failure, up to noOfRetries times, as long as
+            # timeoutInSeconds have not passed since it was first started.
+            # Returns the last return code, or None on timeout, and the number of retries done.
+
+        deadline = time.time() + self.timeoutInSeconds
+        cnt = 0
+        while True:
+            process = subprocess.Popen(paramsStr, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            returncode = self.wait_for_process(process, deadline - time.time())
+            if returncode is None:
+                self.logger.log(scriptType + ' for '+self.pluginName+' timed out.',True,'Error')
+                return None, cnt
+            if returncode == CommonVariables.PrePost_ScriptStatus_Success or cnt >= noOfRetries or time.time() >= deadline:
+                return returncode, cnt
+            self.logger.log(scriptType + ' for '+self.pluginName+' failed. Retrying...',True,'Info')
+            cnt = cnt + 1
+
     def pre_script(self, pluginIndex, preScriptCompleted, preScriptResult):
 
             # Generates a system call to run the prescript
@@ -206,32 +248,12 @@ class ScriptRunner(object):
             paramsStr.append(str(param))
 
         self.logger.log('Running prescript for '+self.pluginName+' module...',True,'Info')
-        process = subprocess.Popen(paramsStr, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        flag_timeout = False
-        curr = 0
-        cnt = 0
-        while True:
-            while process.poll() is None:
-                if curr >= self.pollTotalCount:
-                    self.logger.log('Prescript for '+self.pluginName+' timed out.',True,'Error')
-                    flag_timeout = True
-                    break
-                curr = curr + 1
-                time.sleep(self.pollSleepTime)
-            if process.returncode is CommonVariables.PrePost_ScriptStatus_Success:
-                break
-            if flag_timeout:
-                break
-            if cnt >= self.preScriptNoOfRetries:
-                break
-            self.logger.log('Prescript for '+self.pluginName+' failed. Retrying...',True,'Info')
-            cnt = cnt + 1
-
+        returncode, cnt = self.run_script('Prescript', paramsStr, self.preScriptNoOfRetries)
+        flag_timeout = returncode is None
 
         result.noOfRetries = cnt
         if not flag_timeout:
-            result.errorCode = process.returncode
+            result.errorCode = returncode
             if result.errorCode != CommonVariables.PrePost_ScriptStatus_Success:
                 self.logger.log('Prescript for '+self.pluginName+' failed with error code: '+str(result.errorCode)+' .',True,'Error')
                 result.continueBackup = self.continueBackupOnFailure
@@ -261,31 +283,12 @@ class ScriptRunner(object):
             paramsStr.append(str(param))
 
         self.logger.log('Running postscript for '+self.pluginName+' module...',True,'Info')
-        process = subprocess.Popen(paramsStr, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        flag_timeout = False
-        curr = 0
-        cnt = 0
-        while True:
-            while process.poll() is None:
-                if curr >= self.pollTotalCount:
-                    self.logger.log('Postscript for '+self.pluginName+' timed out.',True,'Error')
-                    flag_timeout = True
-                    break
-                curr = curr + 1
-                time.sleep(self.pollSleepTime)
-            if process.returncode is CommonVariables.PrePost_ScriptStatus_Success:
-                break
-            if flag_timeout:
-                break
-            if cnt >= self.postScriptNoOfRetries:
-                break
-            self.logger.log('Postscript for '+self.pluginName+' failed. Retrying...',True,'Info')
-            cnt = cnt + 1
+        returncode, cnt = self.run_script('Postscript', paramsStr, self.postScriptNoOfRetries)
+        flag_timeout = returncode is None
 
         result.noOfRetries = cnt
         if not flag_timeout:
-            result.errorCode = process.returncode
+            result.errorCode = returncode
             if result.errorCode != CommonVariables.PrePost_ScriptStatus_Success:
                 self.logger.log('Postscript for '+self.pluginName+' failed with error code: '+str(result.errorCode)+' .',True,'Error')
                 result.errorCode = CommonVariables.FailedPrepostPostScriptFailed
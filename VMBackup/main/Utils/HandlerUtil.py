@@ -75,8 +75,10 @@ except ImportError:
 from common import CommonVariables
 import platform
 import subprocess
+import threading
 import datetime
 import Utils.Status
+import Utils.MountInfo
 from MachineIdentity import MachineIdentity
 import ExtensionErrorCodeHelper
 import traceback
@@ -89,8 +91,82 @@ class HandlerContext:
         self._version = '0.0'
         return
 
+class ConfigFileCache(object):
+    """
+    In-process view of one section of an ini config file. The file is parsed once and parsed
+    again only when its inode, mtime or size changes, so lookups cost a stat instead of a parse.
+    """
+    def __init__(self, configfile, section):
+        self.configfile = configfile
+        self.section = section
+        self.file_signature = None
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get_file_signature(self):
+        try:
+            stat = os.stat(self.configfile)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+    def load(self):
+        values = {}
+        config = ConfigParsers.ConfigParser()
+        config.read(self.configfile)
+        if config.has_section(self.section):
+            for option in config.options(self.section):
+                try:
+                    values[option] = config.get(self.section, option)
+                except Exception:
+                    pass
+        return values
+
+    def get(self, key):
+        file_signature = self.get_file_signature()
+        with self.lock:
+            if file_signature != self.file_signature:
+                if file_signature is None:
+                    self.values = {}
+                else:
+                    self.values = self.load()
+                self.file_signature = file_signature
+            return self.values.get(key.lower())
+
+    def set(self, key, value):
+        """
+        Updates the key in the config file. The new content is written to a temp file
+        which is then renamed over the config file, so readers never see a partial file.
+        """
+        configdir = os.path.dirname(self.configfile)
+        if not os.path.exists(configdir):
+            os.makedirs(configdir)
+        with self.lock:
+            config = ConfigParsers.RawConfigParser()
+            file_mode = 0o644
+            if os.path.exists(self.configfile):
+                config.read(self.configfile)
+                file_mode = os.stat(self.configfile).st_mode & 0o777
+            if not config.has_section(self.section):
+                config.add_section(self.section)
+            config.set(self.section, key, value)
+            fd, temp_path = tempfile.mkstemp(dir = configdir, prefix = '.' + os.path.basename(self.configfile))
+            try:
+                with os.fdopen(fd, 'w') as config_file:
+                    config.write(config_file)
+                    config_file.flush()
+                    os.fsync(config_file.fileno())
+                os.chmod(temp_path, file_mode)
+                os.rename(temp_path, self.configfile)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            self.file_signature = None
+
 class HandlerUtility:
     telemetry_data = {} 
+    config_cache = ConfigFileCache('/etc/azure/vmbackup.conf', 'SnapshotThread')
     serializable_telemetry_data = []
     ExtErrorCode = ExtensionErrorCodeHelper.ExtensionErrorCodeEnum.success
     SnapshotConsistency = Utils.Status.SnapshotConsistencyType.none
@@ -323,15 +399,9 @@ class HandlerUtility:
     '''
 
     def get_value_from_configfile(self, key):
-        global backup_logger
         value = None
-        configfile = '/etc/azure/vmbackup.conf'
         try :
-            if os.path.exists(configfile):
-                config = ConfigParsers.ConfigParser()
-                config.read(configfile)
-                if config.has_option('SnapshotThread',key):
-                    value = config.get('SnapshotThread',key)
+            value = HandlerUtility.config_cache.get(key)
         except Exception as e:
             pass
 
@@ -367,24 +437,9 @@ class HandlerUtility:
         return int(value)
  
     def set_value_to_configfile(self, key, value):
-        configfile = '/etc/azure/vmbackup.conf'
         try :
             self.log('setting ' + str(key)  + 'in config file to ' + str(value) , 'Info')
-            if not os.path.exists(os.path.dirname(configfile)):
-                os.makedirs(os.path.dirname(configfile))
-            config = ConfigParsers.RawConfigParser()
-            if os.path.exists(configfile):
-                config.read(configfile)
-                if config.has_section('SnapshotThread'):
-                    if config.has_option('SnapshotThread', key):
-                        config.remove_option('SnapshotThread', key)
-                else:
-                    config.add_section('SnapshotThread')
-            else:
-                config.add_section('SnapshotThread')
-            config.set('SnapshotThread', key, value)
-            with open(configfile, 'w') as config_file:
-                config.write(config_file)
+            HandlerUtility.config_cache.set(key, value)
         except Exception as e:
             errorMsg = " Unable to set config file.key is "+ key +"with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
             self.log(errorMsg, 'Warning')
@@ -416,40 +471,19 @@ class HandlerUtility:
 
     def get_total_used_size(self):
         try:
-            df = subprocess.Popen(["df" , "-k" , "--output=source,fstype,size,used,avail,pcent,target"], stdout=subprocess.PIPE)
-            '''
-            Sample output of the df command
-
-            Filesystem                                              Type     1K-blocks    Used    Avail Use% Mounted on
-            /dev/sda2                                               xfs       52155392 3487652 48667740   7% /
-            devtmpfs                                                devtmpfs   7170976       0  7170976   0% /dev
-            tmpfs                                                   tmpfs      7180624       0  7180624   0% /dev/shm
-            tmpfs                                                   tmpfs      7180624  760496  6420128  11% /run
-            tmpfs                                                   tmpfs      7180624       0  7180624   0% /sys/fs/cgroup
-            /dev/sda1                                               ext4        245679  151545    76931  67% /boot
-            /dev/sdb1                                               ext4      28767204 2142240 25140628   8% /mnt/resource
-            /dev/mapper/mygroup-thinv1                              xfs        1041644   33520  1008124   4% /bricks/brick1
-            /dev/mapper/mygroup-85197c258a54493da7880206251f5e37_0  xfs        1041644   33520  1008124   4% /run/gluster/snaps/85197c258a54493da7880206251f5e37/brick2
-            /dev/mapper/mygroup2-thinv2                             xfs       15717376 5276944 10440432  34% /tmp/test
-            /dev/mapper/mygroup2-63a858543baf4e40a3480a38a2f232a0_0 xfs       15717376 5276944 10440432  34% /run/gluster/snaps/63a858543baf4e40a3480a38a2f232a0/brick2
-            tmpfs                                                   tmpfs      1436128       0  1436128   0% /run/user/1000
-            //Centos72test/cifs_test                                cifs      52155392 4884620 47270772  10% /mnt/cifs_test2
-
-            '''
-            process_wait_time = 30
-            while(process_wait_time >0 and df.poll() is None):
-                time.sleep(1)
-                process_wait_time -= 1
-
-            output = df.stdout.read()
-            output = output.split("\n")
             total_used = 0
             total_used_network_shares = 0
             total_used_gluster = 0
             network_fs_types = []
-            for i in range(1,len(output)-1):
-                device, fstype, size, used, available, percent, mountpoint = output[i].split()
-                self.log("Device name : {0} fstype : {1} size : {2} used space in KB : {3} available space : {4} mountpoint : {5}".format(device,fstype,size,used,available,mountpoint))
+            for mount_entry in Utils.MountInfo.get_df_mounts(Utils.MountInfo.get_mount_topology(), Utils.MountInfo.PSEUDO_FILE_SYSTEMS):
+                device = mount_entry.source
+                fstype = mount_entry.fstype
+                mountpoint = mount_entry.mount_point
+                statvfs_result = Utils.MountInfo.statvfs_with_timeout(mountpoint, 5)
+                if statvfs_result is None or statvfs_result.f_blocks == 0:
+                    continue
+                used = Utils.MountInfo.used_kilobytes(statvfs_result)
+                self.log("Device name : {0} fstype : {1} used space in KB : {2} mountpoint : {3}".format(device,fstype,used,mountpoint))
                 if "fuse" in fstype.lower() or "nfs" in fstype.lower() or "cifs" in fstype.lower():
                     if fstype not in network_fs_types :
                         network_fs_types.append(fstype)
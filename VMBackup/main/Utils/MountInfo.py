@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import threading
+
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+SYS_BLOCK_PATH = '/sys/block'
+# kernel pseudo file systems, df does not list them either
+PSEUDO_FILE_SYSTEMS = ['autofs', 'proc', 'sysfs', 'cgroup', 'cgroup2', 'devpts', 'debugfs', 'tracefs', 'securityfs', 'pstore', 'mqueue', 'hugetlbfs', 'configfs', 'fusectl', 'rpc_pipefs', 'binfmt_misc', 'bpf', 'selinuxfs', 'efivarfs', 'nsfs']
+
+class MountInfoEntry(object):
+    def __init__(self, mount_id, parent_id, major_minor, root, mount_point, fstype, source):
+        self.mount_id = mount_id
+        self.parent_id = parent_id
+        self.major_minor = major_minor
+        self.root = root
+        self.mount_point = mount_point
+        self.fstype = fstype
+        self.source = source
+
+    def __str__(self):
+        return "mount_point:" + str(self.mount_point) + " source:" + str(self.source) + " fstype:" + str(self.fstype) + " major_minor:" + str(self.major_minor) + " root:" + str(self.root)
+
+class BlockDevice(object):
+    def __init__(self, name, type, major_minor, parent = None):
+        self.name = name
+        self.type = type
+        self.major_minor = major_minor
+        self.parent = parent
+
+    def __str__(self):
+        return "name:" + str(self.name) + " type:" + str(self.type) + " major_minor:" + str(self.major_minor) + " parent:" + str(self.parent)
+
+def unescape_mount_field(field):
+    # mountinfo escapes space, tab, newline and backslash as octal sequences
+    return re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), field)
+
+def parse_mount_info(lines):
+    """
+    Parses the lines of /proc/<pid>/mountinfo, returns the entries in mount order.
+
+    36 35 98:0 /mnt1 /mnt2 rw,noatime master:1 - ext3 /dev/root rw,errors=continue
+    (1)(2)(3)   (4)   (5)      (6)      (7)   (8) (9)   (10)         (11)
+    """
+    entries = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 10 or '-' not in fields[6:]:
+            continue
+        separator = fields.index('-', 6)
+        if len(fields) < separator + 3:
+            continue
+        entries.append(MountInfoEntry(mount_id = fields[0],
+                                      parent_id = fields[1],
+                                      major_minor = fields[2],
+                                      root = unescape_mount_field(fields[3]),
+                                      mount_point = unescape_mount_field(fields[4]),
+                                      fstype = fields[separator + 1],
+                                      source = unescape_mount_field(fields[separator + 2])))
+    return entries
+
+def read_mount_info(mountinfo_path = MOUNTINFO_PATH):
+    with open(mountinfo_path, 'r') as mountinfo_file:
+        return parse_mount_info(mountinfo_file.readlines())
+
+def statvfs_with_timeout(path, timeout):
+    """
+    Runs os.statvfs in a helper thread so that a hung network mount can not block the caller.
+    Returns None when the call did not complete within timeout seconds or failed.
+    """
+    result = []
+    def do_statvfs():
+        try:
+            result.append(os.statvfs(path))
+        except OSError:
+            pass
+    statvfs_thread = threading.Thread(target = do_statvfs)
+    statvfs_thread.daemon = True
+    statvfs_thread.start()
+    statvfs_thread.join(timeout)
+    if statvfs_thread.is_alive() or len(result) == 0:
+        return None
+    return result[0]
+
+def used_kilobytes(statvfs_result):
+    return (statvfs_result.f_blocks - statvfs_result.f_bfree) * statvfs_result.f_frsize // 1024
+
+def read_sys_file(path):
+    try:
+        with open(path, 'r') as sys_file:
+            return sys_file.read().strip()
+    except (IOError, OSError):
+        return None
+
+def get_block_device_type(sys_block_path, name):
+    # same TYPE values as reported by lsblk
+    if name.startswith('loop'):
+        return 'loop'
+    if name.startswith('sr'):
+        return 'rom'
+    if name.startswith('md'):
+        return 'md'
+    if name.startswith('dm-'):
+        dm_uuid = read_sys_file(os.path.join(sys_block_path, name, 'dm', 'uuid')) or ''
+        if dm_uuid.startswith('LVM-'):
+            return 'lvm'
+        if dm_uuid.startswith('CRYPT-'):
+            return 'crypt'
+        if dm_uuid.startswith('mpath-'):
+            return 'mpath'
+        return 'dm'
+    return 'disk'
+
+def read_block_devices(sys_block_path = SYS_BLOCK_PATH):
+    """
+    Lists the block devices and their partitions from sysfs, without running lsblk.
+    """
+    block_devices = []
+    for name in os.listdir(sys_block_path):
+        device_path = os.path.join(sys_block_path, name)
+        major_minor = read_sys_file(os.path.join(device_path, 'dev'))
+        if major_minor is None:
+            continue
+        device_name = name
+        if name.startswith('dm-'):
+            device_name = read_sys_file(os.path.join(device_path, 'dm', 'name')) or name
+        block_devices.append(BlockDevice(device_name, get_block_device_type(sys_block_path, name), major_minor))
+        try:
+            children = os.listdir(device_path)
+        except OSError:
+            continue
+        for child in children:
+            if os.path.exists(os.path.join(device_path, child, 'partition')):
+                partition_major_minor = read_sys_file(os.path.join(device_path, child, 'dev'))
+                if partition_major_minor is not None:
+                    block_devices.append(BlockDevice(child, 'part', partition_major_minor, device_name))
+    return block_devices
+
+class MountTopology(object):
+    """
+    Index of the mount table joined with the block devices, built from /proc/self/mountinfo
+    and /sys/block in a single pass. Lookups by mount point, source device and major:minor
+    are dictionary lookups, and building it does not start any process.
+    """
+    def __init__(self, mountinfo_path = MOUNTINFO_PATH, sys_block_path = SYS_BLOCK_PATH):
+        self.mounts = read_mount_info(mountinfo_path)
+        self.block_devices = []
+        try:
+            self.block_devices = read_block_devices(sys_block_path)
+        except OSError:
+            pass
+        self.block_devices_by_major_minor = {}
+        for block_device in self.block_devices:
+            self.block_devices_by_major_minor[block_device.major_minor] = block_device
+        self.by_mount_point = {}
+        self.by_source = {}
+        self.by_major_minor = {}
+        for mount_entry in self.mounts:
+            # a mount point mounted over is hidden, only the last mount on it is visible
+            self.by_mount_point[mount_entry.mount_point] = mount_entry
+            self.by_source.setdefault(mount_entry.source, []).append(mount_entry)
+            self.by_major_minor.setdefault(mount_entry.major_minor, []).append(mount_entry)
+        self.source_major_minor = {}
+
+    def visible_mounts(self):
+        return [mount_entry for mount_entry in self.mounts if self.by_mount_point.get(mount_entry.mount_point) is mount_entry]
+
+    def get_mount(self, mount_point):
+        return self.by_mount_point.get(mount_point)
+
+    def get_mounts_of_source(self, source):
+        return self.by_source.get(source, [])
+
+    def get_mounts_of_major_minor(self, major_minor):
+        return self.by_major_minor.get(major_minor, [])
+
+    def get_block_device(self, mount_entry):
+        """
+        Returns the block device backing the mount, or None for mounts which are not backed by one.
+        Btrfs reports an anonymous major:minor in mountinfo, so the source device node is used first.
+        """
+        major_minor = self.get_source_major_minor(mount_entry.source)
+        if major_minor is not None and major_minor in self.block_devices_by_major_minor:
+            return self.block_devices_by_major_minor[major_minor]
+        return self.block_devices_by_major_minor.get(mount_entry.major_minor)
+
+    def get_source_major_minor(self, source):
+        if not source.startswith('/dev/'):
+            return None
+        if source not in self.source_major_minor:
+            major_minor = None
+            try:
+                rdev = os.stat(source).st_rdev
+                major_minor = str(os.major(rdev)) + ':' + str(os.minor(rdev))
+            except OSError:
+                pass
+            self.source_major_minor[source] = major_minor
+        return self.source_major_minor[source]
+
+def get_df_mounts(mount_topology, pseudo_file_systems):
+    """
+    Picks the mounts the way df does: only visible mounts, no pseudo file systems,
+    and a device mounted at several places is listed once at its shortest mount point.
+    """
+    mounts_by_device = {}
+    device_order = []
+    for mount_entry in mount_topology.visible_mounts():
+        if mount_entry.fstype in pseudo_file_systems:
+            continue
+        current_entry = mounts_by_device.get(mount_entry.major_minor)
+        if current_entry is None:
+            mounts_by_device[mount_entry.major_minor] = mount_entry
+            device_order.append(mount_entry.major_minor)
+        elif len(mount_entry.mount_point) < len(current_entry.mount_point):
+            mounts_by_device[mount_entry.major_minor] = mount_entry
+    return [mounts_by_device[major_minor] for major_minor in device_order]
+
+shared_mount_topology = None
+
+def get_mount_topology(refresh = False):
+    """
+    Returns the topology shared by the freezer and the size calculation, building it when
+    there is none yet or when refresh is requested.
+    """
+    global shared_mount_topology
+    if shared_mount_topology is None or refresh:
+        shared_mount_topology = MountTopology()
+    return shared_mount_topology
@@ -9,18 +9,18 @@ import base64
 import json
 import tempfile
 import time
-from Utils.DiskUtil import DiskUtil
+from Utils import MountInfo
 import Utils.HandlerUtil
 import traceback
-import subprocess
 
 class SizeCalculation(object):
 
-    def __init__(self,patching,logger,para_parser):
+    def __init__(self,patching,logger,para_parser,mount_topology = None):
         self.patching=patching
+        self.mount_topology = mount_topology
         self.logger=logger
-        self.file_systems_info = []
         self.non_physical_file_systems = ['fuse', 'nfs', 'cifs', 'overlay', 'aufs', 'lustre', 'secfs2', 'zfs', 'btrfs', 'iso']
+        self.statvfs_timeout = 5
         self.known_fs = ['ext3', 'ext4', 'jfs', 'xfs', 'reiserfs', 'devtmpfs', 'tmpfs', 'rootfs', 'fuse', 'nfs', 'cifs', 'overlay', 'aufs', 'lustre', 'secfs2', 'zfs', 'btrfs', 'iso']
         self.isOnlyOSDiskBackupEnabled = False
         try:
@@ -39,94 +39,28 @@ class SizeCalculation(object):
             self.logger.log(errMsg, True, 'Error')
             self.isOnlyOSDiskBackupEnabled = False
 
-    def get_loop_devices(self):
-        global disk_util
-        disk_util = DiskUtil(patching = self.patching,logger = self.logger)
-        if len(self.file_systems_info) == 0 :
-            self.file_systems_info = disk_util.get_mount_file_systems()
-        self.logger.log("file_systems list : ",True)
-        self.logger.log(str(self.file_systems_info),True)
-        disk_loop_devices_file_systems = []
-        for file_system_info in self.file_systems_info:
-            if 'loop' in file_system_info[0]:
-                disk_loop_devices_file_systems.append(file_system_info[0])
-        return disk_loop_devices_file_systems
-
     def get_total_used_size(self):
         try:
             size_calc_failed = False
-            df = subprocess.Popen(["df" , "-k"], stdout=subprocess.PIPE)
-            '''
-            Sample output of the df command
-
-            Filesystem                                              Type     1K-blocks    Used    Avail Use% Mounted on
-            /dev/sda2                                               xfs       52155392 3487652 48667740   7% /
-            devtmpfs                                                devtmpfs   7170976       0  7170976   0% /dev
-            tmpfs                                                   tmpfs      7180624       0  7180624   0% /dev/shm
-            tmpfs                                                   tmpfs      7180624  760496  6420128  11% /run
-            tmpfs                                                   tmpfs      7180624       0  7180624   0% /sys/fs/cgroup
-            /dev/sda1                                               ext4        245679  151545    76931  67% /boot
-            /dev/sdb1                                               ext4      28767204 2142240 25140628   8% /mnt/resource
-            /dev/mapper/mygroup-thinv1                              xfs        1041644   33520  1008124   4% /bricks/brick1
-            /dev/mapper/mygroup-85197c258a54493da7880206251f5e37_0  xfs        1041644   33520  1008124   4% /run/gluster/snaps/85197c258a54493da7880206251f5e37/brick2
-            /dev/mapper/mygroup2-thinv2                             xfs       15717376 5276944 10440432  34% /tmp/test
-            /dev/mapper/mygroup2-63a858543baf4e40a3480a38a2f232a0_0 xfs       15717376 5276944 10440432  34% /run/gluster/snaps/63a858543baf4e40a3480a38a2f232a0/brick2
-            tmpfs                                                   tmpfs      1436128       0  1436128   0% /run/user/1000
-            //Centos72test/cifs_test                                cifs      52155392 4884620 47270772  10% /mnt/cifs_test2
-
-            '''
-            output = ""
-            process_wait_time = 300
-            while(df is not None and process_wait_time >0 and df.poll() is None):
-                time.sleep(1)
-                process_wait_time -= 1
-            self.logger.log("df command executed for process wait time value" + str(process_wait_time), True)
-            if(df is not None and df.poll() is not None):
-                self.logger.log("df return code"+str(df.returncode), True)
-                output = df.stdout.read()
-            if sys.version_info > (3,):
-                output = str(output, encoding='utf-8', errors="backslashreplace")
-            else:
-                output = str(output)
-            output = output.strip().split("\n")
-            disk_loop_devices_file_systems = self.get_loop_devices()
-            self.logger.log("outside loop device", True)
             total_used = 0
             total_used_network_shares = 0
             total_used_gluster = 0
-            total_used_loop_device=0
             total_used_temporary_disks = 0 
             total_used_ram_disks = 0
             total_used_unknown_fs = 0
             network_fs_types = []
             unknown_fs_types = []
-      
-            if len(self.file_systems_info) == 0 :
-                self.file_systems_info = disk_util.get_mount_file_systems()
-
-            output_length = len(output)
-            index = 1
-            while index < output_length:
-                if(len(output[index].split()) < 6 ): #when a row is divided in 2 lines
-                    index = index+1
-                    if(index < output_length and len(output[index-1].split()) + len(output[index].split()) == 6):
-                        output[index] = output[index-1] + output[index]
-                    else:
-                        self.logger.log("Output of df command is not in desired format",True)
-                        total_used = 0
-                        size_calc_failed = True
-                        break
-                device, size, used, available, percent, mountpoint = output[index].split()
-                fstype = ''
+            skipped_mounts = []
+
+            if self.mount_topology is None:
+                self.mount_topology = MountInfo.get_mount_topology()
+            for mount_entry in MountInfo.get_df_mounts(self.mount_topology, MountInfo.PSEUDO_FILE_SYSTEMS):
+                device = mount_entry.source
+                fstype = mount_entry.fstype
+                mountpoint = mount_entry.mount_point
                 isNetworkFs = False
                 isKnownFs = False
 
-
-                for file_system_info in self.file_systems_info:
-                    if device == file_system_info[0] and mountpoint == file_system_info[2]:
-                        fstype = file_system_info[1]
-                self.logger.log("Device name : {0} fstype : {1} size : {2} used space in KB : {3} available space : {4} mountpoint : {5}".format(device,fstype,size,used,available,mountpoint),True)
-
                 for nonPhysicaFsType in self.non_physical_file_systems:
                     if nonPhysicaFsType in fstype.lower():
                         isNetworkFs = True
@@ -137,6 +71,17 @@ class SizeCalculation(object):
                         isKnownFs = True
                         break
 
+                # statvfs runs with a timeout per mount, so that a hung network share is skipped instead of blocking
+                statvfs_result = MountInfo.statvfs_with_timeout(mountpoint, self.statvfs_timeout)
+                if statvfs_result is None:
+                    skipped_mounts.append(mountpoint)
+                    self.logger.log("Skipping mount point, statvfs failed or timed out. Device name : {0} mountpoint : {1} fstype : {2}".format(device,mountpoint,fstype),True)
+                    continue
+                if statvfs_result.f_blocks == 0:
+                    continue
+                used = MountInfo.used_kilobytes(statvfs_result)
+                self.logger.log("Device name : {0} fstype : {1} size : {2} used space in KB : {3} mountpoint : {4}".format(device,fstype,statvfs_result.f_blocks * statvfs_result.f_frsize // 1024,used,mountpoint),True)
+
                 if not (isKnownFs or fstype == '' or fstype == None):
                     unknown_fs_types.append(fstype)
 
@@ -154,10 +99,6 @@ class SizeCalculation(object):
                     self.logger.log("Not Adding RAM disks, Device name : {0} used space in KB : {1} fstype : {2}".format(device,used,fstype),True)
                     total_used_ram_disks = total_used_ram_disks + int(used)
 
-                elif 'loop' in device and device not in disk_loop_devices_file_systems:
-                    self.logger.log("Not Adding Loop Device , Device name : {0} used space in KB : {1} fstype : {2}".format(device,used,fstype),True)
-                    total_used_loop_device = total_used_loop_device + int(used)
-
                 elif (mountpoint.startswith('/run/gluster/snaps/')):
                     self.logger.log("Not Adding Gluster Device , Device name : {0} used space in KB : {1} mount point : {2}".format(device,used,mountpoint),True)
                     total_used_gluster = total_used_gluster + int(used)
@@ -178,7 +119,8 @@ class SizeCalculation(object):
                     if not (isKnownFs or fstype == '' or fstype == None):
                         total_used_unknown_fs = total_used_unknown_fs + int(used)
 
-                index = index + 1
+            if not len(skipped_mounts) == 0:
+                Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("sizeCalcSkippedMounts",str(skipped_mounts))
 
             if not len(unknown_fs_types) == 0:
                 Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("unknownFSTypeInDf",str(unknown_fs_types))
@@ -195,8 +137,6 @@ class SizeCalculation(object):
                 Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("tempDisksSize",str(total_used_temporary_disks))
             if total_used_ram_disks != 0:
                 Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("ramDisksSize",str(total_used_ram_disks))
-            if total_used_loop_device != 0 :
-                Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("loopDevicesSize",str(total_used_loop_device))
             self.logger.log("Total used space in Bytes : {0}".format(total_used * 1024),True)
             return total_used * 1024, size_calc_failed #Converting into Bytes
         except Exception as e:
@@ -19,20 +19,79 @@
 import datetime
 import os
 import string
+import threading
 import time
 import traceback
 from blobwriter import BlobWriter
 from Utils.WAAgentUtil import waagent
 import sys
 
+class LogRingBuffer(object):
+    """
+    Fixed capacity buffer for the log lines written while the file systems are frozen.
+    The slots are allocated up front, once full the oldest line is overwritten and counted as dropped.
+    """
+    def __init__(self, capacity, max_line_length):
+        self.capacity = capacity
+        self.max_line_length = max_line_length
+        self.slots = [None] * capacity
+        self.start = 0
+        self.count = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def append(self, line):
+        if len(line) > self.max_line_length:
+            line = line[:self.max_line_length] + "...\n"
+        with self.lock:
+            if self.count == self.capacity:
+                self.slots[self.start] = line
+                self.start = (self.start + 1) % self.capacity
+                self.dropped += 1
+            else:
+                self.slots[(self.start + self.count) % self.capacity] = line
+                self.count += 1
+
+    def drain(self):
+        """
+        Returns the buffered lines as one string, oldest first, and empties the buffer.
+        """
+        with self.lock:
+            lines = []
+            if self.dropped > 0:
+                lines.append("================== " + str(self.dropped) + " log lines dropped during Freeze ==============\n")
+            for index in range(self.count):
+                slot = (self.start + index) % self.capacity
+                lines.append(self.slots[slot])
+                self.slots[slot] = None
+            self.start = 0
+            self.count = 0
+            self.dropped = 0
+        return "".join(lines)
+
 class Backuplogger(object):
+    LOG_BUFFER_CAPACITY_DEFAULT = 8192
+    LOG_BUFFER_LINE_LENGTH = 4096
+
     def __init__(self, hutil):
-        self.msg = ''
         self.con_path = '/dev/console'
+        self.con_fd = None
         self.enforced_local_flag_value = True
         self.hutil = hutil
         self.prev_log = ''
         self.logging_off = False
+        self.buffer = LogRingBuffer(self.get_buffer_capacity(), self.LOG_BUFFER_LINE_LENGTH)
+        self.flush_thread = None
+
+    def get_buffer_capacity(self):
+        capacity = self.LOG_BUFFER_CAPACITY_DEFAULT
+        try:
+            capacity = int(self.hutil.get_intvalue_from_configfile('LogBufferCapacity', self.LOG_BUFFER_CAPACITY_DEFAULT))
+        except Exception:
+            pass
+        if capacity <= 0:
+            capacity = self.LOG_BUFFER_CAPACITY_DEFAULT
+        return capacity
 
     def enforce_local_flag(self, enforced_local):
         if (self.hutil.get_intvalue_from_configfile('LoggingOff', 0) == 1):
@@ -40,10 +99,10 @@ class Backuplogger(object):
         if (self.enforced_local_flag_value != False and enforced_local == False and self.logging_off == True):
             pass
         elif (self.enforced_local_flag_value != False and enforced_local == False):
-            self.msg = self.msg + "================== Logs during Freeze Start ==============" + "\n"
+            self.buffer.append("================== Logs during Freeze Start ==============" + "\n")
         elif (self.enforced_local_flag_value == False and enforced_local == True):
-            self.msg = self.msg + "================== Logs during Freeze End ==============" + "\n"
-            self.commit_to_local()
+            self.buffer.append("================== Logs during Freeze End ==============" + "\n")
+            self.start_flush()
         self.enforced_local_flag_value = enforced_local
 
     """description of class"""
@@ -60,17 +119,31 @@ class Backuplogger(object):
                 if(self.enforced_local_flag_value != False):
                     self.log_to_con(log_msg)
             if(self.enforced_local_flag_value == False):
-                self.msg += log_msg
+                self.buffer.append(log_msg)
             else:
                 self.hutil.log(str(msg),level)
 
+    def write_to_con(self, data):
+        # the console is opened once and kept open, a failed write drops the fd so the next line reopens it
+        try:
+            if self.con_fd is None:
+                self.con_fd = os.open(self.con_path, os.O_WRONLY | os.O_NOCTTY)
+            os.write(self.con_fd, data)
+        except (IOError, OSError):
+            self.close_con()
+
+    def close_con(self):
+        if self.con_fd is not None:
+            try:
+                os.close(self.con_fd)
+            except OSError:
+                pass
+            self.con_fd = None
+
     def log_to_con(self, msg):
         try:
-            with open(self.con_path, "w") as C :
-                message = filter(lambda x : x in string.printable, msg)
-                C.write(message.encode('ascii','ignore'))
-        except IOError as e:
-            pass
+            message = filter(lambda x : x in string.printable, msg)
+            self.write_to_con(message.encode('ascii','ignore'))
         except Exception as e:
             pass
 
@@ -84,19 +157,31 @@ class Backuplogger(object):
             log_msg= str(log_msg.encode('ascii', "backslashreplace"), 
                          encoding="ascii")
             if(self.enforced_local_flag_value != False):
-                with open(self.con_path, "w") as C :
-                    C.write(log_msg)
-        except IOError:
-            pass
+                self.write_to_con(log_msg.encode('ascii'))
         except Exception as e:
             log_msg = "###### Exception in log_to_con_py3"
         return log_msg
 
+    def start_flush(self):
+        """
+        Writes the lines buffered during the freeze to the local log on a background thread,
+        so that the thaw path does not wait for the disk. commit waits for it before uploading.
+        """
+        self.wait_for_flush()
+        self.flush_thread = threading.Thread(target=self.commit_to_local_no_wait)
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+
+    def wait_for_flush(self):
+        flush_thread = self.flush_thread
+        if flush_thread is not None and flush_thread is not threading.current_thread():
+            flush_thread.join()
+            self.flush_thread = None
+
     def commit(self, logbloburi):
         #commit to local file system first, then commit to the network.
         try:
-            self.hutil.log(self.msg)
-            self.msg = ''
+            self.commit_to_local()
         except Exception as e:
             pass 
         try:
@@ -105,12 +190,18 @@ class Backuplogger(object):
             self.hutil.log('commit to blob failed')
 
     def commit_to_local(self):
-        self.hutil.log(self.msg)
-        self.msg = ''
+        self.wait_for_flush()
+        self.commit_to_local_no_wait()
+
+    def commit_to_local_no_wait(self):
+        msg = self.buffer.drain()
+        if msg != '':
+            self.hutil.log(msg)
 
     def commit_to_blob(self, logbloburi):
         UploadStatusAndLog = self.hutil.get_strvalue_from_configfile('UploadStatusAndLog','True')
         if (UploadStatusAndLog == None or UploadStatusAndLog == 'True'):
+            self.wait_for_flush()
             log_to_blob = ""
             blobWriter = BlobWriter(self.hutil)
             # append the wala log at the end.
@@ -122,8 +213,8 @@ class Backuplogger(object):
                         distro_str = self.hutil.patching.distro_info[0] + " " + self.hutil.patching.distro_info[1]
                     else:
                         distro_str = self.hutil.patching.distro_info[0]
-                    self.msg = "Distro Info:" + distro_str + "\n" + self.msg
-                self.msg = "Guest Agent Version is :" + waagent.GuestAgentVersion + "\n" + self.msg
+                    self.buffer.append("Distro Info:" + distro_str + "\n")
+                self.buffer.append("Guest Agent Version is :" + waagent.GuestAgentVersion + "\n")
                 with open("/var/log/waagent.log", 'rb') as file:
                     file.seek(0, os.SEEK_END)
                     length = file.tell()
@@ -16,13 +16,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import sys
 import time
 import datetime
 import traceback
+import base64
+import hashlib
+import tempfile
+import threading
 try:
     import urlparse
 except ImportError:
     import urllib.parse as urlparse
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 from common import CommonVariables
 from HttpUtil import HttpUtil
 from Utils import HandlerUtil
@@ -34,8 +44,64 @@ class BlobProperties():
     def __str__(self):
         return ' blobType: ' + str(self.blobType) + ' contentLength: ' + str(self.contentLength)
 
+class PageBlobSource(object):
+    """
+    Seekable view over the content written to a page-blob. Accepts a string, a file object
+    or an iterator of chunks; iterators are spooled to a temporary file so that the content
+    never has to be held in memory as a whole.
+    """
+    def __init__(self, content):
+        self.lock = threading.Lock()
+        self.owns_file = False
+        if hasattr(content, 'read') and hasattr(content, 'seek'):
+            self.file = content
+        elif isinstance(content, (bytes, str)) or (sys.version_info < (3,) and isinstance(content, unicode)):
+            self.file = None
+            self.data = PageBlobSource.to_bytes(content)
+        else:
+            self.file = tempfile.TemporaryFile()
+            self.owns_file = True
+            for chunk in content:
+                self.file.write(PageBlobSource.to_bytes(chunk))
+        if self.file is not None:
+            self.file.seek(0, os.SEEK_END)
+            self.length = self.file.tell()
+        else:
+            self.length = len(self.data)
+        # only the tail of the content is written when it is larger than the blob
+        self.start = 0
+
+    @staticmethod
+    def to_bytes(content):
+        if isinstance(content, bytes):
+            return content
+        return content.encode('utf-8')
+
+    def set_tail(self, max_length):
+        if (self.length - self.start) > max_length:
+            self.start = self.length - max_length
+
+    def size(self):
+        return self.length - self.start
+
+    def read(self, offset, length):
+        if self.file is None:
+            return self.data[self.start + offset:self.start + offset + length]
+        with self.lock:
+            self.file.seek(self.start + offset)
+            return PageBlobSource.to_bytes(self.file.read(length))
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+
 class BlobWriter(object):
     """description of class"""
+    PAGE_SIZE_BYTES = 512
+    PAGE_UPLOAD_LIMIT_BYTES = 4194304 # 4 MB
+    STATUS_BLOB_LIMIT_BYTES = 10485760 # 10 MB
+    PAGE_UPLOAD_WORKER_COUNT = 4
+
     def __init__(self, hutil):
         self.hutil = hutil
     """
@@ -45,13 +111,17 @@ class BlobWriter(object):
         try:
             # get the blob type
             if(blobUri is not None):
-                blobType = self.GetBlobType(blobUri)
+                blobProperties = self.GetBlobProperties(blobUri)
+                blobType = "BlockBlob"
+                if(blobProperties is not None):
+                    blobType = blobProperties.blobType
+                self.hutil.log("WriteBlob: Blob-Type :"+str(blobType))
                 if (str(blobType).lower() == "pageblob"):
-                    # Clear Page-Blob Contents
-                    self.ClearPageBlob(blobUri)
-                    # Write to Page-Blob
-                    self.WritePageBlob(msg, blobUri)
+                    # Write to Page-Blob, the pages beyond the new content are cleared afterwards
+                    self.WritePageBlob(msg, blobUri, blobProperties)
                 else:
+                    if(hasattr(msg, 'read')):
+                        msg = msg.read()
                     self.WriteBlockBlob(msg, blobUri)
             else:
                 self.hutil.log("bloburi is None")
@@ -86,79 +156,109 @@ class BlobWriter(object):
             self.hutil.log("retry times is " + str(retry_times))
             retry_times = retry_times - 1
 
-    def WritePageBlob(self, message, blobUri):
-        if(blobUri is not None):
+    def WritePageBlob(self, message, blobUri, blobProperties = None):
+        """
+        Writes message (string, file object or iterator of chunks) to the page-blob. The pages are
+        uploaded concurrently and only the ranges that failed are retried. Pages beyond the end of
+        the new content are cleared, so no separate clear pass over the whole blob is needed.
+        """
+        if(blobUri is None):
+            self.hutil.log("WritePageBlob: bloburi is None")
+            return
+        source = None
+        try:
+            source = PageBlobSource(message)
+            if(blobProperties is None):
+                blobProperties = self.GetBlobProperties(blobUri)
+            blobContentLength = int(blobProperties.contentLength)
+            self.hutil.log("WritePageBlob: contentLength:"+str(blobContentLength))
+            maxMsgLen = self.STATUS_BLOB_LIMIT_BYTES
+            if (blobContentLength > self.STATUS_BLOB_LIMIT_BYTES):
+                maxMsgLen = blobContentLength
+            self.hutil.log("WritePageBlob: msg length:"+str(source.size()))
+            source.set_tail(maxMsgLen)
+            msgLen = source.size()
+            paddedLen = msgLen
+            if((msgLen % self.PAGE_SIZE_BYTES) != 0):
+                # last page gets padded to make the length multiple of 512
+                paddedLen = msgLen + (self.PAGE_SIZE_BYTES - (msgLen % self.PAGE_SIZE_BYTES))
+                self.hutil.log("WritePageBlob: msg length after aligning to page-size(512):"+str(paddedLen))
+            if(blobContentLength < paddedLen):
+                # Try to resize blob to increase its size
+                isSuccessful = self.try_resize_page_blob(blobUri, paddedLen)
+                if(isSuccessful == True):
+                    self.hutil.log("WritePageBlob: page-blob resized successfully new size(blobContentLength):"+str(paddedLen))
+                    blobContentLength = paddedLen
+                else:
+                    self.hutil.log("WritePageBlob: page-blob resize failed")
+            if(paddedLen > blobContentLength):
+                source.set_tail(blobContentLength)
+                msgLen = source.size()
+                paddedLen = msgLen
+                self.hutil.log("WritePageBlob: msg length after aligning to blobContentLength:"+str(msgLen))
+
+            page_ranges = []
+            for offset in range(0, paddedLen, self.PAGE_UPLOAD_LIMIT_BYTES):
+                page_ranges.append((offset, min(self.PAGE_UPLOAD_LIMIT_BYTES, paddedLen - offset)))
             retry_times = 3
-            while(retry_times > 0):
-                msg = message
+            while(retry_times > 0 and len(page_ranges) > 0):
+                page_ranges = self.put_page_ranges(source, blobUri, page_ranges)
+                retry_times = retry_times - 1
+                self.hutil.log("WritePageBlob: failed page ranges " + str(len(page_ranges)) + ", retry times is " + str(retry_times))
+            result = CommonVariables.success
+            if(len(page_ranges) > 0):
+                result = CommonVariables.error
+            elif(paddedLen < blobContentLength):
+                # clear the stale content left beyond the new content
+                result = self.put_page_clear(blobUri, paddedLen, blobContentLength - paddedLen)
+            if(result == CommonVariables.success):
+                self.hutil.log("WritePageBlob: page-blob written succesfully")
+            else:
+                self.hutil.log("WritePageBlob: page-blob failed to write")
+                HandlerUtil.HandlerUtility.add_to_telemetery_data(CommonVariables.statusBlobUploadError, "true")
+        except Exception as e:
+            HandlerUtil.HandlerUtility.add_to_telemetery_data(CommonVariables.statusBlobUploadError, "true")
+            self.hutil.log("WritePageBlob: Failed to write to page-blob with error: %s, stack trace: %s" % (str(e), traceback.format_exc()))
+        finally:
+            if(source is not None):
+                source.close()
+
+    def put_page_ranges(self, source, blobUri, page_ranges):
+        """
+        Uploads the given (offset, length) ranges of source with a bounded number of threads,
+        returns the ranges which failed.
+        """
+        range_queue = queue.Queue()
+        for page_range in page_ranges:
+            range_queue.put(page_range)
+        failed_ranges = []
+        failed_ranges_lock = threading.Lock()
+
+        def upload_worker():
+            while True:
                 try:
-                    PAGE_SIZE_BYTES = 512
-                    PAGE_UPLOAD_LIMIT_BYTES = 4194304 # 4 MB
-                    STATUS_BLOB_LIMIT_BYTES = 10485760 # 10 MB
-                    http_util = HttpUtil(self.hutil)
-                    sasuri_obj = urlparse.urlparse(blobUri + '&comp=page')
-                    # Get Blob-properties to know content-length
-                    blobProperties = self.GetBlobProperties(blobUri)
-                    blobContentLength = int(blobProperties.contentLength)
-                    self.hutil.log("WritePageBlob: contentLength:"+str(blobContentLength))
-                    maxMsgLen = STATUS_BLOB_LIMIT_BYTES
-                    if (blobContentLength > STATUS_BLOB_LIMIT_BYTES):
-                        maxMsgLen = blobContentLength
-                    msgLen = len(msg)
-                    self.hutil.log("WritePageBlob: msg length:"+str(msgLen))
-                    if(len(msg) > maxMsgLen):
-                        msg = msg[msgLen-maxMsgLen:msgLen]
-                        msgLen = len(msg)
-                        self.hutil.log("WritePageBlob: msg length after aligning to maxMsgLen:"+str(msgLen))
-                    if((msgLen % PAGE_SIZE_BYTES) != 0):
-                        # Add padding to message to make its legth multiple of 512
-                        paddedLen = msgLen + (512 - (msgLen % PAGE_SIZE_BYTES))
-                        msg = msg.ljust(paddedLen)
-                        msgLen = len(msg)
-                        self.hutil.log("WritePageBlob: msg length after aligning to page-size(512):"+str(msgLen))
-                    if(blobContentLength < msgLen):
-                        # Try to resize blob to increase its size
-                        isSuccessful = self.try_resize_page_blob(blobUri, msgLen)
-                        if(isSuccessful == True):
-                            self.hutil.log("WritePageBlob: page-blob resized successfully new size(blobContentLength):"+str(msgLen))
-                            blobContentLength = msgLen
-                        else:
-                            self.hutil.log("WritePageBlob: page-blob resize failed")
-                    if(msgLen > blobContentLength):
-                        msg = msg[msgLen-blobContentLength:msgLen]
-                        msgLen = len(msg)
-                        self.hutil.log("WritePageBlob: msg length after aligning to blobContentLength:"+str(msgLen))
-                    # Write Pages
-                    result = CommonVariables.error
-                    bytes_sent = 0
-                    while (bytes_sent < msgLen):
-                        bytes_remaining = msgLen - bytes_sent
-                        pageContent = None
-                        if(bytes_remaining > PAGE_UPLOAD_LIMIT_BYTES): # more than 4 MB
-                            pageContent = msg[bytes_sent:bytes_sent+PAGE_UPLOAD_LIMIT_BYTES]
-                        else:
-                            pageContent = msg[bytes_sent:msgLen]
-                        self.hutil.log("WritePageBlob: pageContentLen:"+str(len(pageContent)))
-                        result = self.put_page_update(pageContent, blobUri, bytes_sent)
-                        if(result == CommonVariables.success):
-                            self.hutil.log("WritePageBlob: page written succesfully")
-                        else:
-                            self.hutil.log("WritePageBlob: page failed to write")
-                            break
-                        bytes_sent = bytes_sent + len(pageContent)                      
-                    if(result == CommonVariables.success):
-                        self.hutil.log("WritePageBlob: page-blob written succesfully")
-                        retry_times = 0
-                    else:
-                        self.hutil.log("WritePageBlob: page-blob failed to write")
-                        HandlerUtil.HandlerUtility.add_to_telemetery_data(CommonVariables.statusBlobUploadError, "true")
+                    offset, length = range_queue.get_nowait()
+                except queue.Empty:
+                    return
+                result = CommonVariables.error
+                try:
+                    pageContent = source.read(offset, length)
+                    pageContent = pageContent.ljust(length, b' ')
+                    result = self.put_page_update(pageContent, blobUri, offset)
                 except Exception as e:
-                    HandlerUtil.HandlerUtility.add_to_telemetery_data(CommonVariables.statusBlobUploadError, "true")
-                    self.hutil.log("WritePageBlob: Failed to write to page-blob with error: %s, stack trace: %s" % (str(e), traceback.format_exc()))
-                self.hutil.log("WritePageBlob: retry times is " + str(retry_times))
-                retry_times = retry_times - 1
-        else:
-            self.hutil.log("WritePageBlob: bloburi is None")
+                    self.hutil.log("WritePageBlob: Failed to write page at offset " + str(offset) + " with error: %s, stack trace: %s" % (str(e), traceback.format_exc()))
+                if(result != CommonVariables.success):
+                    with failed_ranges_lock:
+                        failed_ranges.append((offset, length))
+
+        workers = []
+        for i in range(0, min(self.PAGE_UPLOAD_WORKER_COUNT, len(page_ranges))):
+            worker = threading.Thread(target=upload_worker)
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        return sorted(failed_ranges)
 
     def ClearPageBlob(self, blobUri):
         if(blobUri is not None):
@@ -207,7 +307,7 @@ class BlobWriter(object):
                     http_util = HttpUtil(self.hutil)
                     sasuri_obj = urlparse.urlparse(blobUri)
                     headers = {}
-                    result, httpResp, errMsg = http_util.HttpCallGetResponse('GET', sasuri_obj, None, headers = headers)
+                    result, httpResp, errMsg = http_util.HttpCallGetResponse('HEAD', sasuri_obj, None, headers = headers)
                     self.hutil.log("GetBlobProperties: HttpCallGetResponse : result :" + str(result) + ", errMsg :" + str(errMsg))
                     blobProperties = self.httpresponse_get_blob_properties(httpResp)
                     self.hutil.log("GetBlobProperties: blobProperties :" + str(blobProperties))
@@ -234,7 +334,8 @@ class BlobWriter(object):
         headers = {}
         headers["x-ms-page-write"] = 'update'
         headers["x-ms-range"] = 'bytes={0}-{1}'.format(pageBlobIndex, pageBlobIndex + len(pageContent) - 1)
-        headers["Content-Length"] = len(str(pageContent))
+        headers["Content-Length"] = len(pageContent)
+        headers["Content-MD5"] = base64.b64encode(hashlib.md5(pageContent).digest()).decode('ascii')
         result = http_util.Call(method = 'PUT', sasuri_obj = sasuri_obj, data = pageContent, headers = headers, fallback_to_curl = True)
         return result
     
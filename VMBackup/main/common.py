@@ -60,6 +60,8 @@ class CommonVariables:
     SnapshotMethod = 'SnapshotMethod'
     IsAnySnapshotFailed = 'IsAnySnapshotFailed'
     SnapshotRateExceededFailureCount = 'SnapshotRateExceededFailureCount'
+    SnapshotWorkerCount = 'SnapshotWorkerCount'
+    SnapshotWorkerCountDefault = 8
 
     status_transitioning = 'transitioning'
     status_warning = 'warning'
@@ -129,6 +129,12 @@ class FreezeSnapshotter(object):
 
         """ Do Not remove below HttpUtil object creation. This is to ensure HttpUtil singleton object is created before freeze."""
         http_util = HttpUtil(self.logger)
+        if(self.takeSnapshotFrom != CommonVariables.onlyHost):
+            try:
+                connections_per_host = self.hutil.get_intvalue_from_configfile(CommonVariables.SnapshotWorkerCount, CommonVariables.SnapshotWorkerCountDefault)
+                http_util.warm_up_connections(self.para_parser.blobs, connections_per_host)
+            except Exception as e:
+                self.logger.log('Failed to warm up blob connections with error: %s, stack trace: %s' % (str(e), traceback.format_exc()), True, 'Warning')
 
         if(self.takeSnapshotFrom == CommonVariables.onlyGuest):
             run_result, run_status, blob_snapshot_info_array, all_failed, all_snapshots_failed, unable_to_sleep, is_inconsistent = self.takeSnapshotFromGuest()
@@ -229,7 +235,7 @@ class FreezeSnapshotter(object):
             time_after_freeze = datetime.datetime.now()
             freezeTimeTaken = time_after_freeze-time_before_freeze
             self.logger.log('T:S ***** freeze, time_before_freeze=' + str(time_before_freeze) + ", time_after_freeze=" + str(time_after_freeze) + ", freezeTimeTaken=" + str(freezeTimeTaken))
-            HandlerUtil.HandlerUtility.add_to_telemetery_data("FreezeTime", str(time_after_freeze-time_before_freeze-datetime.timedelta(seconds=5)))
+            HandlerUtil.HandlerUtility.add_to_telemetery_data("FreezeTime", str(time_after_freeze-time_before_freeze))
             run_result = CommonVariables.success
             run_status = 'success'
             all_failed= False
@@ -273,6 +279,7 @@ class FreezeSnapshotter(object):
         unable_to_sleep = False
         blob_snapshot_info_array = None
         all_snapshots_failed = False
+        snap_shotter = None
         try:
             if( self.para_parser.blobs == None or len(self.para_parser.blobs) == 0) :
                 run_result = CommonVariables.FailedRetryableSnapshotFailedNoNetwork
@@ -283,12 +290,15 @@ class FreezeSnapshotter(object):
                 all_snapshots_failed = True
                 return run_result, run_status, blob_snapshot_info_array, all_failed, all_snapshots_failed, unable_to_sleep, is_inconsistent
 
+            snap_shotter = GuestSnapshotter(self.logger, self.hutil)
+            # snapshot workers are started before the freeze so that the frozen window only covers the snapshot calls
+            snap_shotter.start_worker_pool(self.para_parser)
+
             if self.g_fsfreeze_on :
                 run_result, run_status = self.freeze()
 
             if(run_result == CommonVariables.success or self.takeCrashConsistentSnapshot == True):
                 HandlerUtil.HandlerUtility.add_to_telemetery_data(CommonVariables.snapshotCreator, CommonVariables.guestExtension)
-                snap_shotter = GuestSnapshotter(self.logger, self.hutil)
                 self.logger.log('T:S doing snapshot now...')
                 time_before_snapshot = datetime.datetime.now()
                 snapshot_result, blob_snapshot_info_array, all_failed, is_inconsistent, unable_to_sleep, all_snapshots_failed = snap_shotter.snapshotall(self.para_parser, self.freezer, self.g_fsfreeze_on)
@@ -303,6 +313,9 @@ class FreezeSnapshotter(object):
             self.logger.log(errMsg, True, 'Error')
             run_result = CommonVariables.error
             run_status = 'error'
+        finally:
+            if snap_shotter is not None:
+                snap_shotter.stop_worker_pool()
 
         return run_result, run_status, blob_snapshot_info_array, all_failed, all_snapshots_failed, unable_to_sleep, is_inconsistent
 
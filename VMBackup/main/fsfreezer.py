@@ -19,22 +19,16 @@
 import subprocess
 from mounts import Mounts
 import datetime
-import threading
+import errno
+import fcntl
 import os
+import select
 import time
 import sys
 import signal
 import traceback
-import threading
 from common import CommonVariables
-
-def thread_for_binary(self,args):
-    self.logger.log("Thread for binary is called",True)
-    time.sleep(3)
-    self.logger.log("Waited in thread for 3 seconds",True)
-    self.logger.log("****** 1. Starting Freeze Binary ",True)
-    self.child = subprocess.Popen(args,stdout=subprocess.PIPE)
-    self.logger.log("Binary subprocess Created",True)
+from Utils import HandlerUtil
 
 class FreezeError(object):
     def __init__(self):
@@ -60,6 +54,10 @@ class FreezeHandler(object):
         self.child= None
         self.logger=logger
         self.hutil = hutil
+        # self-pipe used to wake up the waiting thread as soon as a signal arrives
+        self.wakeup_read_fd = None
+        self.wakeup_write_fd = None
+        self.old_wakeup_fd = -1
 
     def sigusr1_handler(self,signal,frame):
         self.logger.log('freezed',False)
@@ -77,28 +75,72 @@ class FreezeHandler(object):
         self.sig_handle = 0
         self.child= None
 
-
     def startproc(self,args):
-        binary_thread = threading.Thread(target=thread_for_binary, args=[self, args])
-        binary_thread.start()
-
         SafeFreezeWaitInSecondsDefault = 66
 
         proc_sleep_time = self.hutil.get_intvalue_from_configfile('SafeFreezeWaitInSeconds',SafeFreezeWaitInSecondsDefault)
-        
-        for i in range(0,(int(proc_sleep_time/2))):
-            if(self.sig_handle==0):
-                self.logger.log("inside while with sig_handle "+str(self.sig_handle))
-                time.sleep(2)
-            else:
-                break
+
+        self.logger.log("****** 1. Starting Freeze Binary ",True)
+        self.child = subprocess.Popen(args,stdout=subprocess.PIPE)
+        self.logger.log("Binary subprocess Created",True)
+        # SIGCHLD may have been delivered before self.child was assigned
+        if(self.sig_handle == 0 and self.child.poll() is not None):
+            self.sig_handle = 2
+
+        self.wait_for_signal(lambda: self.sig_handle != 0, proc_sleep_time)
         self.logger.log("Binary output for signal handled: "+str(self.sig_handle))
         return self.sig_handle
 
+    def wait_for_signal(self, condition, timeout):
+        """
+        Blocks until condition() is true or the timeout expires. The wait is woken up by the
+        signal wakeup fd, so it returns as soon as the signal handler has run.
+        """
+        deadline = time.time() + timeout
+        while not condition():
+            remaining = deadline - time.time()
+            if(remaining <= 0):
+                return False
+            try:
+                # bounded slice, in case a wakeup is consumed before the python level handler ran
+                readable, writable, exceptional = select.select([self.wakeup_read_fd], [], [], min(remaining, 1))
+            except (select.error, OSError) as e:
+                if(e.args[0] == errno.EINTR):
+                    continue
+                raise
+            if(readable):
+                try:
+                    os.read(self.wakeup_read_fd, 512)
+                except OSError:
+                    pass
+        return True
+
     def signal_receiver(self):
+        if(self.wakeup_read_fd is None):
+            self.wakeup_read_fd, self.wakeup_write_fd = os.pipe()
+            for fd in (self.wakeup_read_fd, self.wakeup_write_fd):
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            # kept to be restored by release_signal_receiver
+            self.old_wakeup_fd = signal.set_wakeup_fd(self.wakeup_write_fd)
         signal.signal(signal.SIGUSR1,self.sigusr1_handler)
         signal.signal(signal.SIGCHLD,self.sigchld_handler)
 
+    def release_signal_receiver(self):
+        """
+        Restores the previous signal wakeup fd and closes the self-pipe once the freeze/thaw handshake is over.
+        """
+        if(self.wakeup_read_fd is None):
+            return
+        try:
+            signal.set_wakeup_fd(self.old_wakeup_fd)
+        finally:
+            os.close(self.wakeup_read_fd)
+            os.close(self.wakeup_write_fd)
+            self.wakeup_read_fd = None
+            self.wakeup_write_fd = None
+            self.old_wakeup_fd = -1
+
 class FsFreezer:
     def __init__(self, patching, logger, hutil):
         """
@@ -165,7 +207,9 @@ class FsFreezer:
                 self.logger.enforce_local_flag(True)
             else:
                 self.logger.enforce_local_flag(False) 
+            time_before_freeze = datetime.datetime.now()
             sig_handle=self.freeze_handler.startproc(args)
+            HandlerUtil.HandlerUtility.add_to_telemetery_data("FreezeWaitTime", str(datetime.datetime.now() - time_before_freeze))
             self.logger.log("freeze_safe after returning from startproc : sig_handle="+str(sig_handle))
             if(sig_handle != 1):
                 if (self.freeze_handler.child is not None):
@@ -188,6 +232,10 @@ class FsFreezer:
             error_msg='freeze failed for some mount with exception, Exception %s, stack trace: %s' % (str(e), traceback.format_exc())
             freeze_result.errors.append(error_msg)
             self.logger.log(error_msg, True, 'Error')
+        finally:
+            # without a running binary there is no thaw to wait for
+            if(self.freeze_handler.child is None or self.freeze_handler.child.poll() is not None):
+                self.freeze_handler.release_signal_receiver()
         return freeze_result,timedout
 
     def thaw_safe(self):
@@ -195,39 +243,41 @@ class FsFreezer:
         unable_to_sleep = False
         if(self.skip_freeze == True):
             return thaw_result, unable_to_sleep
-        if(self.freeze_handler.child is None):
-            self.logger.log("child already completed", True)
-            self.logger.log("****** 7. Error - Binary Process Already Completed", True)
-            error_msg = 'snapshot result inconsistent'
-            thaw_result.errors.append(error_msg)
-        elif(self.freeze_handler.child.poll() is None):
-            self.logger.log("child process still running")
-            self.logger.log("****** 7. Sending Thaw Signal to Binary")
-            self.freeze_handler.child.send_signal(signal.SIGUSR1)
-            for i in range(0,30):
-                if(self.freeze_handler.child.poll() is None):
+        try:
+            if(self.freeze_handler.child is None):
+                self.logger.log("child already completed", True)
+                self.logger.log("****** 7. Error - Binary Process Already Completed", True)
+                error_msg = 'snapshot result inconsistent'
+                thaw_result.errors.append(error_msg)
+            elif(self.freeze_handler.child.poll() is None):
+                self.logger.log("child process still running")
+                self.logger.log("****** 7. Sending Thaw Signal to Binary")
+                self.freeze_handler.signal_receiver()
+                time_before_thaw = datetime.datetime.now()
+                self.freeze_handler.child.send_signal(signal.SIGUSR1)
+                if(not self.freeze_handler.wait_for_signal(lambda: self.freeze_handler.child.poll() is not None, 30)):
                     self.logger.log("child still running sigusr1 sent")
-                    time.sleep(1)
+                HandlerUtil.HandlerUtility.add_to_telemetery_data("ThawWaitTime", str(datetime.datetime.now() - time_before_thaw))
+                self.logger.enforce_local_flag(True)
+                self.log_binary_output()
+                if(self.freeze_handler.child.returncode!=0):
+                    error_msg = 'snapshot result inconsistent as child returns with failure'
+                    thaw_result.errors.append(error_msg)
+                    self.logger.log(error_msg, True, 'Error')
+            else:
+                self.logger.log("Binary output after process end when no thaw sent: ", True)
+                if(self.freeze_handler.child.returncode==2):
+                    error_msg = 'Unable to execute sleep'
+                    thaw_result.errors.append(error_msg)
+                    unable_to_sleep = True
                 else:
-                    break
-            self.logger.enforce_local_flag(True)
-            self.log_binary_output()
-            if(self.freeze_handler.child.returncode!=0):
-                error_msg = 'snapshot result inconsistent as child returns with failure'
-                thaw_result.errors.append(error_msg)
+                    error_msg = 'snapshot result inconsistent'
+                    thaw_result.errors.append(error_msg)
+                self.logger.enforce_local_flag(True)
+                self.log_binary_output()
                 self.logger.log(error_msg, True, 'Error')
-        else:
-            self.logger.log("Binary output after process end when no thaw sent: ", True)
-            if(self.freeze_handler.child.returncode==2):
-                error_msg = 'Unable to execute sleep'
-                thaw_result.errors.append(error_msg)
-                unable_to_sleep = True
-            else:
-                error_msg = 'snapshot result inconsistent'
-                thaw_result.errors.append(error_msg)
-            self.logger.enforce_local_flag(True)
-            self.log_binary_output()
-            self.logger.log(error_msg, True, 'Error')
+        finally:
+            self.freeze_handler.release_signal_receiver()
         self.logger.enforce_local_flag(True)
         return thaw_result, unable_to_sleep
 
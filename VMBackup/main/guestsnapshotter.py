@@ -27,7 +27,11 @@ try:
     import ConfigParser as ConfigParsers
 except ImportError:
     import configparser as ConfigParsers
-import multiprocessing as mp
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import threading
 import datetime
 from common import CommonVariables
 from HttpUtil import HttpUtil
@@ -63,14 +67,93 @@ class SnapshotResult(object):
             error_str+=(str(error)) + "\n"
         return error_str
 
+class SnapshotTaskResult(object):
+    def __init__(self, snapshot_error, snapshot_info_indexer, log_message, error_message):
+        self.snapshot_error = snapshot_error
+        self.snapshot_info_indexer = snapshot_info_indexer
+        self.log_message = log_message
+        self.error_message = error_message
+
+class SnapshotWorkerPool(object):
+    """
+    Fixed size pool of snapshot worker threads. The workers are started before the freeze
+    and wait on the task queue, every finished task is reported on the single result queue.
+    """
+    def __init__(self, logger, worker_count):
+        self.logger = logger
+        self.worker_count = worker_count
+        self.task_queue = queue.Queue()
+        self.result_queue = queue.Queue()
+        self.workers = []
+
+    def start(self):
+        for i in range(0, self.worker_count):
+            worker = threading.Thread(target=self.worker_loop, name='snapshot-worker-' + str(i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        self.logger.log("started snapshot worker pool with " + str(self.worker_count) + " workers")
+
+    def worker_loop(self):
+        while True:
+            task = self.task_queue.get()
+            if task is None:
+                break
+            target, args = task
+            try:
+                result = target(*args)
+            except Exception as e:
+                result = SnapshotTaskResult(None, None, '', " snapshot worker failed with error: %s, stack trace: %s" % (str(e), traceback.format_exc()))
+            self.result_queue.put(result)
+
+    def submit(self, target, *args):
+        self.task_queue.put((target, args))
+
+    def get_result(self):
+        return self.result_queue.get()
+
+    def shutdown(self):
+        for worker in self.workers:
+            self.task_queue.put(None)
+        self.workers = []
+
 class GuestSnapshotter(object):
     """description of class"""
     def __init__(self, logger, hutil):
         self.logger = logger
         self.configfile='/etc/azure/vmbackup.conf'
         self.hutil = hutil
+        self.worker_pool = None
+
+    def is_parallel_snapshot(self, paras):
+        seqsnapshot = self.hutil.get_intvalue_from_configfile('seqsnapshot',0)
+        return not (seqsnapshot == 1 or seqsnapshot == 2 or paras.blobs is None or len(paras.blobs) <= 4)
 
-    def snapshot(self, sasuri, sasuri_index, meta_data, snapshot_result_error, snapshot_info_indexer_queue, global_logger, global_error_logger):
+    def start_worker_pool(self, paras):
+        """
+        Start the snapshot worker threads ahead of the freeze, so that none of the
+        setup cost is paid while the file systems are frozen.
+        """
+        if self.worker_pool is not None or not self.is_parallel_snapshot(paras):
+            return
+        try:
+            worker_count = self.hutil.get_intvalue_from_configfile(CommonVariables.SnapshotWorkerCount, CommonVariables.SnapshotWorkerCountDefault)
+            if worker_count <= 0:
+                worker_count = CommonVariables.SnapshotWorkerCountDefault
+            worker_count = min(worker_count, len(paras.blobs))
+            self.worker_pool = SnapshotWorkerPool(self.logger, worker_count)
+            self.worker_pool.start()
+        except Exception as e:
+            errorMsg = "Failed to start snapshot worker pool with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
+            self.logger.log(errorMsg, True, 'Warning')
+            self.stop_worker_pool()
+
+    def stop_worker_pool(self):
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+            self.worker_pool = None
+
+    def snapshot(self, sasuri, sasuri_index, meta_data):
         temp_logger=''
         error_logger=''
         snapshot_error = SnapshotError()
@@ -121,10 +204,7 @@ class GuestSnapshotter(object):
             snapshot_error.errorcode = CommonVariables.error
             snapshot_error.sasuri = sasuri
         temp_logger=temp_logger + str(datetime.datetime.now()) + ' snapshot ends..'
-        global_logger.put(temp_logger)
-        global_error_logger.put(error_logger)
-        snapshot_result_error.put(snapshot_error)
-        snapshot_info_indexer_queue.put(snapshot_info_indexer)
+        return SnapshotTaskResult(snapshot_error, snapshot_info_indexer, temp_logger, error_logger)
 
     def snapshot_seq(self, sasuri, sasuri_index, meta_data):
         result = None
@@ -185,47 +265,34 @@ class GuestSnapshotter(object):
         all_snapshots_failed = False
         set_next_backup_to_seq = False
         try:
-            self.logger.log("before start of multiprocessing queues..")
-            mp_jobs = []
-            queue_creation_starttime = datetime.datetime.now()
-            global_logger = mp.Queue()
-            global_error_logger = mp.Queue()
-            snapshot_result_error = mp.Queue()
-            snapshot_info_indexer_queue = mp.Queue()
-            time_before_snapshot_start = datetime.datetime.now()
+            self.logger.log("before start of snapshot worker pool..")
+            pool_creation_starttime = datetime.datetime.now()
             blobs = paras.blobs
 
             if blobs is not None:
+                self.start_worker_pool(paras)
+                if self.worker_pool is None:
+                    all_snapshots_failed = True
+                    raise Exception("Exception while creating snapshot worker pool")
+
                 # initialize blob_snapshot_info_array
-                mp_jobs = []
                 blob_index = 0
                 self.logger.log('****** 5. Snaphotting (Guest-parallel) Started')
                 for blob in blobs:
                     blobUri = blob.split("?")[0]
                     self.logger.log("index: " + str(blob_index) + " blobUri: " + str(blobUri))
                     blob_snapshot_info_array.append(HostSnapshotObjects.BlobSnapshotInfo(False, blobUri, None, 500))
-                    try:
-                        mp_jobs.append(mp.Process(target=self.snapshot,args=(blob, blob_index, paras.backup_metadata, snapshot_result_error, snapshot_info_indexer_queue, global_logger, global_error_logger)))
-                    except Exception as e:
-                        self.logger.log("multiprocess queue creation failed")
-                        all_snapshots_failed = True
-                        raise Exception("Exception while creating multiprocess queue")
-
-                    blob_index = blob_index + 1
-
-                counter = 0
-                for job in mp_jobs:
-                    job.start()
-                    if(counter == 0):
-                        queue_creation_endtime = datetime.datetime.now()
-                        timediff = queue_creation_endtime - queue_creation_starttime
+                    self.worker_pool.submit(self.snapshot, blob, blob_index, paras.backup_metadata)
+                    if(blob_index == 0):
+                        pool_creation_endtime = datetime.datetime.now()
+                        timediff = pool_creation_endtime - pool_creation_starttime
                         if(timediff.seconds >= 10):
-                            self.logger.log("mp queue creation took more than 10 secs. Setting next backup to sequential")
+                            self.logger.log("snapshot worker pool creation took more than 10 secs. Setting next backup to sequential")
                             set_next_backup_to_seq = True
-                    counter = counter + 1
+                    blob_index = blob_index + 1
 
-                for job in mp_jobs:
-                    job.join()
+                task_results = [self.worker_pool.get_result() for blob in blobs]
+                self.stop_worker_pool()
                 self.logger.log('****** 6. Snaphotting (Guest-parallel) Completed')
                 thaw_result = None
                 if g_fsfreeze_on and thaw_done_local == False:
@@ -243,26 +310,23 @@ class GuestSnapshotter(object):
                         snapshot_result.errors.append(thaw_result.errors)
                         return snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done_local, unable_to_sleep, all_snapshots_failed
                 self.logger.log('end of snapshot process')
-                logging = [global_logger.get() for job in mp_jobs]
+                logging = [task_result.log_message for task_result in task_results]
                 self.logger.log(str(logging))
-                error_logging = [global_error_logger.get() for job in mp_jobs]
+                error_logging = [task_result.error_message for task_result in task_results]
                 self.logger.log(str(error_logging),False,'Error')
-                if not snapshot_result_error.empty():
-                    results = [snapshot_result_error.get() for job in mp_jobs]
-                    for result in results:
-                        if(result.errorcode != CommonVariables.success):
-                            snapshot_result.errors.append(result)
-                if not snapshot_info_indexer_queue.empty():
-                    snapshot_info_indexers = [snapshot_info_indexer_queue.get() for job in mp_jobs]
-                    for snapshot_info_indexer in snapshot_info_indexers:
+                for task_result in task_results:
+                    if(task_result.snapshot_error is not None and task_result.snapshot_error.errorcode != CommonVariables.success):
+                        snapshot_result.errors.append(task_result.snapshot_error)
+                    snapshot_info_indexer = task_result.snapshot_info_indexer
+                    if snapshot_info_indexer is not None:
                         # update blob_snapshot_info_array element properties from snapshot_info_indexer object
                         self.get_snapshot_info(snapshot_info_indexer, blob_snapshot_info_array[snapshot_info_indexer.index])
                         if (blob_snapshot_info_array[snapshot_info_indexer.index].isSuccessful == True):
                             all_failed = False
                         self.logger.log("index: " + str(snapshot_info_indexer.index) + " blobSnapshotUri: " + str(blob_snapshot_info_array[snapshot_info_indexer.index].snapshotUri))
 
-                    all_snapshots_failed = all_failed
-                    self.logger.log("Setting all_snapshots_failed to " + str(all_snapshots_failed))
+                all_snapshots_failed = all_failed
+                self.logger.log("Setting all_snapshots_failed to " + str(all_snapshots_failed))
 
                 return snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done_local, unable_to_sleep, all_snapshots_failed
             else:
@@ -273,6 +337,8 @@ class GuestSnapshotter(object):
             self.logger.log(errorMsg)
             exceptOccurred = True
             return snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done_local, unable_to_sleep, all_snapshots_failed
+        finally:
+            self.stop_worker_pool()
 
 
     def snapshotall_seq(self, paras, freezer, thaw_done, g_fsfreeze_on):
@@ -330,7 +396,7 @@ class GuestSnapshotter(object):
 
     def snapshotall(self, paras, freezer, g_fsfreeze_on):
         thaw_done = False
-        if (self.hutil.get_intvalue_from_configfile('seqsnapshot',0) == 1 or self.hutil.get_intvalue_from_configfile('seqsnapshot',0) == 2 or (len(paras.blobs) <= 4)):
+        if not self.is_parallel_snapshot(paras):
             snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done, unable_to_sleep, all_snapshots_failed =  self.snapshotall_seq(paras, freezer, thaw_done, g_fsfreeze_on)
         else:
             snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done, unable_to_sleep, all_snapshots_failed =  self.snapshotall_parallel(paras, freezer, thaw_done, g_fsfreeze_on)
@@ -22,7 +22,9 @@ import re
 import sys
 import subprocess
 import types
+import traceback
 from Utils.DiskUtil import DiskUtil
+from Utils import MountInfo
 
 class Error(Exception):
     pass
@@ -38,6 +40,13 @@ class Mount:
 class Mounts:
     def __init__(self,patching,logger):
         self.mounts = []
+        try:
+            self.load_from_topology(MountInfo.get_mount_topology(refresh = True), logger)
+            return
+        except Exception as e:
+            errMsg = 'Failed to read the mount topology, falling back to mount and lsblk, Exception %s, stack trace: %s' % (str(e), traceback.format_exc())
+            logger.log(errMsg, True, 'Warning')
+            self.mounts = []
         added_mount_point_names = [] 
         disk_util = DiskUtil(patching,logger)
         # Get mount points 
@@ -96,6 +105,30 @@ class Mounts:
         # Reverse the mounts list
         self.mounts.reverse()
 
+    def load_from_topology(self, mount_topology, logger):
+        """
+        Builds the mounts list from the mountinfo/sysfs topology index, in the same order as the
+        mount and lsblk based lookup: mount table order, duplicate mount points resolved to the
+        visible mount, each file system once, then reversed.
+        """
+        added_file_systems = set()
+        for mount_entry in mount_topology.visible_mounts():
+            block_device = mount_topology.get_block_device(mount_entry)
+            if block_device is None:
+                continue
+            # a file system mounted at several places (bind mounts) must only be frozen once
+            if mount_entry.major_minor in added_file_systems:
+                logger.log("######## mounts list item Skipped as its file system is already added, mountPoint "+str(mount_entry.mount_point), True)
+                continue
+            added_file_systems.add(mount_entry.major_minor)
+            mount = Mount(block_device.name, block_device.type, mount_entry.fstype, mount_entry.mount_point)
+            if (self.should_skip_fstype(str(mount.fstype))):
+                logger.log("######## mounts list item Skipped due to fsType, mountPoint "+str(mount.mount_point)+", fsType "+str(mount.fstype)+" and unique-name "+str(mount.unique_name), True)
+                continue
+            self.mounts.append(mount)
+            logger.log("mounts list item added, mount point "+str(mount.mount_point)+", device-name "+str(mount.name)+", type "+str(mount.type)+", fs-type "+str(mount.fstype)+", unique-name "+str(mount.unique_name), True)
+        self.mounts.reverse()
+
     def should_skip_fstype(self, fstype):
         if (fstype == 'ext3' or fstype == 'ext4' or fstype == 'xfs' or fstype == 'btrfs'):
             return False
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Run from the VMBackup directory with: PYTHONPATH=main python -m unittest discover -s test
+
+import fcntl
+import os
+import signal
+import unittest
+from fsfreezer import FreezeHandler
+
+
+class MockLogger(object):
+    def log(self, msg, local=False, level='Info'):
+        pass
+
+
+class TestFreezeHandler(unittest.TestCase):
+    def setUp(self):
+        self.sigusr1_handler = signal.getsignal(signal.SIGUSR1)
+        self.sigchld_handler = signal.getsignal(signal.SIGCHLD)
+        self.old_read_fd, self.old_write_fd = os.pipe()
+        fcntl.fcntl(self.old_write_fd, fcntl.F_SETFL, fcntl.fcntl(self.old_write_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        signal.set_wakeup_fd(self.old_write_fd)
+
+    def tearDown(self):
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGUSR1, self.sigusr1_handler)
+        signal.signal(signal.SIGCHLD, self.sigchld_handler)
+        os.close(self.old_read_fd)
+        os.close(self.old_write_fd)
+
+    def test_release_restores_wakeup_fd_and_closes_pipe(self):
+        freeze_handler = FreezeHandler(MockLogger(), None)
+        for i in range(3):
+            freeze_handler.signal_receiver()
+            wakeup_fds = (freeze_handler.wakeup_read_fd, freeze_handler.wakeup_write_fd)
+            # a second call during the same handshake keeps the pipe
+            freeze_handler.signal_receiver()
+            self.assertEqual(wakeup_fds, (freeze_handler.wakeup_read_fd, freeze_handler.wakeup_write_fd))
+
+            freeze_handler.release_signal_receiver()
+            self.assertEqual(self.old_write_fd, signal.set_wakeup_fd(self.old_write_fd))
+            for fd in wakeup_fds:
+                self.assertRaises(OSError, os.fstat, fd)
+        freeze_handler.release_signal_receiver()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Run from the VMBackup directory with: PYTHONPATH=main python -m unittest discover -s test
+
+import errno
+import socket
+import unittest
+from HttpUtil import HttpUtil, httplibs
+
+
+class MockLogger(object):
+    def log(self, msg, local=False, level='Info'):
+        pass
+
+
+class TestHttpUtil(unittest.TestCase):
+    def setUp(self):
+        self.http_util = HttpUtil(MockLogger())
+
+    def test_failed_send_is_retried(self):
+        e = socket.error(errno.EPIPE, 'Broken pipe')
+        for method in ['PUT', 'POST', 'GET']:
+            self.assertTrue(self.http_util.can_retry(method, e, False))
+        self.assertFalse(self.http_util.can_retry('PUT', socket.error(errno.ETIMEDOUT, 'Timed out'), False))
+
+    def test_closed_connection_after_send_is_retried_if_idempotent(self):
+        e = httplibs.BadStatusLine("''")
+        self.assertTrue(self.http_util.can_retry('GET', e, True))
+        self.assertTrue(self.http_util.can_retry('head', e, True))
+        # the server may have processed these before closing the connection
+        self.assertFalse(self.http_util.can_retry('PUT', e, True))
+        self.assertFalse(self.http_util.can_retry('POST', e, True))
+        self.assertFalse(self.http_util.can_retry('POST', socket.error(errno.ECONNRESET, 'Reset'), True))
+        self.assertFalse(self.http_util.can_retry('GET', httplibs.BadStatusLine('HTTP/1.1 abc'), True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Run from the VMBackup directory with: PYTHONPATH=main python -m unittest discover -s test
+
+import threading
+import unittest
+from common import CommonVariables
+from PluginHost import PluginHost
+from ScriptRunner import ScriptRunnerResult
+
+
+class MockLogger(object):
+    def log(self, msg, local=False, level='Info'):
+        pass
+
+
+class MockPlugin(object):
+    def __init__(self, hangingScript, unblock):
+        self.hangingScript = hangingScript
+        self.unblock = unblock
+        self.calls = []
+
+    def run(self, scriptName, pluginIndex, scriptCompleted, scriptResult):
+        self.calls.append(scriptName)
+        if scriptName == self.hangingScript:
+            self.unblock.wait()
+        result = ScriptRunnerResult()
+        result.errorCode = CommonVariables.PrePost_PluginStatus_Success
+        scriptCompleted[pluginIndex] = True
+        scriptResult[pluginIndex] = result
+
+    def pre_script(self, pluginIndex, scriptCompleted, scriptResult):
+        self.run('pre_script', pluginIndex, scriptCompleted, scriptResult)
+
+    def post_script(self, pluginIndex, scriptCompleted, scriptResult):
+        self.run('post_script', pluginIndex, scriptCompleted, scriptResult)
+
+
+class TestPluginHost(unittest.TestCase):
+    def setUp(self):
+        self.unblock = threading.Event()
+
+    def tearDown(self):
+        self.unblock.set()
+
+    def new_plugin_host(self, hangingScript):
+        # The prescript of "app" runs after the one of "db", its postscript before the one of "db"
+        plugin_host = PluginHost(MockLogger())
+        plugin_host.modulesLoaded = True
+        plugin_host.timeoutInSeconds = 0.2
+        plugin_host.pollTime = 0
+        plugin_host.pluginName = ['db', 'app']
+        plugin_host.pluginDependsOn = [[], ['db']]
+        plugin_host.noOfPlugins = 2
+        plugin_host.plugins = [MockPlugin(None, self.unblock), MockPlugin(hangingScript, self.unblock)]
+        plugin_host.preScriptCompleted = [False, False]
+        plugin_host.preScriptResult = [None, None]
+        plugin_host.postScriptCompleted = [False, False]
+        plugin_host.postScriptResult = [None, None]
+        return plugin_host
+
+    def test_postscript_runs_after_dependency_timed_out(self):
+        plugin_host = self.new_plugin_host('post_script')
+        result = plugin_host.post_script()
+
+        self.assertEqual(['post_script'], plugin_host.plugins[0].calls)
+        self.assertTrue(plugin_host.postScriptTimeline[1].timedOut)
+        self.assertFalse(plugin_host.postScriptTimeline[0].timedOut)
+        self.assertTrue(plugin_host.postScriptTimeline[0].startTime >= plugin_host.postScriptTimeline[1].startTime + 0.2)
+        self.assertEqual([CommonVariables.PrePost_PluginStatus_Success, CommonVariables.FailedPrepostPluginhostPostTimeout],
+                         sorted(error.errorCode for error in result.errors))
+
+    def test_prescript_is_skipped_after_dependency_timed_out(self):
+        plugin_host = self.new_plugin_host(None)
+        plugin_host.plugins[0].hangingScript = 'pre_script'
+        result = plugin_host.pre_script()
+
+        self.assertEqual([], plugin_host.plugins[1].calls)
+        self.assertTrue(plugin_host.preScriptTimeline[0].timedOut)
+        self.assertTrue(plugin_host.preScriptTimeline[1].timedOut)
+        self.assertIsNone(plugin_host.preScriptTimeline[1].startTime)
+        self.assertTrue(result.anyScriptFailed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import os
+import re
+from CommandExecutor import CommandExecutor, ProcessCommunicator
+from Common import CommonVariables
+
+
+def parse_dumpe2fs(output):
+    """
+    returns (block_size, block_count, free block ranges) from the output of dumpe2fs,
+    the ranges are (first_block, last_block) and include both ends.
+    """
+    block_size = None
+    block_count = None
+    free_ranges = []
+    for line in output.splitlines():
+        if line.startswith('Block size:'):
+            block_size = int(line.split(':', 1)[1])
+        elif line.startswith('Block count:'):
+            block_count = int(line.split(':', 1)[1])
+        # the free blocks of a group are indented, the superblock summary is not
+        elif line.startswith(' ') and line.strip().startswith('Free blocks:'):
+            for free_range in line.split(':', 1)[1].split(','):
+                free_range = free_range.strip()
+                if not free_range:
+                    continue
+                if '-' in free_range:
+                    first, last = free_range.split('-', 1)
+                    free_ranges.append((int(first), int(last)))
+                else:
+                    free_ranges.append((int(free_range), int(free_range)))
+
+    if block_size is None or block_count is None:
+        raise Exception("dumpe2fs output has no block size or block count")
+    return block_size, block_count, free_ranges
+
+def parse_xfs_db_freesp(output):
+    """
+    returns (block_size, block_count, free block ranges) from the output of
+    xfs_db -c 'sb 0' -c 'p blocksize agblocks dblocks' -c 'freesp -d'.
+    """
+    values = {}
+    free_extents = []
+    for line in output.splitlines():
+        match = re.match(r'^\s*(\w+) = (\d+)\s*$', line)
+        if match:
+            values[match.group(1)] = int(match.group(2))
+            continue
+        # freesp -d prints every free extent as agno agbno len, the histogram has five columns
+        fields = line.split()
+        if len(fields) == 3 and all(field.isdigit() for field in fields):
+            free_extents.append(tuple(int(field) for field in fields))
+
+    for key in ['blocksize', 'agblocks', 'dblocks']:
+        if key not in values:
+            raise Exception("xfs_db output has no {0}".format(key))
+
+    free_ranges = []
+    for agno, agbno, length in free_extents:
+        first = agno * values['agblocks'] + agbno
+        free_ranges.append((first, first + length - 1))
+    return values['blocksize'], values['dblocks'], free_ranges
+
+
+class AllocationMap(object):
+    """
+    the byte ranges of a device the file system on it has allocated, everything else can be
+    skipped when copying the device. the map is saved next to the copy journal because the
+    source is overwritten while it is copied and can not be queried again after a reboot.
+    """
+    def __init__(self, source_path, total_size, allocated_ranges):
+        self.source_path = source_path
+        self.total_size = total_size
+        self.allocated_ranges = allocated_ranges
+        self.range_ends = [offset + length for offset, length in allocated_ranges]
+
+    @staticmethod
+    def from_free_blocks(source_path, block_size, block_count, free_ranges):
+        total_size = block_size * block_count
+        allocated_ranges = []
+        next_block = 0
+        for first, last in sorted(free_ranges):
+            if first > next_block:
+                allocated_ranges.append((next_block * block_size, (first - next_block) * block_size))
+            next_block = max(next_block, last + 1)
+        if next_block < block_count:
+            allocated_ranges.append((next_block * block_size, (block_count - next_block) * block_size))
+        return AllocationMap(source_path, total_size, allocated_ranges)
+
+    @staticmethod
+    def query(logger, source_path, file_system=None):
+        """
+        reads the free space map of the unmounted file system on source_path, returns None
+        when the file system is not supported or can not be read.
+        """
+        command_executor = CommandExecutor(logger)
+        if not file_system:
+            proc_comm = ProcessCommunicator()
+            command_executor.Execute('blkid -o value -s TYPE {0}'.format(source_path), communicator=proc_comm, suppress_logging=True)
+            file_system = (proc_comm.stdout or '').strip()
+
+        file_system = file_system.lower()
+        if file_system in CommonVariables.inplace_supported_file_systems:
+            command = 'dumpe2fs {0}'.format(source_path)
+            parse = parse_dumpe2fs
+        elif file_system == 'xfs':
+            command = "xfs_db -r -c 'sb 0' -c 'p blocksize agblocks dblocks' -c 'freesp -d' {0}".format(source_path)
+            parse = parse_xfs_db_freesp
+        else:
+            logger.log("no free space map for file system '{0}' on {1}".format(file_system, source_path))
+            return None
+
+        proc_comm = ProcessCommunicator()
+        return_code = command_executor.Execute(command, communicator=proc_comm, suppress_logging=True)
+        if return_code != CommonVariables.process_success:
+            logger.log(msg="reading the free space map of {0} failed with {1}".format(source_path, return_code),
+                       level=CommonVariables.WarningLevel)
+            return None
+        try:
+            block_size, block_count, free_ranges = parse(proc_comm.stdout)
+        except Exception as e:
+            logger.log(msg="parsing the free space map of {0} failed: {1}".format(source_path, e),
+                       level=CommonVariables.WarningLevel)
+            return None
+
+        allocation_map = AllocationMap.from_free_blocks(source_path, block_size, block_count, free_ranges)
+        logger.log("{0}: {1} of {2} bytes allocated in {3} ranges".format(source_path,
+                                                                       allocation_map.get_allocated_size(),
+                                                                       allocation_map.total_size,
+                                                                       len(allocation_map.allocated_ranges)))
+        return allocation_map
+
+    def get_allocated_size(self):
+        return sum(length for offset, length in self.allocated_ranges)
+
+    def is_allocated(self, offset, length):
+        """
+        whether any byte of [offset, offset + length) is allocated, bytes past the end of
+        the file system count as allocated.
+        """
+        if offset + length > self.total_size:
+            return True
+        index = bisect.bisect_right(self.range_ends, offset)
+        return index < len(self.allocated_ranges) and self.allocated_ranges[index][0] < offset + length
+
+    def get_allocated_ranges(self, offset, length):
+        """
+        the allocated parts of [offset, offset + length) as (offset, length) pairs.
+        """
+        end = offset + length
+        ranges = []
+        index = bisect.bisect_right(self.range_ends, offset)
+        while index < len(self.allocated_ranges) and self.allocated_ranges[index][0] < end:
+            range_offset, range_length = self.allocated_ranges[index]
+            range_start = max(offset, range_offset)
+            range_end = min(end, range_offset + range_length)
+            ranges.append((range_start, range_end - range_start))
+            index += 1
+        if end > self.total_size:
+            tail_start = max(offset, self.total_size)
+            if ranges and ranges[-1][0] + ranges[-1][1] == tail_start:
+                tail_start = ranges.pop()[0]
+            ranges.append((tail_start, end - tail_start))
+        return ranges
+
+    def save(self, path):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as map_file:
+            map_file.write("{0}\n{1}\n".format(self.source_path, self.total_size))
+            for offset, length in self.allocated_ranges:
+                map_file.write("{0} {1}\n".format(offset, length))
+            map_file.flush()
+            os.fsync(map_file.fileno())
+        os.rename(temp_path, path)
+
+    @staticmethod
+    def load(path):
+        """
+        returns None when there is no saved map.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as map_file:
+            lines = map_file.read().splitlines()
+        allocated_ranges = []
+        for line in lines[2:]:
+            offset, length = line.split()
+            allocated_ranges.append((int(offset), int(length)))
+        return AllocationMap(lines[0], int(lines[1]), allocated_ranges)
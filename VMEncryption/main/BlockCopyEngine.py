@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mmap
+import os
+import threading
+import time
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+def read_at(fd, buffer, offset, length):
+    """
+    reads up to length bytes at offset, into buffer when the platform has preadv.
+    returns the data read, which is shorter than length only at the end of the file.
+    """
+    if hasattr(os, 'preadv') and buffer is not None:
+        view = memoryview(buffer)
+        done = 0
+        while done < length:
+            read_size = os.preadv(fd, [view[done:length]], offset + done)
+            if read_size == 0:
+                break
+            done += read_size
+        return view[:done]
+
+    chunks = []
+    done = 0
+    while done < length:
+        if hasattr(os, 'pread'):
+            chunk = os.pread(fd, length - done, offset + done)
+        else:
+            os.lseek(fd, offset + done, os.SEEK_SET)
+            chunk = os.read(fd, length - done)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        done += len(chunk)
+    return b''.join(chunks)
+
+def write_at(fd, data, offset):
+    view = memoryview(data)
+    done = 0
+    while done < len(view):
+        if hasattr(os, 'pwritev'):
+            written = os.pwritev(fd, [view[done:]], offset + done)
+        elif hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view[done:].tobytes(), offset + done)
+        else:
+            os.lseek(fd, offset + done, os.SEEK_SET)
+            written = os.write(fd, view[done:].tobytes())
+        done += written
+
+
+class IOBudget(object):
+    """
+    token bucket shared by all copies running at the same time, consume blocks the calling copy
+    until the bytes it is about to write fit into bytes_per_second.
+    a budget of 0 bytes per second does not throttle at all.
+    """
+    def __init__(self, bytes_per_second, clock=time.time, sleep=time.sleep):
+        self.bytes_per_second = bytes_per_second
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        # one second worth of bytes may be written in a burst
+        self.available = float(bytes_per_second)
+        self.last_refill = clock()
+
+    def consume(self, byte_count):
+        if self.bytes_per_second <= 0:
+            return
+        with self.lock:
+            now = self.clock()
+            self.available = min(float(self.bytes_per_second), self.available + (now - self.last_refill) * self.bytes_per_second)
+            self.last_refill = now
+            # going into debt keeps requests larger than the bucket working, later ones wait for it
+            self.available -= byte_count
+            wait_time = -self.available / self.bytes_per_second if self.available < 0 else 0
+        if wait_time > 0:
+            self.sleep(wait_time)
+
+
+class BlockFile(object):
+    """
+    a block device or file opened for positional I/O.
+    when the platform supports it a second O_DIRECT descriptor is kept, and reads and writes
+    whose offset and length are aligned go through it and bypass the page cache.
+    """
+    def __init__(self, path, writable, use_direct_io):
+        self.path = path
+        flags = os.O_RDONLY
+        if writable:
+            flags = os.O_RDWR | os.O_CREAT
+        self.fd = os.open(path, flags, 0o600)
+        self.direct_fd = None
+        if use_direct_io:
+            try:
+                self.direct_fd = os.open(path, flags | os.O_DIRECT)
+            except OSError:
+                # tmpfs and some other file systems refuse O_DIRECT
+                self.direct_fd = None
+
+    def get_fd(self, offset, length):
+        if self.direct_fd is not None and offset % BlockCopyEngine.alignment == 0 and length % BlockCopyEngine.alignment == 0:
+            return self.direct_fd
+        return self.fd
+
+    def read(self, offset, length, buffer):
+        return read_at(self.get_fd(offset, length), buffer, offset, length)
+
+    def write(self, offset, data):
+        # only data living in an aligned buffer can be written with O_DIRECT
+        if isinstance(data, memoryview) and not isinstance(data.obj, bytes):
+            write_at(self.get_fd(offset, len(data)), data, offset)
+        else:
+            write_at(self.fd, data, offset)
+
+    def sync(self):
+        os.fsync(self.fd)
+
+    def close(self):
+        for fd in [self.fd, self.direct_fd]:
+            if fd is not None:
+                os.close(fd)
+        self.fd = None
+        self.direct_fd = None
+
+
+class BlockCopyEngine(object):
+    """
+    in-process copy of device ranges with positional reads and writes.
+    read_ranges reads the next range on a helper thread while the caller writes the current one,
+    with two buffers in flight, so reading and writing overlap without any dd process.
+    """
+    alignment = 4096
+    buffer_count = 2
+
+    def __init__(self, logger, buffer_size, use_direct_io=True):
+        self.logger = logger
+        self.buffer_size = buffer_size
+        # O_DIRECT needs page aligned memory, which is only reachable through preadv/pwritev
+        self.use_direct_io = use_direct_io and hasattr(os, 'O_DIRECT') and hasattr(os, 'preadv') and hasattr(os, 'pwritev')
+
+    def open_source(self, path):
+        return BlockFile(path, writable=False, use_direct_io=self.use_direct_io)
+
+    def open_destination(self, path):
+        return BlockFile(path, writable=True, use_direct_io=self.use_direct_io)
+
+    def allocate_buffer(self):
+        if hasattr(os, 'preadv'):
+            # anonymous mappings are page aligned
+            return mmap.mmap(-1, self.buffer_size)
+        return None
+
+    def read_ranges(self, source, ranges):
+        """
+        yields (offset, length, data) for each (offset, length) in ranges, in order.
+        data is only valid until the next item is requested, its buffer is then reused for read ahead.
+        """
+        free_buffers = queue.Queue()
+        for i in range(self.buffer_count):
+            free_buffers.put(self.allocate_buffer())
+        filled_buffers = queue.Queue()
+        stopped = threading.Event()
+
+        def read_ahead():
+            try:
+                for offset, length in ranges:
+                    buffer = free_buffers.get()
+                    if stopped.is_set():
+                        return
+                    data = source.read(offset, length, buffer)
+                    filled_buffers.put((offset, length, buffer, data, None))
+            except Exception as e:
+                filled_buffers.put((None, None, None, None, e))
+
+        reader_thread = threading.Thread(target=read_ahead)
+        reader_thread.daemon = True
+        reader_thread.start()
+        try:
+            for i in range(len(ranges)):
+                offset, length, buffer, data, error = filled_buffers.get()
+                if error is not None:
+                    raise error
+                if len(data) != length:
+                    raise IOError("short read from {0} at offset {1}: {2} of {3} bytes".format(source.path, offset, len(data), length))
+                yield offset, length, data
+                free_buffers.put(buffer)
+        finally:
+            stopped.set()
+            for i in range(self.buffer_count):
+                free_buffers.put(None)
+            reader_thread.join()
+
+    def copy_range(self, source, destination, source_offset, destination_offset, length):
+        """
+        copies one range synchronously, in buffer_size pieces.
+        """
+        buffer = self.allocate_buffer()
+        done = 0
+        while done < length:
+            piece_length = min(self.buffer_size, length - done)
+            data = source.read(source_offset + done, piece_length, buffer)
+            if len(data) != piece_length:
+                raise IOError("short read from {0} at offset {1}: {2} of {3} bytes".format(source.path, source_offset + done, len(data), piece_length))
+            destination.write(destination_offset + done, data)
+            done += piece_length
+
+    def copy_ranges(self, source, destination, ranges):
+        """
+        copies each (offset, length) in ranges to the same offset of the destination, with read ahead.
+        """
+        pieces = []
+        for offset, length in ranges:
+            for piece_offset in range(offset, offset + length, self.buffer_size):
+                pieces.append((piece_offset, min(self.buffer_size, offset + length - piece_offset)))
+        for offset, length, data in self.read_ranges(source, pieces):
+            destination.write(offset, data)
+        destination.sync()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import errno
+import os
+import os.path
+import re
+import socket
+from Common import CommonVariables, DeviceItem
+
+NETLINK_KOBJECT_UEVENT = 15
+# kernel uevents and the events udevd sends once it has updated its database
+UEVENT_GROUPS = 1 | 2
+
+
+def read_sys_file(path):
+    try:
+        with open(path, 'r') as sys_file:
+            return sys_file.read().strip()
+    except (IOError, OSError):
+        return None
+
+def list_dir(path):
+    try:
+        return sorted(os.listdir(path))
+    except OSError:
+        return []
+
+def lvm_name_from_dm_name(dm_name):
+    """
+    device mapper names of logical volumes are "<vg>-<lv>" with dashes inside the names doubled.
+    returns "<vg>/<lv>" like lvs reports it, or None when the name does not split that way.
+    """
+    parts = re.split(r'(?<!-)-(?!-)', dm_name)
+    if len(parts) != 2 or not parts[0] or not parts[1]:
+        return None
+    return parts[0].replace('--', '-') + '/' + parts[1].replace('--', '-')
+
+
+class UeventMonitor(object):
+    """
+    non-blocking subscription to the block device uevents, drained on every inventory lookup.
+    """
+    def __init__(self):
+        self.uevent_socket = None
+        try:
+            self.uevent_socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            self.uevent_socket.bind((0, UEVENT_GROUPS))
+            self.uevent_socket.setblocking(False)
+        except (AttributeError, socket.error):
+            self.close()
+
+    def is_available(self):
+        return self.uevent_socket is not None
+
+    def has_block_events(self):
+        changed = False
+        while self.uevent_socket is not None:
+            try:
+                message = self.uevent_socket.recv(65536)
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # the queue overflowed or the socket broke, events may have been lost
+                    self.close()
+                    changed = True
+                break
+            if b'SUBSYSTEM=block' in message:
+                changed = True
+        return changed
+
+    def close(self):
+        if self.uevent_socket is not None:
+            self.uevent_socket.close()
+        self.uevent_socket = None
+
+
+class BlockDeviceInventory(object):
+    """
+    all block devices of the machine, read from sysfs, the udev database and the mount table in
+    one pass, the same data lsblk reports. devices are indexed by name and major:minor, and
+    LVM names, crypt types and azure symlinks are joined in while building.
+    """
+    def __init__(self, logger,
+                 sys_class_block_path='/sys/class/block',
+                 udev_data_path='/run/udev/data',
+                 mountinfo_path='/proc/self/mountinfo',
+                 swaps_path='/proc/swaps',
+                 azure_symlinks_dir=CommonVariables.azure_symlinks_dir):
+        self.logger = logger
+        self.sys_class_block_path = sys_class_block_path
+        self.udev_data_path = udev_data_path
+        self.mountinfo_path = mountinfo_path
+        self.swaps_path = swaps_path
+        self.azure_symlinks_dir = azure_symlinks_dir
+        self.device_items_by_name = {}
+        self.device_items_by_majmin = {}
+        self.children = {}
+        self.parents = {}
+        self.roots = []
+        self.signature = None
+
+    @staticmethod
+    def is_supported(sys_class_block_path='/sys/class/block', udev_data_path='/run/udev/data'):
+        # without the udev database the file system type, label and uuid would need probing
+        return os.path.isdir(sys_class_block_path) and os.path.isdir(udev_data_path)
+
+    def get_signature(self):
+        """
+        cheap fingerprint of everything the inventory is built from, compared before each lookup
+        so that changes made without a uevent reaching us are still noticed.
+        """
+        signature = [tuple(list_dir(self.sys_class_block_path))]
+        try:
+            signature.append(os.stat(self.udev_data_path).st_mtime)
+        except OSError:
+            signature.append(None)
+        signature.append(read_sys_file(self.mountinfo_path))
+        signature.append(read_sys_file(self.swaps_path))
+        return tuple(signature)
+
+    def read_udev_properties(self, majmin):
+        properties = {}
+        udev_data = read_sys_file(os.path.join(self.udev_data_path, 'b' + majmin))
+        if udev_data:
+            for line in udev_data.splitlines():
+                if line.startswith('E:') and '=' in line:
+                    key, value = line[2:].split('=', 1)
+                    properties[key] = value
+        return properties
+
+    def read_mount_points(self):
+        """
+        returns the first mount point of every major:minor and swap device, as lsblk shows them.
+        """
+        mount_points = {}
+        mountinfo = read_sys_file(self.mountinfo_path) or ''
+        for line in mountinfo.splitlines():
+            fields = line.split()
+            if len(fields) < 10 or '-' not in fields[6:]:
+                continue
+            separator = fields.index('-', 6)
+            mount_point = re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), fields[4])
+            source = fields[separator + 2] if len(fields) > separator + 2 else ''
+            majmin = fields[2]
+            # btrfs reports an anonymous major:minor, the source device node tells the real one
+            if source.startswith('/dev/'):
+                try:
+                    rdev = os.stat(source).st_rdev
+                    majmin = str(os.major(rdev)) + ':' + str(os.minor(rdev))
+                except OSError:
+                    pass
+            if majmin not in mount_points:
+                mount_points[majmin] = mount_point
+
+        swaps = read_sys_file(self.swaps_path) or ''
+        for line in swaps.splitlines()[1:]:
+            fields = line.split()
+            if fields and fields[0].startswith('/dev/'):
+                try:
+                    rdev = os.stat(fields[0]).st_rdev
+                    mount_points.setdefault(str(os.major(rdev)) + ':' + str(os.minor(rdev)), '[SWAP]')
+                except OSError:
+                    pass
+        return mount_points
+
+    def read_azure_names(self):
+        # same layout get_azure_symlinks reads: symlinks at the top of /dev/disk/azure
+        azure_names = {}
+        for symlink in list_dir(self.azure_symlinks_dir):
+            symlink_full_path = os.path.join(self.azure_symlinks_dir, symlink)
+            if os.path.islink(symlink_full_path):
+                azure_names[os.path.realpath(symlink_full_path)] = symlink
+        return azure_names
+
+    def get_device_type(self, sys_path, kernel_name):
+        if os.path.exists(os.path.join(sys_path, 'partition')):
+            return 'part'
+        if kernel_name.startswith('dm-'):
+            dm_uuid = read_sys_file(os.path.join(sys_path, 'dm', 'uuid')) or ''
+            if dm_uuid.startswith('LVM-'):
+                return 'lvm'
+            if dm_uuid.startswith('CRYPT-'):
+                return 'crypt'
+            if dm_uuid.startswith('mpath-'):
+                return 'mpath'
+            return 'dm'
+        if kernel_name.startswith('md'):
+            return read_sys_file(os.path.join(sys_path, 'md', 'level')) or 'md'
+        if kernel_name.startswith('loop'):
+            return 'loop'
+        if read_sys_file(os.path.join(sys_path, 'device', 'type')) == '5':
+            return 'rom'
+        return 'disk'
+
+    def get_device_id(self, sys_path):
+        """
+        the hyper-v device id is an attribute of the vmbus device the disk hangs off,
+        found the way "udevadm info -a" does, by walking up the parent devices.
+        """
+        current_path = os.path.realpath(sys_path)
+        while current_path and current_path != '/' and current_path != os.path.dirname(current_path):
+            device_id = read_sys_file(os.path.join(current_path, 'device_id'))
+            if device_id:
+                match = re.findall(r'{(.*)}', device_id)
+                if match:
+                    return match[0]
+            current_path = os.path.dirname(current_path)
+        return ""
+
+    def build(self):
+        self.signature = self.get_signature()
+        self.device_items_by_name = {}
+        self.device_items_by_majmin = {}
+        self.children = {}
+        self.parents = {}
+        self.roots = []
+
+        mount_points = self.read_mount_points()
+        azure_names = self.read_azure_names()
+
+        for kernel_name in list_dir(self.sys_class_block_path):
+            sys_path = os.path.join(self.sys_class_block_path, kernel_name)
+            majmin = read_sys_file(os.path.join(sys_path, 'dev'))
+            if majmin is None:
+                continue
+            udev_properties = self.read_udev_properties(majmin)
+
+            device_item = DeviceItem()
+            device_item.type = self.get_device_type(sys_path, kernel_name)
+            device_item.name = kernel_name
+            if kernel_name.startswith('dm-'):
+                device_item.name = read_sys_file(os.path.join(sys_path, 'dm', 'name')) or kernel_name
+                if device_item.type == 'lvm':
+                    device_item.name = lvm_name_from_dm_name(device_item.name) or device_item.name
+            device_item.file_system = udev_properties.get('ID_FS_TYPE', '')
+            device_item.mount_point = mount_points.get(majmin, '')
+            label = udev_properties.get('ID_FS_LABEL_ENC')
+            if label is not None:
+                label = re.sub(r'\\x([0-9a-fA-F]{2})', lambda match: chr(int(match.group(1), 16)), label)
+            else:
+                label = udev_properties.get('ID_FS_LABEL', '')
+            device_item.label = label
+            device_item.uuid = udev_properties.get('ID_FS_UUID', '')
+            device_item.model = read_sys_file(os.path.join(sys_path, 'device', 'model')) or ''
+            size_sectors = read_sys_file(os.path.join(sys_path, 'size'))
+            device_item.size = int(size_sectors) * 512 if size_sectors and size_sectors.isdigit() else 0
+            device_item.majmin = majmin
+            device_item.device_id = self.get_device_id(sys_path) if not kernel_name.startswith('dm-') else ""
+            device_item.azure_name = azure_names.get('/dev/' + kernel_name, '')
+
+            self.device_items_by_name[kernel_name] = device_item
+            self.device_items_by_majmin[majmin] = kernel_name
+
+            # partitions hang off their disk, device mapper and md devices off their slaves
+            if device_item.type == 'part':
+                self.parents[kernel_name] = [os.path.basename(os.path.dirname(os.path.realpath(sys_path)))]
+            else:
+                self.parents[kernel_name] = list_dir(os.path.join(sys_path, 'slaves'))
+
+        for kernel_name in sorted(self.device_items_by_name.keys()):
+            known_parents = [parent for parent in self.parents[kernel_name] if parent in self.device_items_by_name]
+            self.parents[kernel_name] = known_parents
+            if not known_parents:
+                self.roots.append(kernel_name)
+            for parent in known_parents:
+                self.children.setdefault(parent, []).append(kernel_name)
+
+    def is_stale(self):
+        return self.signature is None or self.signature != self.get_signature()
+
+    def resolve_kernel_name(self, dev_path):
+        try:
+            rdev = os.stat(dev_path).st_rdev
+        except OSError:
+            return None
+        return self.device_items_by_majmin.get(str(os.major(rdev)) + ':' + str(os.minor(rdev)))
+
+    def get_physical_disks(self, dev_path):
+        """
+        returns the kernel names of the whole disks dev_path is stored on, more than one for
+        logical volumes or raid arrays spanning disks.
+        """
+        kernel_name = self.resolve_kernel_name(dev_path)
+        if kernel_name is None:
+            raise Exception("{0}: not a block device".format(dev_path))
+
+        physical_disks = []
+        pending = [kernel_name]
+        while pending:
+            kernel_name = pending.pop()
+            if not self.parents.get(kernel_name):
+                if kernel_name not in physical_disks:
+                    physical_disks.append(kernel_name)
+            pending.extend(self.parents.get(kernel_name, []))
+        return sorted(physical_disks)
+
+    def get_device_items(self, dev_path):
+        """
+        returns copies of the device items of dev_path and everything stacked on it, or of all
+        devices when dev_path is None, in the order lsblk lists them.
+        """
+        if dev_path is None:
+            kernel_names = self.roots
+        else:
+            kernel_name = self.resolve_kernel_name(dev_path)
+            if kernel_name is None:
+                raise Exception("{0}: not a block device".format(dev_path))
+            kernel_names = [kernel_name]
+
+        device_items = []
+        pending = list(reversed(kernel_names))
+        while pending:
+            kernel_name = pending.pop()
+            device_items.append(copy.copy(self.device_items_by_name[kernel_name]))
+            pending.extend(reversed(self.children.get(kernel_name, [])))
+        return device_items
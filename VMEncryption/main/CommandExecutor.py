@@ -23,9 +23,10 @@ import os
 import os.path
 import shlex
 import sys
+import time
 
 from subprocess import *
-from threading import Timer
+from threading import Lock, Timer
 
 class ProcessCommunicator(object):
     def __init__(self):
@@ -33,10 +34,41 @@ class ProcessCommunicator(object):
         self.stderr = None
 
 class CommandExecutor(object):
-    """description of class"""
+    """
+    runs commands in child processes. the number of processes started and the time spent
+    waiting for them are counted per program for all executors of the process.
+    """
+    counters = {}
+    counters_lock = Lock()
+
     def __init__(self, logger):
         self.logger = logger
 
+    @staticmethod
+    def count_process(program, elapsed_time):
+        with CommandExecutor.counters_lock:
+            count, total_time = CommandExecutor.counters.get(program, (0, 0.0))
+            CommandExecutor.counters[program] = (count + 1, total_time + elapsed_time)
+
+    @staticmethod
+    def get_counters():
+        """
+        returns {program: (process count, seconds spent)}.
+        """
+        with CommandExecutor.counters_lock:
+            return dict(CommandExecutor.counters)
+
+    @staticmethod
+    def reset_counters():
+        with CommandExecutor.counters_lock:
+            CommandExecutor.counters = {}
+
+    def log_counters(self):
+        counters = CommandExecutor.get_counters()
+        summary = ', '.join("{0}: {1} in {2:.2f}s".format(program, count, total_time)
+                            for program, (count, total_time) in sorted(counters.items()))
+        self.logger.log("processes started: {0}".format(summary or 'none'))
+
     def Execute(self, command_to_execute, raise_exception_on_failure=False, communicator=None, input=None, suppress_logging=False, timeout=0):
         if type(command_to_execute) == unicode:
             command_to_execute = command_to_execute.encode('ascii', 'ignore')
@@ -48,6 +80,7 @@ class CommandExecutor(object):
         timer = None
         return_code = None
 
+        start_time = time.time()
         try:
             proc = Popen(args, stdout=PIPE, stderr=PIPE, stdin=PIPE, close_fds=True)
         except Exception as e:
@@ -71,6 +104,7 @@ class CommandExecutor(object):
             if timer is not None:
                 timer.cancel()
             return_code = proc.returncode
+            CommandExecutor.count_process(os.path.basename(args[0]) if args else '', time.time() - start_time)
 
         if isinstance(communicator, ProcessCommunicator):
             communicator.stdout, communicator.stderr = stdout, stderr
@@ -77,6 +77,15 @@ class CommonVariables:
 
     SupportedVolumeTypes = [ VolumeTypeOS, VolumeTypeData, VolumeTypeAll ]
 
+    """
+    optional settings for encrypting the data volumes of independent disks in parallel,
+    a throughput of 0 means the copy is not throttled
+    """
+    MaxParallelVolumesKey = 'MaxParallelVolumes'
+    MaxCopyThroughputKey = 'MaxCopyThroughputMBps'
+    default_max_parallel_volumes = 4
+    default_max_copy_throughput = 0
+
     """
     command types
     """
@@ -114,6 +123,11 @@ class CommonVariables:
     OngoingItemCurrentLuksHeaderFilePathKey = 'CurrentLuksHeaderFilePath'
     OngoingItemCurrentSourcePathKey = 'CurrentSourcePath'
     OngoingItemCurrentBlockSizeKey = 'CurrentBlockSize'
+    OngoingItemJournalGenerationKey = 'JournalGeneration'
+    OngoingItemJournalBackupRecord = 'backup'
+    OngoingItemJournalDoneRecord = 'done'
+    # the journal is folded into a config snapshot after this many records
+    OngoingItemJournalMaxRecords = 1024
 
     """
     encryption phase devinitions
@@ -33,12 +33,50 @@ class ConfigUtil(object):
         self.config_file_path = config_file_path
         self.logger = logger
         self.azure_crypt_config_section = section_name
+        self.config_cache = None
+        self.config_cache_signature = None
     
     def config_file_exists(self):
         return os.path.exists(self.config_file_path)
 
+    def read_config(self):
+        """
+        returns the parsed config file, it is only parsed again when the file was replaced or changed.
+        the returned parser is shared, callers must not modify it.
+        """
+        stat_result = os.stat(self.config_file_path)
+        signature = (stat_result.st_ino, stat_result.st_size, stat_result.st_mtime)
+        if self.config_cache is None or signature != self.config_cache_signature:
+            config = ConfigParser()
+            config.read(self.config_file_path)
+            self.config_cache = config
+            self.config_cache_signature = signature
+        return self.config_cache
+
+    def write_config(self, config):
+        """
+        writes a complete new file and renames it over the old one, so a crash leaves either
+        the old or the new config and never a half written one.
+        config becomes the cached parser, so callers must not modify it afterwards.
+        """
+        temp_file_path = self.config_file_path + '.tmp'
+        with open(temp_file_path, 'wb') as configfile:
+            config.write(configfile)
+            configfile.flush()
+            os.fsync(configfile.fileno())
+            # the rename keeps the inode, size and mtime of the new file
+            stat_result = os.fstat(configfile.fileno())
+        self.config_cache = None
+        os.rename(temp_file_path, self.config_file_path)
+        self.config_cache = config
+        self.config_cache_signature = (stat_result.st_ino, stat_result.st_size, stat_result.st_mtime)
+        config_dir_fd = os.open(os.path.dirname(os.path.abspath(self.config_file_path)), os.O_RDONLY)
+        try:
+            os.fsync(config_dir_fd)
+        finally:
+            os.close(config_dir_fd)
+
     def save_config(self, prop_name, prop_value):
-        #TODO make the operation an transaction.
         config = ConfigParser()
         if os.path.exists(self.config_file_path):
             config.read(self.config_file_path)
@@ -46,8 +84,7 @@ class ConfigUtil(object):
         if not config.has_section(self.azure_crypt_config_section):
             config.add_section(self.azure_crypt_config_section)
         config.set(self.azure_crypt_config_section, prop_name, prop_value)
-        with open(self.config_file_path, 'wb') as configfile:
-            config.write(configfile)
+        self.write_config(config)
 
     def save_configs(self, key_value_pairs):
         config = ConfigParser()
@@ -59,15 +96,13 @@ class ConfigUtil(object):
         for key_value_pair in key_value_pairs:
             if key_value_pair.prop_value is not None:
                 config.set(self.azure_crypt_config_section, key_value_pair.prop_name, key_value_pair.prop_value)
-        with open(self.config_file_path, 'wb') as configfile:
-            config.write(configfile)
+        self.write_config(config)
 
     def get_config(self, prop_name):
         # write the configs, the bek file name and so on.
         if os.path.exists(self.config_file_path):
             try:
-                config = ConfigParser()
-                config.read(self.config_file_path)
+                config = self.read_config()
                 # read values from a section
                 prop_value = config.get(self.azure_crypt_config_section, prop_name)
                 return prop_value
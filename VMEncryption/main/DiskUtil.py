@@ -26,12 +26,14 @@ import shutil
 import traceback
 import uuid
 import glob
+import threading
 from datetime import datetime
 
 from EncryptionConfig import EncryptionConfig
 from DecryptionMarkConfig import DecryptionMarkConfig
 from EncryptionMarkConfig import EncryptionMarkConfig
 from TransactionalCopyTask import TransactionalCopyTask
+from BlockDeviceInventory import BlockDeviceInventory, UeventMonitor, list_dir, read_sys_file
 from CommandExecutor import CommandExecutor, ProcessCommunicator
 from Common import CommonVariables, CryptItem, LvmItem, DeviceItem
 
@@ -39,7 +41,12 @@ from Common import CommonVariables, CryptItem, LvmItem, DeviceItem
 class DiskUtil(object):
     os_disk_lvm = None
     sles_cache = {}
+    sles_cache_loaded = False
     device_id_cache = {}
+    block_device_inventory = None
+    uevent_monitor = None
+    # data volumes are encrypted on several threads which share the inventory
+    block_device_inventory_lock = threading.Lock()
 
     def __init__(self, hutil, patching, logger, encryption_environment):
         self.encryption_environment = encryption_environment
@@ -51,25 +58,22 @@ class DiskUtil(object):
 
         self.command_executor = CommandExecutor(self.logger)
 
-    def copy(self, ongoing_item_config, status_prefix=''):
+    def copy(self, ongoing_item_config, status_prefix='', io_budget=None, progress=None):
         copy_task = TransactionalCopyTask(logger=self.logger,
                                           disk_util=self,
                                           hutil=self.hutil,
                                           ongoing_item_config=ongoing_item_config,
                                           patching=self.distro_patcher,
                                           encryption_environment=self.encryption_environment,
-                                          status_prefix=status_prefix)
+                                          status_prefix=status_prefix,
+                                          io_budget=io_budget,
+                                          progress=progress)
         try:
-            mem_fs_result = copy_task.prepare_mem_fs()
-            if mem_fs_result != CommonVariables.process_success:
-                return CommonVariables.tmpfs_error
-            else:
-                return copy_task.begin_copy()
+            return copy_task.begin_copy()
         except Exception as e:
-            message = "Failed to perform dd copy: {0}, stack trace: {1}".format(e, traceback.format_exc())
+            message = "Failed to perform the copy: {0}, stack trace: {1}".format(e, traceback.format_exc())
             self.logger.log(msg=message, level=CommonVariables.ErrorLevel)
-        finally:
-            copy_task.clear_mem_fs()
+            return CommonVariables.copy_data_error
 
     def format_disk(self, dev_path, file_system):
         mkfs_command = ""
@@ -933,7 +937,66 @@ class DiskUtil(object):
 
         return DiskUtil.device_id_cache[dev_path]
 
+    @staticmethod
+    def reset_device_caches():
+        """
+        drops the device properties gathered so far, called at the start of every daemon cycle.
+        """
+        DiskUtil.sles_cache = {}
+        DiskUtil.sles_cache_loaded = False
+        DiskUtil.device_id_cache = {}
+
+    def load_device_properties(self, sys_class_block_path='/sys/class/block'):
+        """
+        fills sles_cache with the properties of all block devices at once: the file system type,
+        label and uuid from a single blkid run, everything else from sysfs and the mount table.
+        devices are filed under their kernel name and, for device mapper, their mapper name.
+        """
+        DiskUtil.sles_cache_loaded = True
+        inventory = BlockDeviceInventory(self.logger, sys_class_block_path=sys_class_block_path)
+        mount_points = inventory.read_mount_points()
+
+        blkid_properties = None
+        proc_comm = ProcessCommunicator()
+        # no blkid cache file, it can be stale after the devices changed
+        return_code = self.command_executor.Execute(self.distro_patcher.blkid_path + " -c /dev/null -o export",
+                                                    communicator=proc_comm,
+                                                    suppress_logging=True)
+        if return_code == CommonVariables.process_success:
+            blkid_properties = {}
+            for block in proc_comm.stdout.split('\n\n'):
+                properties = dict(line.split('=', 1) for line in block.splitlines() if '=' in line)
+                if 'DEVNAME' in properties:
+                    blkid_properties[os.path.basename(os.path.realpath(properties['DEVNAME']))] = properties
+
+        for kernel_name in list_dir(sys_class_block_path):
+            sys_path = os.path.join(sys_class_block_path, kernel_name)
+            majmin = read_sys_file(os.path.join(sys_path, 'dev'))
+            sectors = read_sys_file(os.path.join(sys_path, 'size'))
+            properties = {
+                'MAJ:MIN': majmin or '',
+                'SIZE': str(int(sectors) * 512) if sectors else '',
+                'MOUNTPOINT': mount_points.get(majmin, ''),
+                'DEVICE_ID': inventory.get_device_id(sys_path),
+            }
+            if blkid_properties is not None:
+                device_blkid_properties = blkid_properties.get(kernel_name, {})
+                properties['FSTYPE'] = device_blkid_properties.get('TYPE', '')
+                properties['LABEL'] = device_blkid_properties.get('LABEL', '')
+                properties['UUID'] = device_blkid_properties.get('UUID', '')
+
+            dev_names = [kernel_name]
+            mapper_name = read_sys_file(os.path.join(sys_path, 'dm', 'name'))
+            if mapper_name:
+                dev_names.append(mapper_name)
+            for dev_name in dev_names:
+                for property_name, property_value in properties.items():
+                    DiskUtil.sles_cache[(dev_name, property_name)] = property_value
+
     def get_device_items_property(self, dev_name, property_name):
+        if not DiskUtil.sles_cache_loaded:
+            self.load_device_properties()
+
         if (dev_name, property_name) in DiskUtil.sles_cache:
             return DiskUtil.sles_cache[(dev_name, property_name)]
 
@@ -1066,6 +1129,41 @@ class DiskUtil(object):
 
         return device_items_to_return
 
+    def get_block_device_inventory(self):
+        """
+        returns the cached inventory, rebuilt when a block uevent arrived or the sysfs, udev or
+        mount state it was built from changed. None when the udev database is not available.
+        """
+        if not BlockDeviceInventory.is_supported():
+            return None
+
+        with DiskUtil.block_device_inventory_lock:
+            if DiskUtil.uevent_monitor is None:
+                DiskUtil.uevent_monitor = UeventMonitor()
+
+            has_block_events = DiskUtil.uevent_monitor.has_block_events()
+            if DiskUtil.block_device_inventory is None or has_block_events or DiskUtil.block_device_inventory.is_stale():
+                block_device_inventory = BlockDeviceInventory(self.logger)
+                block_device_inventory.build()
+                DiskUtil.block_device_inventory = block_device_inventory
+
+            return DiskUtil.block_device_inventory
+
+    def get_physical_disks(self, dev_name):
+        """
+        returns the names of the whole disks the device is stored on. without the inventory the
+        disks are unknown, so every device is reported on the same disk and nothing runs in parallel.
+        """
+        block_device_inventory = self.get_block_device_inventory()
+        dev_path = self.get_device_path(dev_name)
+        if block_device_inventory is None or dev_path is None:
+            return ['unknown']
+        try:
+            return block_device_inventory.get_physical_disks(dev_path)
+        except Exception as e:
+            self.logger.log(msg="failed to find the disks of {0}: {1}".format(dev_name, e), level=CommonVariables.WarningLevel)
+            return ['unknown']
+
     def get_device_items(self, dev_path):
         if self.distro_patcher.distro_info[0].lower() == 'suse' and self.distro_patcher.distro_info[1] == '11':
             return self.get_device_items_sles(dev_path)
@@ -1073,6 +1171,10 @@ class DiskUtil(object):
             if dev_path:
                 self.logger.log(msg=("getting blk info for: " + str(dev_path)))
 
+            block_device_inventory = self.get_block_device_inventory()
+            if block_device_inventory is not None:
+                return block_device_inventory.get_device_items(dev_path)
+
             if dev_path is None:
                 lsblk_command = 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE,MAJ:MIN'
             else:
@@ -1083,6 +1185,7 @@ class DiskUtil(object):
             
             device_items = []
             lvm_items = self.get_lvm_items()
+            azure_symlinks = self.get_azure_symlinks()
             for line in proc_comm.stdout.splitlines():
                 if line:
                     device_item = DeviceItem()
@@ -1129,7 +1232,7 @@ class DiskUtil(object):
                                 device_item.name = lvm_item.vg_name + '/' + lvm_item.lv_name
 
                     device_item.azure_name = ''
-                    for symlink, target in self.get_azure_symlinks().items():
+                    for symlink, target in azure_symlinks.items():
                         if device_item.name in target:
                             device_item.azure_name = symlink
 
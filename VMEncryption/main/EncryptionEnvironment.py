@@ -35,11 +35,15 @@ class EncryptionEnvironment(object):
         self.azure_crypt_request_queue_path = os.path.join(self.encryption_config_path, 'azure_crypt_request_queue.ini')
         self.azure_decrypt_request_queue_path = os.path.join(self.encryption_config_path, 'azure_decrypt_request_queue.ini')
         self.azure_crypt_ongoing_item_config_path = os.path.join(self.encryption_config_path, 'azure_crypt_ongoing_item.ini')
+        self.azure_crypt_ongoing_item_journal_path = os.path.join(self.encryption_config_path, 'azure_crypt_ongoing_item.journal')
+        # one config, journal and slice backup per volume when several volumes are encrypted at once
+        self.azure_crypt_ongoing_items_path = os.path.join(self.encryption_config_path, 'azure_crypt_ongoing_items')
         self.azure_crypt_current_transactional_copy_path = os.path.join(self.encryption_config_path, 'azure_crypt_copy_progress.ini')
         self.luks_header_base_path = os.path.join(self.encryption_config_path, 'azureluksheader')
         self.cleartext_key_base_path = os.path.join(self.encryption_config_path, 'cleartext_key')
         self.copy_header_slice_file_path = os.path.join(self.encryption_config_path, 'copy_header_slice_file')
         self.copy_slice_item_backup_file = os.path.join(self.encryption_config_path, 'copy_slice_item.bak')
+        self.copy_allocation_map_file = os.path.join(self.encryption_config_path, 'copy_allocation_map')
         self.os_encryption_markers_path = os.path.join(self.encryption_config_path, 'os_encryption_markers')
         self.bek_backup_path = os.path.join(self.encryption_config_path, 'bek_backup')
 
@@ -21,6 +21,7 @@ import os.path
 import uuid
 import time
 import datetime
+import traceback
 from Common import CommonVariables
 from ConfigParser import ConfigParser
 from ConfigUtil import ConfigUtil
@@ -28,9 +29,25 @@ from ConfigUtil import ConfigKeyValuePair
 
 
 class OnGoingItemConfig(object):
-    def __init__(self, encryption_environment, logger):
+    """
+    item_name is None for the single ongoing item, otherwise the item gets its own config,
+    journal, slice backup and allocation map so that several volumes can be encrypted and resumed at once.
+    """
+    def __init__(self, encryption_environment, logger, item_name=None):
         self.encryption_environment = encryption_environment
         self.logger = logger
+        self.item_name = item_name
+        if item_name is None:
+            self.config_path = encryption_environment.azure_crypt_ongoing_item_config_path
+            self.journal_path = encryption_environment.azure_crypt_ongoing_item_journal_path
+            self.slice_backup_file_path = encryption_environment.copy_slice_item_backup_file
+            self.allocation_map_path = encryption_environment.copy_allocation_map_file
+        else:
+            item_path = os.path.join(encryption_environment.azure_crypt_ongoing_items_path, item_name)
+            self.config_path = item_path + '.ini'
+            self.journal_path = item_path + '.journal'
+            self.slice_backup_file_path = item_path + '.bak'
+            self.allocation_map_path = item_path + '.extents'
         self.original_dev_name_path = None
         self.original_dev_path = None
         self.mapper_name = None
@@ -46,7 +63,25 @@ class OnGoingItemConfig(object):
         self.current_total_copy_size = None
         self.current_slice_index = None
         self.current_destination = None
-        self.ongoing_item_config = ConfigUtil(encryption_environment.azure_crypt_ongoing_item_config_path, 'azure_crypt_ongoing_item_config', logger)
+        self.journal_generation = None
+        self.journal_file = None
+        self.journal_record_count = 0
+        # None until the journal was read, then the last record of the current generation
+        self.last_journal_record = None
+        self.last_journal_record_known = False
+        self.ongoing_item_config = ConfigUtil(self.config_path, 'azure_crypt_ongoing_item_config', logger)
+
+    @staticmethod
+    def get_item_names(encryption_environment):
+        """
+        names of the per item configs left behind, archived configs do not end with .ini.
+        """
+        item_names = []
+        if os.path.isdir(encryption_environment.azure_crypt_ongoing_items_path):
+            for file_name in sorted(os.listdir(encryption_environment.azure_crypt_ongoing_items_path)):
+                if file_name.endswith('.ini'):
+                    item_names.append(file_name[:-len('.ini')])
+        return item_names
 
     def config_file_exists(self):
         return self.ongoing_item_config.config_file_exists()
@@ -83,12 +118,94 @@ class OnGoingItemConfig(object):
             return long(device_size_value)
 
     def get_current_slice_index(self):
+        """
+        the copy progress recorded in the journal after the last commit wins over the config file.
+        a slice whose backup record is the last one, but whose backup file is gone, was fully written.
+        """
+        last_record = self.get_last_journal_record()
+        if last_record is not None:
+            record_type, slice_index = last_record
+            if record_type == CommonVariables.OngoingItemJournalBackupRecord and not os.path.exists(self.slice_backup_file_path):
+                return slice_index + 1
+            return slice_index
+
         current_slice_index_value = self.ongoing_item_config.get_config(CommonVariables.OngoingItemCurrentSliceIndexKey)
         if current_slice_index_value is None or current_slice_index_value == "":
             return None
         else:
             return long(current_slice_index_value)
 
+    def is_slice_backup_stale(self):
+        """
+        the backup file belongs to a finished slice, or to one whose copy did not reach the
+        destination yet, either way the source slice is intact and the backup can be dropped.
+        """
+        last_record = self.get_last_journal_record()
+        return last_record is not None \
+            and last_record[0] == CommonVariables.OngoingItemJournalDoneRecord \
+            and os.path.exists(self.slice_backup_file_path)
+
+    def get_journal_generation(self):
+        if self.journal_generation is None:
+            journal_generation_value = self.ongoing_item_config.get_config(CommonVariables.OngoingItemJournalGenerationKey)
+            if journal_generation_value is None or journal_generation_value == "":
+                self.journal_generation = 0
+            else:
+                self.journal_generation = long(journal_generation_value)
+        return self.journal_generation
+
+    def get_last_journal_record(self):
+        """
+        returns (record_type, slice_index) of the last complete journal record written for the
+        committed config, records of an older generation and a torn last line are ignored.
+        the journal is only read once, later records are tracked as they are written.
+        """
+        if self.last_journal_record_known:
+            return self.last_journal_record
+
+        journal_path = self.journal_path
+        generation = self.get_journal_generation()
+        last_record = None
+        record_count = 0
+        if os.path.exists(journal_path):
+            with open(journal_path, 'r') as journal_file:
+                for line in journal_file:
+                    if not line.endswith('\n'):
+                        break
+                    parts = line.split()
+                    if len(parts) != 3 or not parts[0].isdigit() or not parts[2].isdigit():
+                        continue
+                    if long(parts[0]) == generation:
+                        last_record = (parts[1], long(parts[2]))
+                        record_count += 1
+        self.last_journal_record = last_record
+        self.journal_record_count = record_count
+        self.last_journal_record_known = True
+        return last_record
+
+    def checkpoint(self, record_type, slice_index):
+        """
+        appends one record to the journal and syncs it, which is far cheaper than rewriting the config.
+        every record has to be durable before the copy goes on: a backup record guards the write of
+        the destination and a done record guards overwriting the slice backup with the next slice.
+        once the journal is long the progress is folded into a new config snapshot.
+        """
+        self.get_last_journal_record()
+        if self.journal_file is None:
+            self.journal_file = open(self.journal_path, 'a')
+        self.journal_file.write("{0} {1} {2}\n".format(self.get_journal_generation(), record_type, slice_index))
+        self.journal_file.flush()
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(self.journal_file.fileno())
+        else:
+            os.fsync(self.journal_file.fileno())
+        self.last_journal_record = (record_type, slice_index)
+        self.journal_record_count += 1
+
+        if record_type == CommonVariables.OngoingItemJournalDoneRecord \
+           and self.journal_record_count >= CommonVariables.OngoingItemJournalMaxRecords:
+            self.commit()
+
     def get_from_end(self):
         return self.ongoing_item_config.get_config(CommonVariables.OngoingItemFromEndKey)
 
@@ -179,17 +296,45 @@ class OnGoingItemConfig(object):
         current_block_size_pair = ConfigKeyValuePair(CommonVariables.OngoingItemCurrentBlockSizeKey, self.current_block_size)
         key_value_pairs.append(current_block_size_pair)
 
+        if self.is_slice_backup_stale():
+            os.remove(self.slice_backup_file_path)
+
+        # the journal only extends the config of its own generation, so bumping it retires the old records
+        self.journal_generation = self.get_journal_generation() + 1
+        journal_generation_pair = ConfigKeyValuePair(CommonVariables.OngoingItemJournalGenerationKey, self.journal_generation)
+        key_value_pairs.append(journal_generation_pair)
+
+        config_dir = os.path.dirname(self.config_path)
+        if not os.path.exists(config_dir):
+            os.makedirs(config_dir)
         self.ongoing_item_config.save_configs(key_value_pairs)
+        self.remove_journal()
+
+    def remove_journal(self):
+        self.close_journal()
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.last_journal_record = None
+        self.journal_record_count = 0
+        self.last_journal_record_known = True
+
+    def close_journal(self):
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
 
     def clear_config(self):
         try:
-            if os.path.exists(self.encryption_environment.azure_crypt_ongoing_item_config_path):
-                self.logger.log(msg="archive the config file: {0}".format(self.encryption_environment.azure_crypt_ongoing_item_config_path))
+            if os.path.exists(self.config_path):
+                self.logger.log(msg="archive the config file: {0}".format(self.config_path))
                 time_stamp = datetime.datetime.now()
-                new_name = "{0}_{1}".format(self.encryption_environment.azure_crypt_ongoing_item_config_path, time_stamp)
-                os.rename(self.encryption_environment.azure_crypt_ongoing_item_config_path, new_name)
+                new_name = "{0}_{1}".format(self.config_path, time_stamp)
+                os.rename(self.config_path, new_name)
+                self.remove_journal()
+                if os.path.exists(self.allocation_map_path):
+                    os.remove(self.allocation_map_path)
             else:
-                self.logger.log(msg=("the config file not exist: {0}".format(self.encryption_environment.azure_crypt_ongoing_item_config_path)), level = CommonVariables.WarningLevel)
+                self.logger.log(msg=("the config file not exist: {0}".format(self.config_path)), level = CommonVariables.WarningLevel)
             return True
         except OSError as e:
             self.logger.log("Failed to archive_backup_config with error: {0}, stack trace: {1}".format(e, traceback.format_exc()))
@@ -16,15 +16,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import subprocess
 import os
 import os.path
-import sys
-import shlex
-from subprocess import *
-from CommandExecutor import CommandExecutor
+import traceback
+from AllocationMap import AllocationMap
+from BlockCopyEngine import BlockCopyEngine, write_at
 from Common import CommonVariables
-from ConfigUtil import ConfigUtil
 from OnGoingItemConfig import *
 
 
@@ -32,12 +29,19 @@ class TransactionalCopyTask(object):
     """
     copy_total_size is in byte, skip_target_size is also in byte
     slice_size is in byte 50M
+
+    every slice is first made durable in the slice backup file and recorded in the ongoing item
+    journal, only then written to the destination, so a slice interrupted half way can be
+    replayed from the backup even when the destination overlaps the source.
+
+    slices holding no block the file system allocated are skipped, they get no journal record
+    so a resumed copy skips them again by the saved allocation map.
     """
-    def __init__(self, logger, hutil, disk_util, ongoing_item_config, patching, encryption_environment, status_prefix=''):
+    def __init__(self, logger, hutil, disk_util, ongoing_item_config, patching, encryption_environment, status_prefix='', io_budget=None, progress=None):
         """
         copy_total_size is in bytes.
+        io_budget throttles the slice writes, progress(done_slices, total_slices) replaces the status report.
         """
-        self.command_executer = CommandExecutor(logger)
         self.ongoing_item_config = ongoing_item_config
         self.total_size = self.ongoing_item_config.get_current_total_copy_size()
         self.block_size = self.ongoing_item_config.get_current_block_size()
@@ -48,247 +52,183 @@ class TransactionalCopyTask(object):
 
         self.last_slice_size = self.total_size % self.block_size
         # we add 1 even the last_slice_size is zero.
-        self.total_slice_size = ((self.total_size - self.last_slice_size) / self.block_size) + 1
+        self.total_slice_size = ((self.total_size - self.last_slice_size) // self.block_size) + 1
 
         self.status_prefix = status_prefix
+        self.io_budget = io_budget
+        self.progress = progress
         self.encryption_environment = encryption_environment
         self.logger = logger
         self.patching = patching
         self.disk_util = disk_util
         self.hutil = hutil
-        self.tmpfs_mount_point = "/mnt/azure_encrypt_tmpfs"
-        self.slice_file_path = self.tmpfs_mount_point + "/slice_file"
-        self.copy_command = self.patching.dd_path
-
-    def resume_copy_internal(self, copy_slice_item_backup_file_size, skip_block, original_total_copy_size):
-        block_size_of_slice_item_backup = 512
-        #copy the left slice
-        if copy_slice_item_backup_file_size <= original_total_copy_size:
-            skip_of_slice_item_backup_file = copy_slice_item_backup_file_size / block_size_of_slice_item_backup
-            left_count = ((original_total_copy_size - copy_slice_item_backup_file_size) / block_size_of_slice_item_backup)
-            total_count = original_total_copy_size / block_size_of_slice_item_backup
-            original_device_skip_count = (self.block_size * skip_block) / block_size_of_slice_item_backup 
-            if left_count != 0:
-                dd_cmd = str(self.copy_command) \
-                       + ' if=' + self.source_dev_full_path \
-                       + ' of=' + self.encryption_environment.copy_slice_item_backup_file \
-                       + ' bs=' + str(block_size_of_slice_item_backup) \
-                       + ' skip=' + str(original_device_skip_count + skip_of_slice_item_backup_file) \
-                       + ' seek=' + str(skip_of_slice_item_backup_file) \
-                       + ' count=' + str(left_count)
-
-                return_code = self.command_executer.Execute(dd_cmd)
-                if return_code != CommonVariables.process_success:
-                    return return_code
-
-            dd_cmd = str(self.copy_command) \
-                   + ' if=' + self.encryption_environment.copy_slice_item_backup_file \
-                   + ' of=' + self.destination \
-                   + ' bs=' + str(block_size_of_slice_item_backup) \
-                   + ' seek=' + str(original_device_skip_count) \
-                   + ' count=' + str(total_count)
-
-            return_code = self.command_executer.Execute(dd_cmd)
-            if return_code != CommonVariables.process_success:
-                return return_code
-            else:
-                self.current_slice_index += 1
-                self.ongoing_item_config.current_slice_index = self.current_slice_index
-                self.ongoing_item_config.commit()
-                if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                    os.remove(self.encryption_environment.copy_slice_item_backup_file)
-                return return_code
-        else:
-            self.logger.log(msg="copy_slice_item_backup_file_size is bigger than original_total_copy_size",
-                            level=CommonVariables.ErrorLevel)
-            return CommonVariables.backup_slice_file_error
+        self.copy_engine = BlockCopyEngine(logger=logger, buffer_size=self.block_size)
 
-    def resume_copy(self):
-        if self.from_end.lower() == 'true':
-            skip_block = (self.total_slice_size - self.current_slice_index - 1)
-        else:
-            skip_block = self.current_slice_index
-
-        return_code = CommonVariables.process_success
-
-        if self.current_slice_index == 0:
-            if self.last_slice_size > 0:
-                if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                    copy_slice_item_backup_file_size = os.path.getsize(self.encryption_environment.copy_slice_item_backup_file)
-                    return_code = self.resume_copy_internal(copy_slice_item_backup_file_size=copy_slice_item_backup_file_size,
-                                                           skip_block=skip_block,
-                                                           original_total_copy_size=self.last_slice_size)
-                else:
-                    self.logger.log(msg="1. the slice item backup file not exists.",
-                                    level=CommonVariables.WarningLevel)
-            else:
-                self.logger.log(msg="the last slice",
-                                level=CommonVariables.WarningLevel)
-        else:
-            if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                copy_slice_item_backup_file_size = os.path.getsize(self.encryption_environment.copy_slice_item_backup_file)
-                return_code = self.resume_copy_internal(copy_slice_item_backup_file_size, skip_block=skip_block, original_total_copy_size=self.block_size)
-            else:
-                self.logger.log(msg="2. unfortunately the slice item backup file not exists.",
-                                level=CommonVariables.WarningLevel)
-        return return_code
-
-    def copy_last_slice(self, skip_block):
-        block_size_of_last_slice = 512
-        skip_of_last_slice = (skip_block * self.block_size) / block_size_of_last_slice
-        count_of_last_slice = self.last_slice_size / block_size_of_last_slice
-
-        copy_result = self.copy_internal(from_device=self.source_dev_full_path,
-                                         to_device = self.destination,
-                                         skip=skip_of_last_slice,
-                                         seek=skip_of_last_slice,
-                                         block_size=block_size_of_last_slice,
-                                         count = count_of_last_slice)
-        return copy_result
-
-    def begin_copy(self):
+    def get_slice_range(self, slice_index):
         """
-        check the device_item size first, cut it
+        returns (offset, length) of the slice in both the source and the destination.
+        the slice holding the remainder is copied first when copying from the end.
         """
-        self.resume_copy()
         if self.from_end.lower() == 'true':
-            while self.current_slice_index < self.total_slice_size:
-                skip_block = (self.total_slice_size - self.current_slice_index - 1)
-
-                if self.current_slice_index == 0:
-                    if self.last_slice_size > 0:
-                        copy_result = self.copy_last_slice(skip_block)
-                        if copy_result != CommonVariables.process_success:
-                            return copy_result
-                    else:
-                        self.logger.log(msg = "the last slice size is zero, so skip the 0 index.")
-                else:
-                    copy_result = self.copy_internal(from_device=self.source_dev_full_path,
-                                                     to_device=self.destination,
-                                                     skip=skip_block,
-                                                     seek=skip_block,
-                                                     block_size=self.block_size)
-
-                    if copy_result != CommonVariables.process_success:
-                        return copy_result
-
-                self.current_slice_index += 1
-
-                if self.status_prefix:
-                    msg = self.status_prefix + ': ' \
-                        + str(int(self.current_slice_index / (float)(self.total_slice_size) * 100.0)) \
-                        + '%'
-
-                    self.hutil.do_status_report(operation='DataCopy',
-                                                status=CommonVariables.extension_success_status,
-                                                status_code=str(CommonVariables.success),
-                                                message=msg)
-
-                self.ongoing_item_config.current_slice_index = self.current_slice_index
-                self.ongoing_item_config.commit()
-
-            return CommonVariables.process_success
+            skip_block = self.total_slice_size - slice_index - 1
+            is_last_slice = (slice_index == 0)
         else:
-            while self.current_slice_index < self.total_slice_size:
-                skip_block = self.current_slice_index
-
-                if self.current_slice_index == (self.total_slice_size - 1):
-                    if self.last_slice_size > 0:
-                        copy_result = self.copy_last_slice(skip_block)
-                        if copy_result != CommonVariables.process_success:
-                            return copy_result
-                    else:
-                        self.logger.log(msg = "the last slice size is zero, so skip the last slice index.")
-                else:
-                    copy_result = self.copy_internal(from_device=self.source_dev_full_path,
-                                                     to_device=self.destination,
-                                                     skip=skip_block,
-                                                     seek=skip_block,
-                                                     block_size=self.block_size)
+            skip_block = slice_index
+            is_last_slice = (slice_index == self.total_slice_size - 1)
 
-                    if copy_result != CommonVariables.process_success:
-                        return copy_result
+        if is_last_slice:
+            return skip_block * self.block_size, self.last_slice_size
+        return skip_block * self.block_size, self.block_size
 
-                self.current_slice_index += 1
+    def resume_copy(self, source, destination):
+        backup_file_path = self.ongoing_item_config.slice_backup_file_path
 
-                if self.status_prefix:
-                    msg = self.status_prefix + ': ' \
-                        + str(int(self.current_slice_index / (float)(self.total_slice_size) * 100.0)) \
-                        + '%'
-
-                    self.hutil.do_status_report(operation='DataCopy',
-                                                status=CommonVariables.extension_success_status,
-                                                status_code=str(CommonVariables.success),
-                                                message=msg)
+        if self.ongoing_item_config.is_slice_backup_stale():
+            self.logger.log(msg="the slice item backup file was not used for the destination yet, remove it.",
+                            level=CommonVariables.WarningLevel)
+            os.remove(backup_file_path)
+            return CommonVariables.process_success
 
-                self.hutil.do_status_report(operation='DataCopy',
-                                            status=CommonVariables.extension_success_status,
-                                            status_code=str(CommonVariables.success),
-                                            message=msg)
+        if not os.path.exists(backup_file_path):
+            self.logger.log(msg="the slice item backup file not exists.",
+                            level=CommonVariables.WarningLevel)
+            return CommonVariables.process_success
 
-                self.ongoing_item_config.current_slice_index = self.current_slice_index
-                self.ongoing_item_config.commit()
+        offset, length = self.get_slice_range(self.current_slice_index)
+        if length == 0:
+            self.logger.log(msg="the last slice",
+                            level=CommonVariables.WarningLevel)
             return CommonVariables.process_success
 
-    """
-    TODO: if the copy failed?
-    """
-    def copy_internal(self, from_device, to_device,  block_size, skip=0, seek=0, count=1):
+        copy_slice_item_backup_file_size = os.path.getsize(backup_file_path)
+        if copy_slice_item_backup_file_size > length:
+            self.logger.log(msg="copy_slice_item_backup_file_size is bigger than original_total_copy_size",
+                            level=CommonVariables.ErrorLevel)
+            return CommonVariables.backup_slice_file_error
+
+        self.logger.log(msg="replaying slice {0} from the slice item backup file".format(self.current_slice_index))
+        backup = self.copy_engine.open_destination(backup_file_path)
+        try:
+            # a backup left short was being written when we stopped, the destination was not touched yet
+            if copy_slice_item_backup_file_size < length:
+                self.copy_engine.copy_range(source, backup, offset + copy_slice_item_backup_file_size, copy_slice_item_backup_file_size, length - copy_slice_item_backup_file_size)
+                backup.sync()
+            self.ongoing_item_config.checkpoint(CommonVariables.OngoingItemJournalBackupRecord, self.current_slice_index)
+            self.copy_engine.copy_range(backup, destination, 0, offset, length)
+            destination.sync()
+        finally:
+            backup.close()
+
+        self.finish_slice(self.current_slice_index)
+        return CommonVariables.process_success
+
+    def get_allocation_map(self):
         """
-        first, copy the data to the middle cache
+        the free space map is only read before the first slice is copied, after that the source
+        is partly overwritten and only the saved map is trusted. None copies every slice.
         """
-        dd_cmd = str(self.copy_command) \
-               + ' if=' + from_device \
-               + ' of=' + self.slice_file_path \
-               + ' bs=' + str(block_size) \
-               + ' skip=' + str(skip) \
-               + ' count=' + str(count)
-
-        return_code = self.command_executer.Execute(dd_cmd)
-        if return_code != CommonVariables.process_success:
-            self.logger.log(msg="{0} is {1}".format(dd_cmd, return_code), level=CommonVariables.ErrorLevel)
-            return return_code
-        else:
-            slice_file_size = os.path.getsize(self.slice_file_path)
-            self.logger.log(msg=("slice_file_size is: {0}".format(slice_file_size)))
-            """
-            second, copy the data in the middle cache to the backup slice.
-            """
-            backup_slice_item_cmd = str(self.copy_command) \
-                                  + ' if=' + self.slice_file_path \
-                                  + ' of=' + self.encryption_environment.copy_slice_item_backup_file \
-                                  + ' bs=' + str(block_size) \
-                                  + ' count=' + str(count)
-            backup_slice_args = shlex.split(backup_slice_item_cmd)
-            backup_process = Popen(backup_slice_args)
-            self.logger.log("backup_slice_item_cmd is:{0}".format(backup_slice_item_cmd))
-
-            """
-            third, copy the data in the middle cache to the target device.
-            """
-            dd_cmd = str(self.copy_command) + ' if=' + self.slice_file_path + ' of=' + to_device + ' bs=' + str(block_size) + ' seek=' + str(seek) + ' count=' + str(count)
-            return_code = self.command_executer.Execute(dd_cmd)
-            if return_code != CommonVariables.process_success:
-                self.logger.log(msg=("{0} is: {1}".format(dd_cmd, return_code)), level = CommonVariables.ErrorLevel)
+        allocation_map_path = self.ongoing_item_config.allocation_map_path
+        if self.current_slice_index == 0 and self.ongoing_item_config.get_last_journal_record() is None:
+            allocation_map = AllocationMap.query(self.logger, self.source_dev_full_path, self.ongoing_item_config.get_file_system())
+            if allocation_map is None:
+                if os.path.exists(allocation_map_path):
+                    os.remove(allocation_map_path)
             else:
-                #the copy done correctly, so clear the backup slice file item.
-                backup_process.kill()
-                if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                    self.logger.log(msg = "clean up the backup file")
-                    os.remove(self.encryption_environment.copy_slice_item_backup_file)
-                if os.path.exists(self.slice_file_path):
-                    self.logger.log(msg = "clean up the slice file")
-                    os.remove(self.slice_file_path)
-            return return_code
+                allocation_map.save(allocation_map_path)
+            return allocation_map
+
+        allocation_map = AllocationMap.load(allocation_map_path)
+        if allocation_map is not None and allocation_map.source_path != self.source_dev_full_path:
+            self.logger.log(msg="the saved allocation map is for {0}, copying every slice".format(allocation_map.source_path),
+                            level=CommonVariables.WarningLevel)
+            return None
+        return allocation_map
+
+    def write_slice_backup(self, data):
+        backup_fd = os.open(self.ongoing_item_config.slice_backup_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            write_at(backup_fd, data, 0)
+            os.fsync(backup_fd)
+        finally:
+            os.close(backup_fd)
+
+    def copy_slice(self, slice_index, destination, offset, data):
+        if self.io_budget is not None:
+            self.io_budget.consume(len(data))
+        self.write_slice_backup(data)
+        self.ongoing_item_config.checkpoint(CommonVariables.OngoingItemJournalBackupRecord, slice_index)
+        destination.write(offset, data)
+        destination.sync()
+        self.finish_slice(slice_index)
+
+    def finish_slice(self, slice_index):
+        self.current_slice_index = slice_index + 1
+        self.ongoing_item_config.current_slice_index = self.current_slice_index
+        self.ongoing_item_config.checkpoint(CommonVariables.OngoingItemJournalDoneRecord, self.current_slice_index)
+        if os.path.exists(self.ongoing_item_config.slice_backup_file_path):
+            os.remove(self.ongoing_item_config.slice_backup_file_path)
+
+    def report_progress(self):
+        if self.progress is not None:
+            self.progress(self.current_slice_index, self.total_slice_size)
+        elif self.status_prefix:
+            msg = self.status_prefix + ': ' \
+                + str(int(self.current_slice_index / (float)(self.total_slice_size) * 100.0)) \
+                + '%'
+
+            self.hutil.do_status_report(operation='DataCopy',
+                                        status=CommonVariables.extension_success_status,
+                                        status_code=str(CommonVariables.success),
+                                        message=msg)
 
-    def prepare_mem_fs(self):
-        self.disk_util.make_sure_path_exists(self.tmpfs_mount_point)
-        commandToExecute = self.patching.mount_path + " -t tmpfs -o size=" + str(self.block_size + 1024) + " tmpfs " + self.tmpfs_mount_point
-        self.logger.log("prepare mem fs script is: {0}".format(commandToExecute))
-        return_code = self.command_executer.Execute(commandToExecute)
-        return return_code
+    def begin_copy(self):
+        """
+        check the device_item size first, cut it
+        """
+        source = None
+        destination = None
+        try:
+            source = self.copy_engine.open_source(self.source_dev_full_path)
+            destination = self.copy_engine.open_destination(self.destination)
+            self.logger.log(msg="copying {0} to {1} from slice {2} of {3}, direct io: {4}".format(self.source_dev_full_path,
+                                                                                                 self.destination,
+                                                                                                 self.current_slice_index,
+                                                                                                 self.total_slice_size,
+                                                                                                 destination.direct_fd is not None))
+            return_code = self.resume_copy(source, destination)
+            if return_code != CommonVariables.process_success:
+                return return_code
 
-    def clear_mem_fs(self):
-        commandToExecute = self.patching.umount_path + " " + self.tmpfs_mount_point
-        return_code = self.command_executer.Execute(commandToExecute)
-        return return_code
+            allocation_map = self.get_allocation_map()
+            slice_indexes = []
+            ranges = []
+            unallocated_slice_count = 0
+            for slice_index in range(self.current_slice_index, self.total_slice_size):
+                offset, length = self.get_slice_range(slice_index)
+                if length == 0:
+                    self.logger.log(msg="the last slice size is zero, so skip the slice index {0}.".format(slice_index))
+                    continue
+                if allocation_map is not None and not allocation_map.is_allocated(offset, length):
+                    unallocated_slice_count += 1
+                    continue
+                slice_indexes.append(slice_index)
+                ranges.append((offset, length))
+            if unallocated_slice_count > 0:
+                self.logger.log(msg="skipping {0} slices with no allocated blocks".format(unallocated_slice_count))
+
+            # the next slice is read while the current one goes to the backup and the destination
+            for position, (offset, length, data) in enumerate(self.copy_engine.read_ranges(source, ranges)):
+                self.copy_slice(slice_indexes[position], destination, offset, data)
+                self.report_progress()
+
+            if self.current_slice_index < self.total_slice_size:
+                self.finish_slice(self.total_slice_size - 1)
+            return CommonVariables.process_success
+        except (IOError, OSError) as e:
+            self.logger.log(msg="copy failed at slice {0}: {1}, stack trace: {2}".format(self.current_slice_index, e, traceback.format_exc()),
+                            level=CommonVariables.ErrorLevel)
+            return CommonVariables.copy_data_error
+        finally:
+            for block_file in [source, destination]:
+                if block_file is not None:
+                    block_file.close()
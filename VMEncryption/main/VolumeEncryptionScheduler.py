@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import traceback
+from Common import CommonVariables
+
+
+def group_into_lanes(items, get_disks):
+    """
+    groups the items into lanes which do not share a physical disk, directly or through a
+    volume spanning several disks. get_disks(item) returns the disk names of an item.
+    the items keep their order inside a lane, lanes are ordered by their first item.
+    """
+    lanes = []
+    for item_index, item in enumerate(items):
+        disks = set(get_disks(item))
+        merged_disks = set(disks)
+        merged_items = [(item_index, item)]
+        remaining_lanes = []
+        for lane_disks, lane_items in lanes:
+            if lane_disks & disks:
+                merged_disks |= lane_disks
+                merged_items.extend(lane_items)
+            else:
+                remaining_lanes.append((lane_disks, lane_items))
+        merged_items.sort(key=lambda indexed_item: indexed_item[0])
+        remaining_lanes.append((merged_disks, merged_items))
+        lanes = remaining_lanes
+
+    lanes.sort(key=lambda lane: lane[1][0][0])
+    return [[item for item_index, item in lane_items] for lane_disks, lane_items in lanes]
+
+
+class EncryptionProgress(object):
+    """
+    one status message for all the volumes copied at the same time.
+    report(message) is only called when the message changes, and never from two threads at once.
+    """
+    def __init__(self, report, volume_count):
+        self.report = report
+        self.volume_count = volume_count
+        self.fractions = {}
+        self.finished_count = 0
+        self.last_message = None
+        self.lock = threading.Lock()
+
+    def update(self, volume_key, done, total):
+        with self.lock:
+            self.fractions[volume_key] = float(done) / total if total else 1.0
+            self.report_if_changed()
+
+    def finish(self, volume_key):
+        with self.lock:
+            self.fractions[volume_key] = 1.0
+            self.finished_count += 1
+            self.report_if_changed()
+
+    def get_message(self):
+        percent = int(sum(self.fractions.values()) / self.volume_count * 100.0) if self.volume_count else 100
+        return "Encrypting data volumes, {0}/{1} done: {2}%".format(self.finished_count, self.volume_count, percent)
+
+    def report_if_changed(self):
+        message = self.get_message()
+        if message != self.last_message:
+            self.last_message = message
+            self.report(message)
+
+
+class VolumeEncryptionScheduler(object):
+    """
+    runs the lanes on up to max_parallel_volumes threads, the items of one lane one after another,
+    so that no two volumes of the same disk are copied at the same time.
+    """
+    def __init__(self, logger, max_parallel_volumes):
+        self.logger = logger
+        self.max_parallel_volumes = max(1, max_parallel_volumes)
+
+    def run(self, lanes, encrypt):
+        """
+        encrypt(item) returns True when the item is done, a lane stops at its first failed item.
+        returns the failed items.
+        """
+        pending_lanes = list(lanes)
+        failed_items = []
+        lock = threading.Lock()
+
+        def run_lanes():
+            while True:
+                with lock:
+                    if not pending_lanes:
+                        return
+                    lane = pending_lanes.pop(0)
+                for item in lane:
+                    try:
+                        succeeded = encrypt(item)
+                    except Exception as e:
+                        self.logger.log(msg="encrypting {0} failed with error: {1}, stack trace: {2}".format(item, e, traceback.format_exc()),
+                                        level=CommonVariables.ErrorLevel)
+                        succeeded = False
+                    if not succeeded:
+                        with lock:
+                            failed_items.append(item)
+                        break
+
+        worker_count = min(self.max_parallel_volumes, len(pending_lanes))
+        self.logger.log(msg="encrypting {0} lanes on {1} threads".format(len(pending_lanes), worker_count))
+        if worker_count <= 1:
+            run_lanes()
+            return failed_items
+
+        workers = []
+        for i in range(worker_count):
+            worker = threading.Thread(target=run_lanes)
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        return failed_items
@@ -25,6 +25,7 @@ import subprocess
 import sys
 import time
 import tempfile
+import threading
 import traceback
 import uuid
 import shutil
@@ -45,6 +46,8 @@ from EncryptionMarkConfig import EncryptionMarkConfig
 from EncryptionEnvironment import EncryptionEnvironment
 from OnGoingItemConfig import OnGoingItemConfig
 from ProcessLock import ProcessLock
+from BlockCopyEngine import IOBudget
+from VolumeEncryptionScheduler import VolumeEncryptionScheduler, EncryptionProgress, group_into_lanes
 from CommandExecutor import CommandExecutor, ProcessCommunicator
 from __builtin__ import int
 
@@ -397,15 +400,27 @@ def none_or_empty(obj):
         return False
 
 
+se_linux_lock = threading.Lock()
+se_linux_disable_count = 0
+
 def toggle_se_linux_for_centos7(disable):
+    """
+    volumes encrypted in parallel share the selinux mode, it is enabled again when the last of them is done.
+    """
+    global se_linux_disable_count
     if DistroPatcher.distro_info[0].lower() == 'centos' and DistroPatcher.distro_info[1].startswith('7.0'):
-        if disable:
-            se_linux_status = encryption_environment.get_se_linux()
-            if se_linux_status.lower() == 'enforcing':
-                encryption_environment.disable_se_linux()
-                return True
-        else:
-            encryption_environment.enable_se_linux()
+        with se_linux_lock:
+            if disable:
+                se_linux_disable_count += 1
+                if se_linux_disable_count == 1:
+                    se_linux_status = encryption_environment.get_se_linux()
+                    if se_linux_status.lower() == 'enforcing':
+                        encryption_environment.disable_se_linux()
+                        return True
+            else:
+                se_linux_disable_count = max(0, se_linux_disable_count - 1)
+                if se_linux_disable_count == 0:
+                    encryption_environment.enable_se_linux()
     return False
 
 
@@ -1086,21 +1101,28 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file,
                 return current_phase
 
 
+encryption_config_lock = threading.Lock()
+
 def encrypt_inplace_with_seperate_header_file(passphrase_file,
                                               device_item,
                                               disk_util,
                                               bek_util,
                                               status_prefix='',
-                                              ongoing_item_config=None):
+                                              ongoing_item_config=None,
+                                              per_item_config=False,
+                                              io_budget=None,
+                                              progress=None):
     """
     if ongoing_item_config is not None, then this is a resume case.
+    per_item_config keeps the progress in a config of its own, for volumes encrypted in parallel.
     """
     logger.log("encrypt_inplace_with_seperate_header_file")
     current_phase = CommonVariables.EncryptionPhaseEncryptDevice
     if ongoing_item_config is None:
-        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment,
-                                                logger=logger)
         mapper_name = str(uuid.uuid4())
+        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment,
+                                                logger=logger,
+                                                item_name=mapper_name if per_item_config else None)
         ongoing_item_config.current_block_size = CommonVariables.default_block_size
         ongoing_item_config.current_slice_index = 0
         ongoing_item_config.device_size = device_item.size
@@ -1183,44 +1205,49 @@ def encrypt_inplace_with_seperate_header_file(passphrase_file,
                 ongoing_item_config.from_end = True
                 ongoing_item_config.commit()
 
-                copy_result = disk_util.copy(ongoing_item_config=ongoing_item_config, status_prefix=status_prefix)
+                copy_result = disk_util.copy(ongoing_item_config=ongoing_item_config,
+                                             status_prefix=status_prefix,
+                                             io_budget=io_budget,
+                                             progress=progress)
 
                 if copy_result != CommonVariables.success:
                     error_message = "the copying result is {0} so skip the mounting".format(copy_result)
                     logger.log(msg=(error_message), level=CommonVariables.ErrorLevel)
                     return current_phase
                 else:
-                    crypt_item_to_update = CryptItem()
-                    crypt_item_to_update.mapper_name = mapper_name
-                    original_dev_name_path = ongoing_item_config.get_original_dev_name_path()
-                    crypt_item_to_update.dev_path = disk_util.get_persistent_path_by_sdx_path(original_dev_name_path)
-                    crypt_item_to_update.luks_header_path = luks_header_file_path
-                    crypt_item_to_update.file_system = ongoing_item_config.get_file_system()
-                    crypt_item_to_update.uses_cleartext_key = False
-                    crypt_item_to_update.current_luks_slot = 0
-
-                    # if the original mountpoint is empty, then leave
-                    # it as None
-                    mount_point = ongoing_item_config.get_mount_point()
-                    if mount_point is None or mount_point == "":
-                        crypt_item_to_update.mount_point = "None"
-                    else:
-                        crypt_item_to_update.mount_point = mount_point
-                    update_crypt_item_result = disk_util.add_crypt_item(crypt_item_to_update, passphrase_file)
-                    if not update_crypt_item_result:
-                        logger.log(msg="update crypt item failed", level=CommonVariables.ErrorLevel)
-                    if crypt_item_to_update.mount_point != "None":
-                        disk_util.mount_filesystem(device_mapper_path, mount_point)
-                    else:
-                        logger.log("the crypt_item_to_update.mount_point is None, so we do not mount it.")
-
-                    if mount_point:
-                        logger.log(msg="removing entry for unencrypted drive from fstab",
-                                   level=CommonVariables.InfoLevel)
-                        disk_util.modify_fstab_entry_encrypt(mount_point, os.path.join(CommonVariables.dev_mapper_root, mapper_name))
-                    else:
-                        logger.log(msg=original_dev_name_path + " is not defined in fstab, no need to update",
-                                   level=CommonVariables.InfoLevel)
+                    # the crypttab, the mount config and fstab are shared by the volumes encrypted in parallel
+                    with encryption_config_lock:
+                        crypt_item_to_update = CryptItem()
+                        crypt_item_to_update.mapper_name = mapper_name
+                        original_dev_name_path = ongoing_item_config.get_original_dev_name_path()
+                        crypt_item_to_update.dev_path = disk_util.get_persistent_path_by_sdx_path(original_dev_name_path)
+                        crypt_item_to_update.luks_header_path = luks_header_file_path
+                        crypt_item_to_update.file_system = ongoing_item_config.get_file_system()
+                        crypt_item_to_update.uses_cleartext_key = False
+                        crypt_item_to_update.current_luks_slot = 0
+
+                        # if the original mountpoint is empty, then leave
+                        # it as None
+                        mount_point = ongoing_item_config.get_mount_point()
+                        if mount_point is None or mount_point == "":
+                            crypt_item_to_update.mount_point = "None"
+                        else:
+                            crypt_item_to_update.mount_point = mount_point
+                        update_crypt_item_result = disk_util.add_crypt_item(crypt_item_to_update, passphrase_file)
+                        if not update_crypt_item_result:
+                            logger.log(msg="update crypt item failed", level=CommonVariables.ErrorLevel)
+                        if crypt_item_to_update.mount_point != "None":
+                            disk_util.mount_filesystem(device_mapper_path, mount_point)
+                        else:
+                            logger.log("the crypt_item_to_update.mount_point is None, so we do not mount it.")
+
+                        if mount_point:
+                            logger.log(msg="removing entry for unencrypted drive from fstab",
+                                       level=CommonVariables.InfoLevel)
+                            disk_util.modify_fstab_entry_encrypt(mount_point, os.path.join(CommonVariables.dev_mapper_root, mapper_name))
+                        else:
+                            logger.log(msg=original_dev_name_path + " is not defined in fstab, no need to update",
+                                       level=CommonVariables.InfoLevel)
 
                     current_phase = CommonVariables.EncryptionPhaseDone
                     ongoing_item_config.phase = current_phase
@@ -1424,9 +1451,29 @@ def find_all_devices_to_encrypt(encryption_marker, disk_util, bek_util):
     return device_items_to_encrypt
 
 
+def get_parallel_encryption_settings():
+    """
+    returns (max_parallel_volumes, max_copy_throughput in bytes per second) from the public settings.
+    """
+    public_settings = get_public_settings() or {}
+    try:
+        max_parallel_volumes = int(public_settings.get(CommonVariables.MaxParallelVolumesKey,
+                                                       CommonVariables.default_max_parallel_volumes))
+        max_copy_throughput = int(public_settings.get(CommonVariables.MaxCopyThroughputKey,
+                                                      CommonVariables.default_max_copy_throughput))
+    except (TypeError, ValueError) as e:
+        logger.log(msg="invalid parallel encryption settings: {0}, using the defaults".format(e),
+                   level=CommonVariables.WarningLevel)
+        max_parallel_volumes = CommonVariables.default_max_parallel_volumes
+        max_copy_throughput = CommonVariables.default_max_copy_throughput
+    return max(1, max_parallel_volumes), max(0, max_copy_throughput) * 1024 * 1024
+
+
 def enable_encryption_all_in_place(passphrase_file, encryption_marker, disk_util, bek_util):
     """
     if return None for the success case, or return the device item which failed.
+    volumes on different physical disks are encrypted in parallel when the distro supports
+    separate header files, each with its own ongoing item config.
     """
     logger.log(msg="executing the enable_encryption_all_in_place command.")
 
@@ -1439,43 +1486,102 @@ def enable_encryption_all_in_place(passphrase_file, encryption_marker, disk_util
                            status_code=str(CommonVariables.success),
                            message=msg)
 
-    for device_num, device_item in enumerate(device_items_to_encrypt):
-        umount_status_code = CommonVariables.success
-        if device_item.mount_point is not None and device_item.mount_point != "":
-            umount_status_code = disk_util.umount(device_item.mount_point)
-        if umount_status_code != CommonVariables.success:
-            logger.log("error occured when do the umount for: {0} with code: {1}".format(device_item.mount_point, umount_status_code))
-        else:
-            logger.log(msg=("encrypting: {0}".format(device_item)))
-            no_header_file_support = not_support_header_option_distro(DistroPatcher)
+    no_header_file_support = not_support_header_option_distro(DistroPatcher)
+    if no_header_file_support:
+        # resizing the file system in place goes through the single ongoing item config
+        max_parallel_volumes, max_copy_throughput = 1, 0
+    else:
+        max_parallel_volumes, max_copy_throughput = get_parallel_encryption_settings()
+    io_budget = IOBudget(max_copy_throughput) if max_copy_throughput > 0 else None
+
+    if max_parallel_volumes <= 1 or len(device_items_to_encrypt) <= 1:
+        for device_num, device_item in enumerate(device_items_to_encrypt):
             status_prefix = "Encrypting data volume {0}/{1}".format(device_num + 1,
                                                                     len(device_items_to_encrypt))
-
-            # TODO check the file system before encrypting it.
-            if no_header_file_support:
-                logger.log(msg="this is the centos 6 or redhat 6 or sles 11 series, need to resize data drive",
-                           level=CommonVariables.WarningLevel)
-
-                encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file=passphrase_file,
-                                                                                       device_item=device_item,
-                                                                                       disk_util=disk_util,
-                                                                                       bek_util=bek_util,
-                                                                                       status_prefix=status_prefix)
-            else:
-                encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file=passphrase_file,
-                                                                                    device_item=device_item,
-                                                                                    disk_util=disk_util,
-                                                                                    bek_util=bek_util,
-                                                                                    status_prefix=status_prefix)
-
-            if encryption_result_phase == CommonVariables.EncryptionPhaseDone:
-                continue
-            else:
+            if not encrypt_data_volume_in_place(passphrase_file=passphrase_file,
+                                                device_item=device_item,
+                                                disk_util=disk_util,
+                                                bek_util=bek_util,
+                                                no_header_file_support=no_header_file_support,
+                                                status_prefix=status_prefix,
+                                                io_budget=io_budget):
                 # do exit to exit from this round
                 return device_item
+        return None
+
+    def report_progress(message):
+        hutil.do_status_report(operation='EnableEncryption',
+                               status=CommonVariables.extension_success_status,
+                               status_code=str(CommonVariables.success),
+                               message=message)
+
+    progress = EncryptionProgress(report_progress, len(device_items_to_encrypt))
+
+    def encrypt(device_item):
+        succeeded = encrypt_data_volume_in_place(passphrase_file=passphrase_file,
+                                                 device_item=device_item,
+                                                 disk_util=disk_util,
+                                                 bek_util=bek_util,
+                                                 no_header_file_support=False,
+                                                 per_item_config=True,
+                                                 io_budget=io_budget,
+                                                 progress=lambda done, total: progress.update(device_item.name, done, total))
+        if succeeded:
+            progress.finish(device_item.name)
+        return succeeded
+
+    lanes = group_into_lanes(device_items_to_encrypt, lambda device_item: disk_util.get_physical_disks(device_item.name))
+    scheduler = VolumeEncryptionScheduler(logger, max_parallel_volumes)
+    failed_items = scheduler.run(lanes, encrypt)
+    if failed_items:
+        return failed_items[0]
     return None
 
 
+def encrypt_data_volume_in_place(passphrase_file,
+                                 device_item,
+                                 disk_util,
+                                 bek_util,
+                                 no_header_file_support,
+                                 status_prefix='',
+                                 per_item_config=False,
+                                 io_budget=None,
+                                 progress=None):
+    """
+    unmounts and encrypts one data volume, returns True when it is done.
+    """
+    umount_status_code = CommonVariables.success
+    if device_item.mount_point is not None and device_item.mount_point != "":
+        umount_status_code = disk_util.umount(device_item.mount_point)
+    if umount_status_code != CommonVariables.success:
+        logger.log("error occured when do the umount for: {0} with code: {1}".format(device_item.mount_point, umount_status_code))
+        return False
+
+    logger.log(msg=("encrypting: {0}".format(device_item)))
+
+    # TODO check the file system before encrypting it.
+    if no_header_file_support:
+        logger.log(msg="this is the centos 6 or redhat 6 or sles 11 series, need to resize data drive",
+                   level=CommonVariables.WarningLevel)
+
+        encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file=passphrase_file,
+                                                                               device_item=device_item,
+                                                                               disk_util=disk_util,
+                                                                               bek_util=bek_util,
+                                                                               status_prefix=status_prefix)
+    else:
+        encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file=passphrase_file,
+                                                                            device_item=device_item,
+                                                                            disk_util=disk_util,
+                                                                            bek_util=bek_util,
+                                                                            status_prefix=status_prefix,
+                                                                            per_item_config=per_item_config,
+                                                                            io_budget=io_budget,
+                                                                            progress=progress)
+
+    return encryption_result_phase == CommonVariables.EncryptionPhaseDone
+
+
 def disable_encryption_all_in_place(passphrase_file, decryption_marker, disk_util):
     """
     On success, returns None. Otherwise returns the crypt item for which decryption failed.
@@ -1737,6 +1843,10 @@ def daemon_encrypt_data_volumes(encryption_marker, encryption_config, disk_util,
         """
         check whether there's a scheduled encryption task
         """
+        # device properties are gathered once per cycle, the previous cycle may have changed them
+        DiskUtil.reset_device_caches()
+        disk_util.command_executor.log_counters()
+
         mount_all_result = disk_util.mount_all()
 
         if mount_all_result != CommonVariables.process_success:
@@ -1783,6 +1893,10 @@ def daemon_encrypt_data_volumes(encryption_marker, encryption_config, disk_util,
                 raise Exception(message)
             else:
                 ongoing_item_config.clear_config()
+        elif OnGoingItemConfig.get_item_names(encryption_environment):
+            resume_encryption_items_in_place(passphrase_file=bek_passphrase_file,
+                                             disk_util=disk_util,
+                                             bek_util=bek_util)
         else:
             logger.log("OngoingItemConfig does not exist")
             failed_item = None
@@ -1820,6 +1934,58 @@ def daemon_encrypt_data_volumes(encryption_marker, encryption_config, disk_util,
         raise
 
 
+def resume_encryption_items_in_place(passphrase_file, disk_util, bek_util):
+    """
+    resumes the volumes that were encrypted in parallel, each from its own ongoing item config.
+    """
+    ongoing_item_configs = []
+    for item_name in OnGoingItemConfig.get_item_names(encryption_environment):
+        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment,
+                                                logger=logger,
+                                                item_name=item_name)
+        ongoing_item_config.load_value_from_file()
+        ongoing_item_configs.append(ongoing_item_config)
+    logger.log("resuming encryption of {0} data volumes".format(len(ongoing_item_configs)))
+
+    def report_progress(message):
+        hutil.do_status_report(operation='EnableEncryption',
+                               status=CommonVariables.extension_success_status,
+                               status_code=str(CommonVariables.success),
+                               message="Resuming encryption after reboot: " + message)
+
+    progress = EncryptionProgress(report_progress, len(ongoing_item_configs))
+    max_parallel_volumes, max_copy_throughput = get_parallel_encryption_settings()
+    io_budget = IOBudget(max_copy_throughput) if max_copy_throughput > 0 else None
+
+    def resume(ongoing_item_config):
+        mount_point = ongoing_item_config.get_mount_point()
+        if not none_or_empty(mount_point):
+            logger.log("mount point is not empty {0}, trying to unmount it first.".format(mount_point))
+            umount_status_code = disk_util.umount(mount_point)
+            logger.log("unmount return code is {0}".format(umount_status_code))
+        encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file=passphrase_file,
+                                                                            device_item=None,
+                                                                            disk_util=disk_util,
+                                                                            bek_util=bek_util,
+                                                                            ongoing_item_config=ongoing_item_config,
+                                                                            io_budget=io_budget,
+                                                                            progress=lambda done, total: progress.update(ongoing_item_config.item_name, done, total))
+        if encryption_result_phase != CommonVariables.EncryptionPhaseDone:
+            return False
+        progress.finish(ongoing_item_config.item_name)
+        return True
+
+    def get_disks(ongoing_item_config):
+        return disk_util.get_physical_disks(os.path.basename(ongoing_item_config.get_original_dev_name_path()))
+
+    lanes = group_into_lanes(ongoing_item_configs, get_disks)
+    scheduler = VolumeEncryptionScheduler(logger, max_parallel_volumes)
+    failed_items = scheduler.run(lanes, resume)
+    if failed_items:
+        message = 'EnableEncryption: resuming encryption for {0} failed'.format(failed_items[0].get_original_dev_path())
+        raise Exception(message)
+
+
 def daemon_decrypt():
     decryption_marker = DecryptionMarkConfig(logger, encryption_environment)
 
@@ -1938,6 +2104,7 @@ def daemon():
         hutil.redo_current_status()
     finally:
         lock.release_lock()
+        CommandExecutor(logger).log_counters()
         logger.log("exiting daemon")
 
 
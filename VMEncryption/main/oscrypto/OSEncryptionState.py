@@ -25,6 +25,8 @@ import re
 from collections import namedtuple
 from uuid import UUID
 
+from AllocationMap import AllocationMap
+from BlockCopyEngine import BlockCopyEngine
 from Common import *
 from CommandExecutor import *
 from BekUtil import *
@@ -171,6 +173,29 @@ class OSEncryptionState(object):
                                       communicator=proc_comm)
         return int(proc_comm.stdout.strip())
 
+    def _copy_allocated_blocks(self, source, destination, fallback_command):
+        """
+        copies only the blocks the file system on source has allocated, to the same offsets of
+        destination. runs fallback_command when the free space map can not be read.
+        """
+        allocation_map = AllocationMap.query(self.context.logger, source)
+        if allocation_map is None:
+            self.command_executor.Execute(fallback_command, True)
+            return
+
+        ranges = allocation_map.get_allocated_ranges(0, self._get_block_device_size(source))
+        self.context.logger.log("copying {0} allocated ranges from {1} to {2}".format(len(ranges), source, destination))
+        copy_engine = BlockCopyEngine(logger=self.context.logger, buffer_size=CommonVariables.default_block_size)
+        source_file = copy_engine.open_source(source)
+        try:
+            destination_file = copy_engine.open_destination(destination)
+            try:
+                copy_engine.copy_ranges(source_file, destination_file, ranges)
+            finally:
+                destination_file.close()
+        finally:
+            source_file.close()
+
     def _is_uuid(self, s):
         try:
             UUID(s)
@@ -60,7 +60,9 @@ class EncryptBlockDeviceState(OSEncryptionState):
         # Enable used space encryption on RHEL 7.3 and above
         distro_info = self.context.distro_patcher.distro_info
         if LooseVersion(distro_info[1]) >= LooseVersion('7.3'):
-            self.command_executor.Execute('dd if={0} of=/dev/mapper/osencrypt conv=sparse bs=64K'.format(self.rootfs_block_device), True)
+            self._copy_allocated_blocks(self.rootfs_block_device,
+                                        '/dev/mapper/osencrypt',
+                                        'dd if={0} of=/dev/mapper/osencrypt conv=sparse bs=64K'.format(self.rootfs_block_device))
         else:
             self.command_executor.Execute('dd if={0} of=/dev/mapper/osencrypt bs=52428800'.format(self.rootfs_block_device), True)
 
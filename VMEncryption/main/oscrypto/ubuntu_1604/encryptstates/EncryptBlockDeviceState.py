@@ -59,7 +59,9 @@ class EncryptBlockDeviceState(OSEncryptionState):
                                             status_code=str(CommonVariables.success),
                                             message='OS disk encryption started')
 
-        self.command_executor.Execute('dd if={0} of=/dev/mapper/osencrypt conv=sparse bs=64K'.format(self.rootfs_block_device), True)
+        self._copy_allocated_blocks(self.rootfs_block_device,
+                                    '/dev/mapper/osencrypt',
+                                    'dd if={0} of=/dev/mapper/osencrypt conv=sparse bs=64K'.format(self.rootfs_block_device))
 
     def should_exit(self):
         self.context.logger.log("Verifying if machine should exit encrypt_block_device state")
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+#
+# compares the cost of recording the progress of one copied slice by rewriting the
+# ongoing item config with the cost of appending the two journal records of a slice.
+#
+#     python benchmark_ongoing_item_config.py [slice_count]
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+extension_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(extension_path)
+sys.path.append(os.path.join(extension_path, 'main'))
+
+from Common import CommonVariables
+from console_logger import ConsoleLogger
+from test_ongoing_item_config import MockEncryptionEnvironment, new_ongoing_item_config
+
+class QuietLogger(ConsoleLogger):
+    def log(self, msg, level='Info'):
+        pass
+
+def time_per_slice(slice_count, record_slice):
+    work_dir = tempfile.mkdtemp()
+    try:
+        ongoing_item_config = new_ongoing_item_config(MockEncryptionEnvironment(work_dir), QuietLogger())
+        ongoing_item_config.commit()
+        start_time = time.time()
+        for slice_index in range(slice_count):
+            record_slice(ongoing_item_config, slice_index)
+        elapsed_time = time.time() - start_time
+        ongoing_item_config.close_journal()
+        return elapsed_time / slice_count
+    finally:
+        shutil.rmtree(work_dir)
+
+def commit_slice(ongoing_item_config, slice_index):
+    ongoing_item_config.current_slice_index = slice_index + 1
+    ongoing_item_config.commit()
+
+def checkpoint_slice(ongoing_item_config, slice_index):
+    ongoing_item_config.checkpoint(CommonVariables.OngoingItemJournalBackupRecord, slice_index)
+    ongoing_item_config.current_slice_index = slice_index + 1
+    ongoing_item_config.checkpoint(CommonVariables.OngoingItemJournalDoneRecord, slice_index + 1)
+
+if __name__ == '__main__':
+    slice_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    commit_time = time_per_slice(slice_count, commit_slice)
+    checkpoint_time = time_per_slice(slice_count, checkpoint_slice)
+    print("config rewrite per slice:    {0:.3f} ms".format(commit_time * 1000))
+    print("journal records per slice:   {0:.3f} ms".format(checkpoint_time * 1000))
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from main.AllocationMap import AllocationMap, parse_dumpe2fs, parse_xfs_db_freesp
+
+DUMPE2FS_OUTPUT = """Filesystem volume name:   <none>
+Block count:              64
+Free blocks:              40
+Block size:               1024
+
+Group 0: (Blocks 0-31)
+  Primary superblock at 0, Group descriptors at 1-1
+  Free blocks: 10-19, 25
+  Free inodes: 12-16
+Group 1: (Blocks 32-63)
+  Free blocks: 
+  Free inodes: 17-32
+"""
+
+XFS_DB_OUTPUT = """blocksize = 4096
+agblocks = 100
+dblocks = 200
+    agno    agbno      len
+       0       50       50
+       1       10       20
+   from      to extents  blocks    pct
+     16      31       1      20  28.57
+     32      63       1      50  71.43
+"""
+
+class TestAllocationMap(unittest.TestCase):
+    """ unit tests for functions in the AllocationMap module """
+    def test_parse_dumpe2fs(self):
+        block_size, block_count, free_ranges = parse_dumpe2fs(DUMPE2FS_OUTPUT)
+        self.assertEqual((block_size, block_count), (1024, 64))
+        self.assertEqual(free_ranges, [(10, 19), (25, 25)])
+
+    def test_parse_xfs_db_freesp(self):
+        block_size, block_count, free_ranges = parse_xfs_db_freesp(XFS_DB_OUTPUT)
+        self.assertEqual((block_size, block_count), (4096, 200))
+        self.assertEqual(free_ranges, [(50, 99), (110, 129)])
+
+    def test_allocated_ranges_from_free_blocks(self):
+        allocation_map = AllocationMap.from_free_blocks('/dev/sdc1', 1024, 64, [(25, 25), (10, 19)])
+        self.assertEqual(allocation_map.allocated_ranges, [(0, 10 * 1024), (20 * 1024, 5 * 1024), (26 * 1024, 38 * 1024)])
+        self.assertEqual(allocation_map.get_allocated_size(), 53 * 1024)
+
+        self.assertTrue(allocation_map.is_allocated(9 * 1024, 1024))
+        self.assertFalse(allocation_map.is_allocated(10 * 1024, 10 * 1024))
+        self.assertTrue(allocation_map.is_allocated(10 * 1024, 10 * 1024 + 1))
+        self.assertFalse(allocation_map.is_allocated(25 * 1024, 1024))
+        # past the end of the file system
+        self.assertTrue(allocation_map.is_allocated(64 * 1024, 1024))
+
+    def test_get_allocated_ranges_includes_tail(self):
+        allocation_map = AllocationMap.from_free_blocks('/dev/sdc1', 1024, 64, [(10, 19), (60, 63)])
+        self.assertEqual(allocation_map.get_allocated_ranges(5 * 1024, 80 * 1024),
+                         [(5 * 1024, 5 * 1024), (20 * 1024, 40 * 1024), (64 * 1024, 21 * 1024)])
+
+    def test_save_and_load(self):
+        work_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(work_dir, 'copy_allocation_map')
+            self.assertIsNone(AllocationMap.load(path))
+            AllocationMap.from_free_blocks('/dev/sdc1', 1024, 64, [(10, 19)]).save(path)
+            allocation_map = AllocationMap.load(path)
+            self.assertEqual(allocation_map.source_path, '/dev/sdc1')
+            self.assertEqual(allocation_map.total_size, 64 * 1024)
+            self.assertEqual(allocation_map.allocated_ranges, [(0, 10 * 1024), (20 * 1024, 44 * 1024)])
+        finally:
+            shutil.rmtree(work_dir)
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from main.BlockCopyEngine import BlockCopyEngine
+from console_logger import ConsoleLogger
+
+class TestBlockCopyEngine(unittest.TestCase):
+    """ unit tests for functions in the BlockCopyEngine module """
+    def setUp(self):
+        self.logger = ConsoleLogger()
+        self.engine = BlockCopyEngine(self.logger, buffer_size=64 * 1024)
+        self.work_dir = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.work_dir, 'source')
+        self.destination_path = os.path.join(self.work_dir, 'destination')
+        self.data = os.urandom(256 * 1024)
+        with open(self.source_path, 'wb') as source_file:
+            source_file.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_read_ranges_copies_in_given_order(self):
+        source = self.engine.open_source(self.source_path)
+        destination = self.engine.open_destination(self.destination_path)
+        ranges = [(offset, 64 * 1024) for offset in range(192 * 1024, -1, -64 * 1024)]
+        offsets = []
+        for offset, length, data in self.engine.read_ranges(source, ranges):
+            offsets.append(offset)
+            destination.write(offset, data)
+        destination.sync()
+        source.close()
+        destination.close()
+
+        self.assertEqual(offsets, [offset for offset, length in ranges])
+        with open(self.destination_path, 'rb') as destination_file:
+            self.assertEqual(destination_file.read(), self.data)
+
+    def test_read_ranges_fails_on_short_read(self):
+        source = self.engine.open_source(self.source_path)
+        with self.assertRaises(IOError):
+            for offset, length, data in self.engine.read_ranges(source, [(192 * 1024, 128 * 1024)]):
+                pass
+        source.close()
+
+    def test_copy_range_unaligned(self):
+        source = self.engine.open_source(self.source_path)
+        destination = self.engine.open_destination(self.destination_path)
+        self.engine.copy_range(source, destination, 513, 7, 100000)
+        destination.sync()
+        source.close()
+        destination.close()
+
+        with open(self.destination_path, 'rb') as destination_file:
+            self.assertEqual(destination_file.read()[7:], self.data[513:513 + 100000])
+
+    def test_copy_ranges_only_touches_given_ranges(self):
+        with open(self.destination_path, 'wb') as destination_file:
+            destination_file.write(b'\0' * len(self.data))
+        source = self.engine.open_source(self.source_path)
+        destination = self.engine.open_destination(self.destination_path)
+        self.engine.copy_ranges(source, destination, [(4096, 150000), (200 * 1024, 8192)])
+        source.close()
+        destination.close()
+
+        with open(self.destination_path, 'rb') as destination_file:
+            copied = destination_file.read()
+        self.assertEqual(copied[4096:4096 + 150000], self.data[4096:4096 + 150000])
+        self.assertEqual(copied[200 * 1024:200 * 1024 + 8192], self.data[200 * 1024:200 * 1024 + 8192])
+        self.assertEqual(copied[:4096], b'\0' * 4096)
+        self.assertEqual(copied[4096 + 150000:200 * 1024], b'\0' * (200 * 1024 - 4096 - 150000))
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from main.BlockDeviceInventory import BlockDeviceInventory, lvm_name_from_dm_name
+from console_logger import ConsoleLogger
+
+class TestBlockDeviceInventory(unittest.TestCase):
+    """ unit tests for functions in the BlockDeviceInventory module """
+    def setUp(self):
+        self.logger = ConsoleLogger()
+        self.root = tempfile.mkdtemp()
+        self.sys_class_block = os.path.join(self.root, 'sys', 'class', 'block')
+        self.udev_data = os.path.join(self.root, 'run', 'udev', 'data')
+        self.mountinfo = os.path.join(self.root, 'mountinfo')
+        self.swaps = os.path.join(self.root, 'swaps')
+        os.makedirs(self.sys_class_block)
+        os.makedirs(self.udev_data)
+
+        vmbus_device = os.path.join(self.root, 'sys', 'devices', 'vmbus', 'disk1')
+        scsi_device = os.path.join(vmbus_device, 'host0', 'target0', '0:0:0:0')
+        self._write(os.path.join(vmbus_device, 'device_id'), '{f8b3781b-1e82-4818-a1c3-63d806ec15bb}')
+        self._write(os.path.join(scsi_device, 'model'), 'Virtual Disk    ')
+        sda = os.path.join(scsi_device, 'block', 'sda')
+        self._write(os.path.join(sda, 'dev'), '8:0')
+        self._write(os.path.join(sda, 'size'), '4096')
+        os.symlink(scsi_device, os.path.join(sda, 'device'))
+        self._write(os.path.join(sda, 'sda1', 'dev'), '8:1')
+        self._write(os.path.join(sda, 'sda1', 'size'), '2048')
+        self._write(os.path.join(sda, 'sda1', 'partition'), '1')
+        dm = os.path.join(self.root, 'sys', 'devices', 'virtual', 'block', 'dm-0')
+        self._write(os.path.join(dm, 'dev'), '253:0')
+        self._write(os.path.join(dm, 'size'), '1024')
+        self._write(os.path.join(dm, 'dm', 'name'), 'data--vg-data--lv')
+        self._write(os.path.join(dm, 'dm', 'uuid'), 'LVM-abc')
+        os.makedirs(os.path.join(dm, 'slaves'))
+        os.symlink(os.path.join(sda, 'sda1'), os.path.join(dm, 'slaves', 'sda1'))
+        for name, path in [('sda', sda), ('sda1', os.path.join(sda, 'sda1')), ('dm-0', dm)]:
+            os.symlink(path, os.path.join(self.sys_class_block, name))
+
+        self._write(os.path.join(self.udev_data, 'b8:1'), 'E:ID_FS_TYPE=LVM2_member\n')
+        self._write(os.path.join(self.udev_data, 'b253:0'), 'E:ID_FS_TYPE=ext4\nE:ID_FS_UUID=0b9f\nE:ID_FS_LABEL_ENC=my\\x20data\n')
+        self._write(self.mountinfo, '30 1 253:0 / /data\\040disk rw,relatime shared:1 - ext4 /dev/mapper/none rw\n')
+        self._write(self.swaps, 'Filename Type Size Used Priority\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, content):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def _build(self):
+        inventory = BlockDeviceInventory(self.logger,
+                                         sys_class_block_path=self.sys_class_block,
+                                         udev_data_path=self.udev_data,
+                                         mountinfo_path=self.mountinfo,
+                                         swaps_path=self.swaps,
+                                         azure_symlinks_dir=os.path.join(self.root, 'azure'))
+        inventory.build()
+        return inventory
+
+    def test_lvm_name_from_dm_name(self):
+        self.assertEqual(lvm_name_from_dm_name('rootvg-rootlv'), 'rootvg/rootlv')
+        self.assertEqual(lvm_name_from_dm_name('data--vg-data--lv'), 'data-vg/data-lv')
+        self.assertEqual(lvm_name_from_dm_name('vg-pool-tpool'), None)
+        self.assertEqual(lvm_name_from_dm_name('0b9f0e2c'), None)
+
+    def test_get_device_items(self):
+        device_items = self._build().get_device_items(None)
+        self.assertEqual([device_item.name for device_item in device_items], ['sda', 'sda1', 'data-vg/data-lv'])
+
+        sda, sda1, lv = device_items
+        self.assertEqual(sda.type, 'disk')
+        self.assertEqual(sda.model, 'Virtual Disk')
+        self.assertEqual(sda.size, 4096 * 512)
+        self.assertEqual(sda.device_id, 'f8b3781b-1e82-4818-a1c3-63d806ec15bb')
+        self.assertEqual(sda1.type, 'part')
+        self.assertEqual(sda1.file_system, 'LVM2_member')
+        self.assertEqual(sda1.device_id, 'f8b3781b-1e82-4818-a1c3-63d806ec15bb')
+        self.assertEqual(lv.type, 'lvm')
+        self.assertEqual(lv.majmin, '253:0')
+        self.assertEqual(lv.file_system, 'ext4')
+        self.assertEqual(lv.uuid, '0b9f')
+        self.assertEqual(lv.label, 'my data')
+        self.assertEqual(lv.mount_point, '/data disk')
+        self.assertEqual(lv.device_id, '')
+
+    def test_returned_items_are_copies(self):
+        inventory = self._build()
+        inventory.get_device_items(None)[0].name = 'changed'
+        self.assertEqual(inventory.get_device_items(None)[0].name, 'sda')
+
+    def test_is_stale(self):
+        inventory = self._build()
+        self.assertFalse(inventory.is_stale())
+        self._write(self.mountinfo, '')
+        self.assertTrue(inventory.is_stale())
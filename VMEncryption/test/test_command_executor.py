@@ -14,4 +14,14 @@ class TestCommandExecutor(unittest.TestCase):
 
     def test_command_no_timeout(self):
         return_code = self.cmd_executor.Execute('sleep 5', timeout=10)
-        self.assertEqual(return_code, 0, msg="The command should have completed successfully")
\ No newline at end of file
+        self.assertEqual(return_code, 0, msg="The command should have completed successfully")
+
+    def test_counts_processes_per_program(self):
+        CommandExecutor.reset_counters()
+        self.cmd_executor.Execute('true')
+        self.cmd_executor.Execute('true')
+        self.cmd_executor.Execute('sleep 0')
+        counters = CommandExecutor.get_counters()
+        self.assertEqual(counters['true'][0], 2)
+        self.assertEqual(counters['sleep'][0], 1)
+        self.assertTrue(counters['sleep'][1] >= 0)
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 import mock
 
@@ -280,3 +283,35 @@ class TestDiskUtil(unittest.TestCase):
         self.assertTrue("\n/dev/mapper/mapper_name2 /mnt/point2 ext4 defaults,nofail 0 0" in open_mock.content_dict["/etc/fstab"])
         self.assertTrue("\nmapper_name /dev/dev_path /test_passphrase_path" in open_mock.content_dict["/etc/crypttab"])
         self.assertTrue("\nmapper_name2 /dev/dev_path2 /test_passphrase_path" in open_mock.content_dict["/etc/crypttab"])
+
+    def test_load_device_properties_batches_queries(self):
+        sys_class_block = tempfile.mkdtemp()
+        try:
+            for kernel_name, majmin, sectors in [('sdc', '8:32', '2048'), ('sdc1', '8:33', '1024'), ('dm-0', '253:0', '1000')]:
+                os.makedirs(os.path.join(sys_class_block, kernel_name))
+                with open(os.path.join(sys_class_block, kernel_name, 'dev'), 'w') as f:
+                    f.write(majmin + '\n')
+                with open(os.path.join(sys_class_block, kernel_name, 'size'), 'w') as f:
+                    f.write(sectors + '\n')
+            os.makedirs(os.path.join(sys_class_block, 'dm-0', 'dm'))
+            with open(os.path.join(sys_class_block, 'dm-0', 'dm', 'name'), 'w') as f:
+                f.write('datavol\n')
+
+            def execute(command, communicator=None, **kwargs):
+                communicator.stdout = "DEVNAME=/dev/sdc1\nUUID=1234\nTYPE=ext4\nLABEL=data\n\nDEVNAME=/dev/sdc\nPTTYPE=gpt\n"
+                return 0
+
+            DiskUtil.reset_device_caches()
+            self.disk_util.distro_patcher.blkid_path = '/sbin/blkid'
+            with mock.patch.object(self.disk_util.command_executor, 'Execute', side_effect=execute) as execute_mock:
+                self.disk_util.load_device_properties(sys_class_block_path=sys_class_block)
+                self.assertEqual(execute_mock.call_count, 1)
+                self.assertEqual(self.disk_util.get_device_items_property('sdc1', 'FSTYPE'), 'ext4')
+                self.assertEqual(self.disk_util.get_device_items_property('sdc1', 'UUID'), '1234')
+                self.assertEqual(self.disk_util.get_device_items_property('sdc1', 'SIZE'), str(1024 * 512))
+                self.assertEqual(self.disk_util.get_device_items_property('sdc', 'FSTYPE'), '')
+                self.assertEqual(self.disk_util.get_device_items_property('datavol', 'MAJ:MIN'), '253:0')
+                self.assertEqual(execute_mock.call_count, 1)
+        finally:
+            DiskUtil.reset_device_caches()
+            shutil.rmtree(sys_class_block)
@@ -0,0 +1,69 @@
+import threading
+import unittest
+
+from main.VolumeEncryptionScheduler import VolumeEncryptionScheduler, EncryptionProgress, group_into_lanes
+from main.BlockCopyEngine import IOBudget
+from console_logger import ConsoleLogger
+
+class TestVolumeEncryptionScheduler(unittest.TestCase):
+    """ unit tests for functions in the VolumeEncryptionScheduler module """
+    def setUp(self):
+        self.logger = ConsoleLogger()
+
+    def test_group_into_lanes_merges_shared_disks(self):
+        disks = {'sdc1': ['sdc'], 'sdd1': ['sdd'], 'sdc2': ['sdc'], 'lv': ['sdd', 'sde'], 'sde1': ['sde'], 'sdf1': ['sdf']}
+        lanes = group_into_lanes(['sdc1', 'sdd1', 'sdc2', 'lv', 'sde1', 'sdf1'], lambda item: disks[item])
+        self.assertEqual(lanes, [['sdc1', 'sdc2'], ['sdd1', 'lv', 'sde1'], ['sdf1']])
+
+    def test_run_keeps_lane_order_and_stops_lane_on_failure(self):
+        encrypted = []
+        lock = threading.Lock()
+
+        def encrypt(item):
+            with lock:
+                encrypted.append(item)
+            return item != 'b1'
+
+        scheduler = VolumeEncryptionScheduler(self.logger, 2)
+        failed_items = scheduler.run([['a1', 'a2'], ['b1', 'b2'], ['c1']], encrypt)
+
+        self.assertEqual(failed_items, ['b1'])
+        self.assertNotIn('b2', encrypted)
+        self.assertEqual(sorted(encrypted), ['a1', 'a2', 'b1', 'c1'])
+        self.assertLess(encrypted.index('a1'), encrypted.index('a2'))
+
+    def test_run_treats_exception_as_failure(self):
+        def encrypt(item):
+            raise Exception("copy failed")
+
+        scheduler = VolumeEncryptionScheduler(self.logger, 4)
+        self.assertEqual(scheduler.run([['a1', 'a2']], encrypt), ['a1'])
+
+    def test_progress_reports_changed_messages(self):
+        messages = []
+        progress = EncryptionProgress(messages.append, 2)
+        progress.update('sdc1', 1, 2)
+        progress.update('sdc1', 1, 2)
+        progress.finish('sdc1')
+        progress.update('sdd1', 1, 2)
+
+        self.assertEqual(messages, ["Encrypting data volumes, 0/2 done: 25%",
+                                    "Encrypting data volumes, 1/2 done: 50%",
+                                    "Encrypting data volumes, 1/2 done: 75%"])
+
+    def test_io_budget_waits_for_tokens(self):
+        now = [100.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        io_budget = IOBudget(1000, clock=lambda: now[0], sleep=sleep)
+        io_budget.consume(1000)
+        io_budget.consume(500)
+        self.assertEqual(sleeps, [0.5])
+
+        unthrottled = IOBudget(0, clock=lambda: now[0], sleep=sleep)
+        unthrottled.consume(10 ** 9)
+        self.assertEqual(sleeps, [0.5])